@@ -6,3 +6,4 @@ pip install -r requirements.txt
 
 python cesfamProyecto/manage.py collectstatic --no-input
 python cesfamProyecto/manage.py migrate
+python cesfamProyecto/manage.py regenerar_agenda
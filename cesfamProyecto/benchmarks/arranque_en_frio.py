@@ -0,0 +1,162 @@
+"""
+Tiempo hasta el primer byte (TTFB) de un worker recién iniciado, con y sin precalentar.
+
+Cada medición corre en un intérprete nuevo, como un worker de gunicorn recién
+creado: carga la aplicación WSGI, ejecuta (o no) `precalentamiento.precalentar`,
+como hace el hook `post_worker_init` de `gunicorn.conf.py`, y luego pide una vez
+cada URL (panel, paso 3 del agendamiento y la API) midiendo cuánto tarda en
+tener la respuesta, y una segunda vez para comparar con un worker ya caliente.
+Las requests pasan por el handler de Django con todos los middlewares, sin red.
+El caché es el de memoria de cada proceso, así que ningún worker aprovecha lo
+que dejó otro.
+
+Por defecto usa una base SQLite temporal. Para probar contra PostgreSQL,
+pasar la URL de una base de datos DESECHABLE (se ejecutan las migraciones y se
+crean datos de prueba):
+    python benchmarks/arranque_en_frio.py --database-url postgres://...
+
+Uso (desde la carpeta que contiene manage.py):
+    python benchmarks/arranque_en_frio.py --repeticiones 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODOS = ('frio', 'precalentado')
+
+
+def configurar_django(database_url):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['ALLOWED_HOSTS'] = 'testserver'
+    # Caché en memoria del proceso: un caché compartido haría que un worker aprovechara el de otro
+    os.environ.pop('DJANGO_CACHE_DIR', None)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cesfamProyecto.settings')
+    os.environ.setdefault('DB_CONN_MAX_AGE', '60')
+
+
+def mediana(valores):
+    """Mediana en milisegundos."""
+    return 1000 * statistics.median(valores)
+
+
+def urls(profesional_id, servicio_id):
+    return (
+        ('dashboard', '/dashboard/', {}),
+        ('paso3', f'/agendar/horario/{profesional_id}/{servicio_id}/', {}),
+        ('api raiz', '/api/', {'HTTP_ACCEPT': 'text/html'}),
+        ('api servicios', '/api/servicios/', {'HTTP_ACCEPT': 'application/json'}),
+    )
+
+
+def worker(args):
+    """Un worker nuevo: carga la aplicación, precalienta según el modo y mide la primera y la segunda request."""
+    configurar_django(args.database_url)
+    inicio = time.perf_counter()
+    from cesfamProyecto.wsgi import application  # noqa: F401 (carga Django como lo hace gunicorn)
+    carga = time.perf_counter() - inicio
+
+    precalentar = 0.0
+    if args.hijo == 'precalentado':
+        from cesfamApp import precalentamiento
+        inicio = time.perf_counter()
+        precalentamiento.precalentar()
+        precalentar = time.perf_counter() - inicio
+
+    from django.conf import settings
+    from django.test import Client
+
+    cliente = Client()
+    cliente.cookies[settings.SESSION_COOKIE_NAME] = args.sesion
+    tiempos = {}
+    for nombre, url, cabeceras in urls(args.profesional, args.servicio):
+        medidas = []
+        for _ in range(2):
+            inicio = time.perf_counter()
+            respuesta = cliente.get(url, **cabeceras)
+            medidas.append(time.perf_counter() - inicio)
+            assert respuesta.status_code == 200, (url, respuesta.status_code)
+        tiempos[nombre] = medidas
+    print(json.dumps({'carga': carga, 'precalentar': precalentar, 'tiempos': tiempos}))
+
+
+def preparar_datos():
+    """Paciente con sesión abierta, un profesional con horario y un servicio; devuelve los ids y la sesión."""
+    from datetime import time as hora
+
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.test import Client
+
+    from cesfamApp.models import Anuncio, Horario, Notificacion, Servicio
+
+    User = get_user_model()
+    call_command('migrate', verbosity=0)
+    prefijo = f'frio_{time.time_ns()}'
+    paciente = User.objects.create_user(username=f'{prefijo}_pac', password='benchmark', rol=User.ROL_PACIENTE)
+    profesional = User.objects.create_user(username=f'{prefijo}_prof', password='benchmark', rol=User.ROL_PROFESIONAL)
+    servicio = Servicio.objects.create(nombre=f'Servicio {prefijo}', tipo='Benchmark', descripcion='Benchmark')
+    servicio.profesionales.add(profesional)
+    for dia in range(5):
+        Horario.objects.create(profesional=profesional, dia=dia, hora_inicio=hora(8, 0), hora_fin=hora(17, 0))
+    Anuncio.objects.create(titulo='Benchmark', contenido='Arranque en frío')
+    Notificacion.objects.create(destinatario=paciente, mensaje='Benchmark')
+    cliente = Client()
+    cliente.force_login(paciente)
+    return profesional.pk, servicio.pk, cliente.cookies[settings.SESSION_COOKIE_NAME].value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeticiones', type=int, default=5, help='Workers nuevos por modo.')
+    parser.add_argument('--database-url', help='Base de datos desechable a usar en vez de SQLite temporal.')
+    # Uso interno: el proceso que hace de worker
+    parser.add_argument('--hijo', choices=MODOS, help=argparse.SUPPRESS)
+    parser.add_argument('--sesion', help=argparse.SUPPRESS)
+    parser.add_argument('--profesional', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--servicio', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        return worker(args)
+
+    args.database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'frio.sqlite3')
+    configurar_django(args.database_url)
+    profesional, servicio, sesion = preparar_datos()
+
+    resultados = {modo: [] for modo in MODOS}
+    for _ in range(args.repeticiones):
+        # Alternados, para que el disco o la CPU no favorezcan a un modo
+        for modo in MODOS:
+            salida = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--hijo', modo, '--database-url', args.database_url,
+                 '--sesion', sesion, '--profesional', str(profesional), '--servicio', str(servicio)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            resultados[modo].append(json.loads(salida.strip().splitlines()[-1]))
+
+    nombres = [nombre for nombre, _, _ in urls(profesional, servicio)]
+    print(f'motor: {args.database_url.split(":")[0]}, mediana de {args.repeticiones} workers por modo (ms)')
+    print(f"{'modo':>13} {'carga':>7} {'precal.':>8} " + ' '.join(f'{nombre:>14}' for nombre in nombres)
+          + f" {'total 1a':>9} {'total 2a':>9}")
+    for modo in MODOS:
+        filas = resultados[modo]
+        primeras = [mediana([fila['tiempos'][nombre][0] for fila in filas]) for nombre in nombres]
+        total_primera = mediana([sum(fila['tiempos'][nombre][0] for nombre in nombres) for fila in filas])
+        total_segunda = mediana([sum(fila['tiempos'][nombre][1] for nombre in nombres) for fila in filas])
+        print(f"{modo:>13} {mediana([fila['carga'] for fila in filas]):>7.0f} "
+              f"{mediana([fila['precalentar'] for fila in filas]):>8.0f} "
+              + ' '.join(f'{valor:>14.1f}' for valor in primeras) + f' {total_primera:>9.1f} {total_segunda:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
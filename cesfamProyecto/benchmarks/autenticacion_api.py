@@ -0,0 +1,107 @@
+"""
+Costo de autenticar cada request de la API: sesión contra JWT.
+
+Hace las mismas requests autenticado con sesión (cookie, como el frontend
+web) y con un access token (`Authorization: Bearer`, ver cesfamApp.tokens),
+y muestra por endpoint las consultas por request, cuántas de ellas son de
+autenticación (tabla de sesiones y de usuarios) y requests por segundo. Con
+sesión cada request lee la sesión y luego al usuario; con JWT el usuario y su
+rol salen del token firmado.
+
+Por defecto usa una base SQLite temporal. Para probar contra PostgreSQL,
+pasar la URL de una base de datos DESECHABLE (se ejecutan las migraciones y se
+crean datos de prueba):
+    python benchmarks/autenticacion_api.py --database-url postgres://...
+
+Uso (desde la carpeta que contiene manage.py):
+    python benchmarks/autenticacion_api.py --requests 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configurar_django(database_url):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['ALLOWED_HOSTS'] = 'testserver'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cesfamProyecto.settings')
+    import django
+    django.setup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=500, help='Requests por endpoint y modo de autenticación.')
+    parser.add_argument('--citas', type=int, default=200, help='Citas del profesional de prueba.')
+    parser.add_argument('--database-url', help='Base de datos desechable a usar en vez de SQLite temporal.')
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    configurar_django(args.database_url or 'sqlite:///' + os.path.join(directorio, 'autenticacion.sqlite3'))
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from django.utils import timezone
+    from rest_framework.test import APIClient
+
+    from cesfamApp.models import Cesfam, Cita, Conversation, Servicio
+
+    User = get_user_model()
+    call_command('migrate', verbosity=0)
+
+    prefijo = f'auth_{time.time_ns()}'
+    profesional = User.objects.create_user(
+        username=f'{prefijo}_prof', email=f'{prefijo}@correo.cl', password='benchmark', rol=User.ROL_PROFESIONAL,
+    )
+    paciente = User.objects.create_user(username=f'{prefijo}_pac', password='benchmark')
+    cesfam = Cesfam.objects.create(nombre=f'Cesfam {prefijo}', direccion='Benchmark', telefono='0')
+    servicio = Servicio.objects.create(nombre=f'Servicio {prefijo}', tipo='Benchmark', descripcion='Benchmark')
+    inicio = timezone.now().replace(microsecond=0) + timedelta(days=365)
+    Cita.objects.bulk_create(
+        Cita(fecha_hora=inicio + timedelta(minutes=30 * i), paciente=paciente, profesional=profesional,
+             cesfam=cesfam, servicio=servicio)
+        for i in range(args.citas)
+    )
+    conversacion = Conversation.objects.create(topic='Benchmark')
+    conversacion.participants.add(profesional, paciente)
+
+    sesion = APIClient()
+    assert sesion.login(username=profesional.username, password='benchmark')
+    token = APIClient()
+    respuesta = token.post('/api/token/', {'identificador': profesional.email, 'password': 'benchmark'}, format='json')
+    assert respuesta.status_code == 200, respuesta.status_code
+    token.credentials(HTTP_AUTHORIZATION=f"Bearer {respuesta.data['access']}")
+
+    endpoints = (
+        ('citas', f'/api/citas/?profesional={profesional.pk}&limit=20'),
+        ('conversaciones', '/api/conversations/'),
+        ('mensajes', f'/api/conversations/{conversacion.pk}/messages/'),
+    )
+    # La consulta con que la autenticación por sesión carga al usuario (no los joins de los endpoints)
+    carga_usuario = f'FROM "{User._meta.db_table}" WHERE "{User._meta.db_table}"."id" ='
+    print(f'motor: {connection.vendor}')
+    print(f"{'endpoint':>15} {'modo':>7} {'consultas':>10} {'de auth':>8} {'req/s':>8}")
+    for nombre, url in endpoints:
+        for modo, cliente in (('sesion', sesion), ('jwt', token)):
+            with CaptureQueriesContext(connection) as consultas:
+                respuesta = cliente.get(url)
+            assert respuesta.status_code == 200, (url, modo, respuesta.status_code)
+            # Se cuentan antes del ciclo: el registro de consultas tiene largo máximo y se desplaza
+            sql = [consulta['sql'] for consulta in consultas]
+            de_auth = sum(1 for texto in sql if 'django_session' in texto or carga_usuario in texto)
+            comienzo = time.perf_counter()
+            for _ in range(args.requests):
+                cliente.get(url)
+            segundos = time.perf_counter() - comienzo
+            print(f'{nombre:>15} {modo:>7} {len(sql):>10} {de_auth:>8} {args.requests / segundos:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Microbenchmark del motor de disponibilidad (cesfamApp.disponibilidad).
+
+Compara el algoritmo anterior (búsqueda lineal de cada bloque en la lista de
+citas) con `calcular_slots_libres` para horizontes de hasta 90 días y cientos
+de citas por profesional. No usa la base de datos.
+
+Uso (desde la carpeta que contiene manage.py):
+    python benchmarks/bench_disponibilidad.py
+"""
+import os
+import random
+import sys
+import timeit
+from datetime import date, datetime, time, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cesfamProyecto.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.utils import timezone  # noqa: E402
+
+from cesfamApp.disponibilidad import DURACION_CITA, agrupar_bloques, calcular_slots_libres  # noqa: E402
+
+TZ = timezone.get_current_timezone()
+INICIO = date(2030, 1, 7)
+AHORA = datetime.combine(INICIO, time(0, 0), tzinfo=TZ)
+
+# Lunes a viernes de 8:00 a 17:00 (un bloque por día, que es lo único que
+# soportaba el algoritmo anterior)
+BLOQUES = [(dia, time(8, 0), time(17, 0)) for dia in range(5)]
+
+
+def algoritmo_anterior(bloques, citas, fecha_inicio, dias):
+    """Copia del bucle que tenían las vistas antes del motor de disponibilidad."""
+    horarios_dict = {dia: (inicio, fin) for dia, inicio, fin in bloques}
+    libres = []
+    for i in range(dias):
+        current_date = fecha_inicio + timedelta(days=i)
+        if current_date.weekday() in horarios_dict:
+            hora_inicio, hora_fin = horarios_dict[current_date.weekday()]
+            current_slot = datetime.combine(current_date, hora_inicio, tzinfo=TZ)
+            hora_fin_dt = datetime.combine(current_date, hora_fin, tzinfo=TZ)
+            while current_slot < hora_fin_dt:
+                if current_slot > AHORA and current_slot not in citas:
+                    libres.append(current_slot)
+                current_slot += DURACION_CITA
+    return libres
+
+
+def generar_citas(total, dias):
+    posibles = calcular_slots_libres(agrupar_bloques(BLOQUES), [], INICIO, INICIO + timedelta(days=dias - 1), ahora=AHORA, tz=TZ)
+    return sorted(random.Random(42).sample(posibles, min(total, len(posibles))))
+
+
+def medir(funcion, repeticiones):
+    return min(timeit.repeat(funcion, number=1, repeat=repeticiones)) * 1000
+
+
+def main():
+    print(f"{'días':>5} {'citas':>6} {'slots':>6} {'anterior (ms)':>14} {'motor (ms)':>11} {'speedup':>8}")
+    for dias in (14, 30, 90):
+        for total_citas in (100, 300, 600):
+            citas = generar_citas(total_citas, dias)
+            bloques_por_dia = agrupar_bloques(BLOQUES)
+            fecha_fin = INICIO + timedelta(days=dias - 1)
+
+            nuevo = lambda: calcular_slots_libres(bloques_por_dia, citas, INICIO, fecha_fin, ahora=AHORA, tz=TZ)  # noqa: E731
+            anterior = lambda: algoritmo_anterior(BLOQUES, citas, INICIO, dias)  # noqa: E731
+
+            assert nuevo() == anterior(), "El motor no coincide con el algoritmo anterior"
+            slots = len(nuevo())
+            t_anterior = medir(anterior, 5)
+            t_nuevo = medir(nuevo, 5)
+            print(f"{dias:>5} {len(citas):>6} {slots:>6} {t_anterior:>14.2f} {t_nuevo:>11.2f} {t_anterior / t_nuevo:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
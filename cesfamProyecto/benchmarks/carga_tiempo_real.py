@@ -0,0 +1,200 @@
+"""
+Prueba de carga de la mensajería en tiempo real (cesfamApp.tiempo_real).
+
+Abre cientos de conexiones SSE simultáneas a `/mensajeria/eventos/`, cada una
+de un usuario distinto con su propia conversación, y las deja inactivas para
+medir la memoria que ocupa cada conexión (Python con tracemalloc y RSS del
+proceso). Luego envía un mensaje a cada conversación y mide cuánto tarda en
+llegar a su conexión.
+
+Las conexiones se hacen directamente contra la aplicación ASGI del proyecto
+(`cesfamProyecto.asgi`) dentro del mismo proceso, sin servidor HTTP de por
+medio, así que la memoria medida es la de Django y el canal, no la de los
+sockets del servidor.
+
+Uso (desde la carpeta que contiene manage.py):
+    python benchmarks/carga_tiempo_real.py --conexiones 500
+"""
+import argparse
+import asyncio
+import gc
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configurar_django(database_url):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['ALLOWED_HOSTS'] = 'testserver'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cesfamProyecto.settings')
+    import django
+    from django.conf import settings
+    django.setup()
+    if settings.DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        settings.DATABASES['default'].setdefault('OPTIONS', {})['timeout'] = 60
+
+
+def rss_kb():
+    """Memoria residente del proceso en KB (Linux); `None` si no se puede leer."""
+    try:
+        with open('/proc/self/status') as status:
+            for linea in status:
+                if linea.startswith('VmRSS:'):
+                    return int(linea.split()[1])
+    except OSError:
+        return None
+
+
+class Conexion:
+    """Cliente ASGI mínimo de una petición GET que lee el flujo hasta que se le pide cortar."""
+
+    def __init__(self, aplicacion, cookie, puerto):
+        self.aplicacion = aplicacion
+        self.scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+            'method': 'GET', 'path': '/mensajeria/eventos/', 'raw_path': b'/mensajeria/eventos/', 'query_string': b'',
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode()), (b'accept', b'text/event-stream')],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', puerto),
+        }
+        self.estado = None
+        self.conectada = asyncio.Event()
+        self.recibido = asyncio.Event()
+        self.recibido_en = None
+        self._pedido_enviado = False
+        self._cortar = asyncio.Event()
+
+    async def _receive(self):
+        if not self._pedido_enviado:
+            self._pedido_enviado = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self._cortar.wait()
+        return {'type': 'http.disconnect'}
+
+    async def _send(self, mensaje):
+        if mensaje['type'] == 'http.response.start':
+            self.estado = mensaje['status']
+            if self.estado != 200:
+                self.conectada.set()
+        elif mensaje['type'] == 'http.response.body':
+            cuerpo = mensaje.get('body', b'')
+            if cuerpo.startswith(b'retry:'):
+                self.conectada.set()
+            elif b'event: message' in cuerpo and not self.recibido.is_set():
+                self.recibido_en = time.perf_counter()
+                self.recibido.set()
+
+    async def correr(self):
+        await self.aplicacion(self.scope, self._receive, self._send)
+
+    def cortar(self):
+        self._cortar.set()
+
+
+async def abrir(aplicacion, cookies):
+    conexiones = [Conexion(aplicacion, cookie, 10000 + i) for i, cookie in enumerate(cookies)]
+    tareas = [asyncio.create_task(conexion.correr()) for conexion in conexiones]
+    await asyncio.wait_for(asyncio.gather(*(c.conectada.wait() for c in conexiones)), 120)
+    fallidas = [c.estado for c in conexiones if c.estado != 200]
+    if fallidas:
+        raise SystemExit(f'{len(fallidas)} conexiones fallaron (estados: {sorted(set(fallidas))})')
+    return conexiones, tareas
+
+
+async def ejecutar(args, cookies, conversaciones, profesional):
+    from asgiref.sync import sync_to_async
+    from django.core.asgi import get_asgi_application
+
+    from cesfamApp import tiempo_real
+    from cesfamApp.models import Message
+
+    aplicacion = get_asgi_application()
+    # Una conexión de calentamiento para que los imports y cachés perezosos no cuenten como memoria por conexión
+    calentamiento, tareas = await abrir(aplicacion, cookies[:1])
+    calentamiento[0].cortar()
+    await asyncio.gather(*tareas)
+
+    gc.collect()
+    tracemalloc.start()
+    python_antes = tracemalloc.get_traced_memory()[0]
+    rss_antes = rss_kb()
+    inicio = time.perf_counter()
+    conexiones, tareas = await abrir(aplicacion, cookies)
+    segundos_apertura = time.perf_counter() - inicio
+    await asyncio.sleep(args.inactividad)
+    gc.collect()
+    python_despues = tracemalloc.get_traced_memory()[0]
+    rss_despues = rss_kb()
+    tracemalloc.stop()
+
+    n = len(conexiones)
+    print(f'conexiones abiertas:       {tiempo_real.canal.conexiones()} (en {segundos_apertura:.2f} s)')
+    print(f'memoria Python/conexión:   {(python_despues - python_antes) / n / 1024:.1f} KB')
+    if rss_antes is not None:
+        print(f'RSS/conexión:              {(rss_despues - rss_antes) / n:.1f} KB '
+              f'(RSS total {rss_despues / 1024:.1f} MB)')
+
+    # Un mensaje nuevo en cada conversación; se mide cuánto tarda en llegar a su conexión
+    enviados = []
+
+    def enviar():
+        for conversacion in conversaciones:
+            enviados.append(time.perf_counter())
+            Message.objects.create(conversation=conversacion, sender=profesional, content='Hola')
+
+    inicio = time.perf_counter()
+    await sync_to_async(enviar)()
+    await asyncio.wait_for(asyncio.gather(*(c.recibido.wait() for c in conexiones)), 120)
+    latencias = sorted((c.recibido_en - enviado) * 1000 for c, enviado in zip(conexiones, enviados))
+    print(f'mensajes entregados:       {n} en {time.perf_counter() - inicio:.2f} s')
+    print(f'latencia p50 / p95 / máx:  {statistics.median(latencias):.1f} / '
+          f'{latencias[int(0.95 * (n - 1))]:.1f} / {latencias[-1]:.1f} ms')
+
+    for conexion in conexiones:
+        conexion.cortar()
+    await asyncio.gather(*tareas)
+    assert tiempo_real.canal.conexiones() == 0, 'Quedaron suscripciones sin liberar'
+    print('OK: todas las conexiones recibieron su mensaje y se liberaron al cerrar.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--conexiones', type=int, default=500, help='Cantidad de conexiones SSE simultáneas.')
+    parser.add_argument('--inactividad', type=float, default=2.0, help='Segundos que quedan inactivas antes de medir.')
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    configurar_django('sqlite:///' + os.path.join(directorio, 'tiempo_real.sqlite3'))
+
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.test import Client
+
+    from cesfamApp.models import Conversation
+
+    User = get_user_model()
+    call_command('migrate', verbosity=0)
+
+    profesional = User.objects.create(username='prof_tiempo_real', rol=User.ROL_PROFESIONAL)
+    pacientes = User.objects.bulk_create(
+        User(username=f'pac_tiempo_real_{i}', rol=User.ROL_PACIENTE) for i in range(args.conexiones)
+    )
+    cookies, conversaciones = [], []
+    for paciente in pacientes:
+        conversacion = Conversation.objects.create(topic=f'Carga {paciente.pk}')
+        conversacion.participants.add(paciente, profesional)
+        conversaciones.append(conversacion)
+        cliente = Client()
+        cliente.force_login(paciente)
+        cookies.append(f'{settings.SESSION_COOKIE_NAME}={cliente.cookies[settings.SESSION_COOKIE_NAME].value}')
+
+    asyncio.run(ejecutar(args, cookies, conversaciones, profesional))
+
+
+if __name__ == '__main__':
+    main()
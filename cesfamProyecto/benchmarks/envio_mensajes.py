@@ -0,0 +1,127 @@
+"""
+Rendimiento del envío de mensajes (cesfamApp.envios).
+
+Envía mensajes seguidos a un conjunto de conversaciones, primero llamando
+directamente a `enviar_mensaje` y luego a través del endpoint
+`POST /api/conversations/<id>/messages/`, y muestra mensajes por segundo y
+consultas por mensaje. Con `--hilos` mayor que 1 los envíos se reparten entre
+hilos, cada uno con su conexión, para ver cómo escala con escrituras
+concurrentes (SQLite las serializa; PostgreSQL no).
+
+Por defecto usa una base SQLite temporal. Para probar contra PostgreSQL,
+pasar la URL de una base de datos DESECHABLE (se ejecutan las migraciones y se
+crean datos de prueba):
+    python benchmarks/envio_mensajes.py --database-url postgres://...
+
+Uso (desde la carpeta que contiene manage.py):
+    python benchmarks/envio_mensajes.py --mensajes 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configurar_django(database_url):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['ALLOWED_HOSTS'] = 'testserver'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cesfamProyecto.settings')
+    import django
+    from django.conf import settings
+    django.setup()
+    if settings.DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        # SQLite serializa las escrituras: se da tiempo suficiente a cada hilo para obtener el lock
+        settings.DATABASES['default'].setdefault('OPTIONS', {})['timeout'] = 60
+
+
+def repartir(mensajes, hilos, enviar):
+    """Ejecuta `enviar(i)` para i en 0..mensajes-1 repartido entre `hilos`; devuelve los segundos."""
+    from django.db import connection
+
+    def trabajar(desde):
+        try:
+            for i in range(desde, mensajes, hilos):
+                enviar(i)
+        finally:
+            connection.close()
+
+    trabajadores = [threading.Thread(target=trabajar, args=(desde,)) for desde in range(hilos)]
+    inicio = time.perf_counter()
+    for trabajador in trabajadores:
+        trabajador.start()
+    for trabajador in trabajadores:
+        trabajador.join()
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mensajes', type=int, default=2000, help='Mensajes a enviar por cada ruta.')
+    parser.add_argument('--conversaciones', type=int, default=50, help='Conversaciones entre las que se reparten.')
+    parser.add_argument('--participantes', type=int, default=2, help='Participantes por conversación.')
+    parser.add_argument('--hilos', type=int, default=1, help='Hilos que envían en paralelo.')
+    parser.add_argument('--database-url', help='Base de datos desechable a usar en vez de SQLite temporal.')
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    configurar_django(args.database_url or 'sqlite:///' + os.path.join(directorio, 'envio.sqlite3'))
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIClient
+
+    from cesfamApp import envios
+    from cesfamApp.models import Conversation, Message
+
+    User = get_user_model()
+    call_command('migrate', verbosity=0)
+
+    prefijo = f'envio_{time.time_ns()}'
+    usuarios = User.objects.bulk_create(
+        User(username=f'{prefijo}_{i}', rol=User.ROL_PACIENTE) for i in range(args.participantes)
+    )
+    if usuarios[0].pk is None:
+        usuarios = list(User.objects.filter(username__startswith=prefijo).order_by('id'))
+    remitente = usuarios[0]
+    conversaciones = []
+    for i in range(args.conversaciones):
+        conversacion = Conversation.objects.create(topic=f'Benchmark {i}')
+        conversacion.participants.add(*usuarios)
+        conversaciones.append(conversacion.pk)
+
+    with CaptureQueriesContext(connection) as consultas:
+        envios.enviar_mensaje(conversaciones[0], remitente, 'Calentamiento')
+    print(f'motor: {connection.vendor}, consultas por mensaje: {len(consultas)}')
+    connection.close()
+
+    def por_servicio(i):
+        envios.enviar_mensaje(conversaciones[i % len(conversaciones)], remitente, f'Mensaje {i}')
+
+    clientes = threading.local()
+
+    def por_api(i):
+        if not hasattr(clientes, 'cliente'):
+            clientes.cliente = APIClient()
+            clientes.cliente.force_authenticate(user=remitente)
+        conversacion = conversaciones[i % len(conversaciones)]
+        respuesta = clientes.cliente.post(f'/api/conversations/{conversacion}/messages/', {'content': f'Mensaje {i}'}, format='json')
+        assert respuesta.status_code == 201, respuesta.status_code
+
+    print(f"{'ruta':>9} {'hilos':>6} {'mensajes':>9} {'seg':>7} {'mensajes/s':>11}")
+    for nombre, enviar in (('servicio', por_servicio), ('api', por_api)):
+        segundos = repartir(args.mensajes, args.hilos, enviar)
+        print(f'{nombre:>9} {args.hilos:>6} {args.mensajes:>9} {segundos:>7.2f} {args.mensajes / segundos:>11.1f}')
+
+    total = Message.objects.filter(sender=remitente).count()
+    assert total == 2 * args.mensajes + 1, f'Se esperaban {2 * args.mensajes + 1} mensajes, hay {total}'
+    print('OK: todos los mensajes quedaron guardados.')
+
+
+if __name__ == '__main__':
+    main()
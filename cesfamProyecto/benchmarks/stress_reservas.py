@@ -0,0 +1,114 @@
+"""
+Prueba de contención del servicio de reservas (cesfamApp.reservas).
+
+Lanza cientos de hilos que intentan reservar el MISMO bloque del mismo
+profesional al mismo tiempo y verifica que exactamente una reserva gana.
+Muestra el rendimiento en reservas intentadas por segundo.
+
+Por defecto usa una base SQLite temporal. Para probar contra PostgreSQL,
+pasar la URL de una base de datos DESECHABLE (se ejecutan las migraciones y se
+crean datos de prueba):
+    python benchmarks/stress_reservas.py --hilos 300 --database-url postgres://...
+
+Uso (desde la carpeta que contiene manage.py):
+    python benchmarks/stress_reservas.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configurar_django(database_url):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cesfamProyecto.settings')
+    import django
+    from django.conf import settings
+    django.setup()
+    if settings.DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        # SQLite serializa las escrituras: se da tiempo suficiente a cada hilo para obtener el lock
+        settings.DATABASES['default'].setdefault('OPTIONS', {})['timeout'] = 60
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--hilos', type=int, default=200, help='Cantidad de reservas simultáneas.')
+    parser.add_argument('--rondas', type=int, default=3, help='Cantidad de bloques distintos a disputar.')
+    parser.add_argument('--database-url', help='Base de datos desechable a usar en vez de SQLite temporal.')
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    configurar_django(args.database_url or 'sqlite:///' + os.path.join(directorio, 'stress.sqlite3'))
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.db import connection
+    from django.utils import timezone
+
+    from cesfamApp import reservas
+    from cesfamApp.models import Cesfam, Cita, Servicio
+
+    User = get_user_model()
+    call_command('migrate', verbosity=0)
+
+    cesfam = Cesfam.objects.create(nombre='Cesfam Stress', direccion='Calle 1', telefono='123')
+    servicio = Servicio.objects.create(nombre='Stress', tipo='Test', descripcion='Prueba de contención')
+    profesional = User.objects.create(username=f'prof_stress_{time.time_ns()}', rol=User.ROL_PROFESIONAL)
+    pacientes = User.objects.bulk_create(
+        User(username=f'pac_stress_{time.time_ns()}_{i}', rol=User.ROL_PACIENTE) for i in range(args.hilos)
+    )
+    if pacientes[0].pk is None:
+        pacientes = list(User.objects.filter(rol=User.ROL_PACIENTE, username__startswith='pac_stress_').order_by('-id')[:args.hilos])
+    connection.close()
+
+    base = (timezone.now() + timedelta(days=7)).replace(minute=0, second=0, microsecond=0)
+    print(f"{'ronda':>5} {'hilos':>6} {'ganadas':>8} {'ocupado':>8} {'otros':>6} {'seg':>7} {'reservas/s':>11}")
+    for ronda in range(args.rondas):
+        fecha_hora = base + timedelta(minutes=30 * ronda)
+        barrera = threading.Barrier(args.hilos)
+        resultados = Counter()
+        lock = threading.Lock()
+
+        def reservar(paciente):
+            barrera.wait()
+            try:
+                reservas.reservar_cita(paciente, profesional, servicio, fecha_hora, cesfam=cesfam)
+                resultado = 'ganada'
+            except reservas.HorarioNoDisponible:
+                resultado = 'ocupado'
+            except Exception as e:  # Errores de la base (p. ej. locks) se reportan aparte
+                resultado = type(e).__name__
+            finally:
+                connection.close()
+            with lock:
+                resultados[resultado] += 1
+
+        hilos = [threading.Thread(target=reservar, args=(paciente,)) for paciente in pacientes]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        segundos = time.perf_counter() - inicio
+
+        otros = sum(total for resultado, total in resultados.items() if resultado not in ('ganada', 'ocupado'))
+        print(f"{ronda:>5} {args.hilos:>6} {resultados['ganada']:>8} {resultados['ocupado']:>8} {otros:>6} "
+              f"{segundos:>7.2f} {args.hilos / segundos:>11.1f}")
+        if otros:
+            print(f"      errores: {dict((k, v) for k, v in resultados.items() if k not in ('ganada', 'ocupado'))}")
+
+        citas = Cita.objects.filter(profesional=profesional, fecha_hora=fecha_hora).count()
+        assert resultados['ganada'] == 1, f"Se esperaba exactamente una reserva ganadora, hubo {resultados['ganada']}"
+        assert citas == 1, f"Se esperaba exactamente una cita en la base, hay {citas}"
+
+    print('OK: en cada ronda exactamente una reserva ganó el bloque.')
+
+
+if __name__ == '__main__':
+    main()
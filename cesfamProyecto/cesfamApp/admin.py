@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, Cesfam, Servicio, Cita, Horario, Anuncio, Notificacion, Mensaje, HistorialMedico, Feedback
+from .models import CustomUser, Cesfam, Servicio, Cita, Horario, BloqueAgenda, ResumenCitas, Anuncio, Notificacion, Mensaje, HistorialMedico, Feedback
 
 # --- Admin Personalizado para el Modelo CustomUser ---
 
@@ -64,6 +64,32 @@ class HorarioAdmin(admin.ModelAdmin):
     list_filter = ('dia', 'bloqueado', 'profesional')
     search_fields = ('profesional__username',)
 
+@admin.register(BloqueAgenda)
+class BloqueAgendaAdmin(admin.ModelAdmin):
+    # Tabla materializada: se regenera con `manage.py regenerar_agenda`, no se edita a mano.
+    list_display = ('profesional', 'inicio', 'fin', 'estado')
+    list_filter = ('estado', 'profesional')
+    date_hierarchy = 'inicio'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ResumenCitas)
+class ResumenCitasAdmin(admin.ModelAdmin):
+    # Tabla de métricas: se reconstruye con `manage.py reconstruir_metricas`, no se edita a mano.
+    list_display = ('periodo', 'fecha', 'profesional', 'servicio', 'cesfam', 'total')
+    list_filter = ('periodo', 'cesfam', 'servicio')
+    date_hierarchy = 'fecha'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(Anuncio)
 class AnuncioAdmin(admin.ModelAdmin):
     list_display = ('titulo', 'publicado_por', 'fecha_publicacion')
@@ -0,0 +1,227 @@
+"""
+Mantenimiento de la agenda materializada (`BloqueAgenda`).
+
+La tabla guarda, para los próximos `HORIZONTE_DIAS` días, cada bloque de
+atención de cada profesional con su estado (libre u ocupado). Se actualiza por
+día y por profesional desde las señales de `Cita` y `Horario` (ver
+`signals.py`), y se reconstruye completa con `manage.py regenerar_agenda`.
+
+Regenerar borra los bloques de las fechas y los vuelve a insertar, así que dos
+transacciones que regeneran al mismo profesional chocarían con la restricción
+única `(profesional, inicio)`. Por eso antes de borrar se bloquea la fila del
+profesional (`SELECT ... FOR UPDATE`): la segunda espera a que la primera
+confirme y luego calcula con sus datos.
+
+Nada agrega solo el último día del horizonte: `regenerar_agenda` debe correr
+una vez al día, después de medianoche. Con cron, por ejemplo:
+
+    15 0 * * * cd /ruta/al/proyecto && python cesfamProyecto/manage.py regenerar_agenda
+
+(en Render, un Cron Job con ese comando). Si deja de correr, los últimos días
+del horizonte quedan sin bloques y se ven sin horarios; `manage.py
+verificar_agenda` los muestra como bloques faltantes.
+"""
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import disponibilidad
+from .models import BloqueAgenda, Horario
+
+HORIZONTE_DIAS = 60
+
+
+def fechas_horizonte(hoy=None):
+    """Devuelve la primera y la última fecha materializadas."""
+    hoy = hoy or timezone.localdate()
+    return hoy, hoy + timedelta(days=HORIZONTE_DIAS - 1)
+
+
+def _rangos_fechas(fechas, tz):
+    """Filtro `Q` que cubre los instantes de cada una de las fechas dadas."""
+    filtro = Q()
+    for fecha in fechas:
+        desde, hasta = disponibilidad.limites_rango(fecha, fecha, tz)
+        filtro |= Q(inicio__gte=desde, inicio__lt=hasta)
+    return filtro
+
+
+def calcular_bloques(fechas, profesional_ids=None, duracion=disponibilidad.DURACION_CITA):
+    """
+    Calcula desde cero los bloques de las fechas dadas, con una consulta para
+    `Horario` y otra para `Cita`. Si `profesional_ids` es None se calculan todos
+    los profesionales.
+
+    Devuelve un diccionario `{(profesional_id, inicio): estado}`.
+    """
+    fechas = sorted(fechas)
+    if not fechas:
+        return {}
+    tz = timezone.get_current_timezone()
+    bloques_por_profesional, citas_por_profesional = disponibilidad.cargar_agendas(
+        profesional_ids, fechas[0], fechas[-1], duracion, tz
+    )
+
+    resultado = {}
+    for profesional_id, bloques_por_dia in bloques_por_profesional.items():
+        ocupadas = citas_por_profesional.get(profesional_id, [])
+        for fecha in fechas:
+            for slot in disponibilidad.generar_slots(bloques_por_dia, fecha, fecha, duracion, tz):
+                ocupado = disponibilidad.esta_ocupado(slot, ocupadas, duracion)
+                resultado[(profesional_id, slot)] = BloqueAgenda.OCUPADO if ocupado else BloqueAgenda.LIBRE
+    return resultado
+
+
+def _crear_bloques(bloques, batch_size=1000, duracion=disponibilidad.DURACION_CITA):
+    BloqueAgenda.objects.bulk_create(
+        (
+            BloqueAgenda(profesional_id=profesional_id, inicio=inicio, fin=inicio + duracion, estado=estado)
+            for (profesional_id, inicio), estado in bloques.items()
+        ),
+        batch_size=batch_size,
+    )
+
+
+def _bloquear_profesionales(profesional_ids=None):
+    """
+    Bloquea hasta el fin de la transacción las filas de los profesionales (por
+    defecto, todos los que tienen horarios o bloques), en orden de id para que
+    dos transacciones no se bloqueen mutuamente.
+    """
+    User = get_user_model()
+    if profesional_ids is None:
+        profesionales = User.objects.filter(
+            Q(pk__in=Horario.objects.values('profesional_id')) |
+            Q(pk__in=BloqueAgenda.objects.values('profesional_id'))
+        )
+    else:
+        profesionales = User.objects.filter(pk__in=profesional_ids)
+    list(profesionales.select_for_update().order_by('pk').values_list('pk', flat=True))
+
+
+def regenerar_fechas(profesional_id, fechas, hoy=None):
+    """
+    Recalcula los bloques de un profesional para las fechas dadas que caen
+    dentro del horizonte. Es la actualización incremental que usan las señales.
+    """
+    primera, ultima = fechas_horizonte(hoy)
+    fechas = {fecha for fecha in fechas if primera <= fecha <= ultima}
+    if not fechas:
+        return
+    tz = timezone.get_current_timezone()
+    with transaction.atomic():
+        _bloquear_profesionales([profesional_id])
+        BloqueAgenda.objects.filter(_rangos_fechas(fechas, tz), profesional_id=profesional_id).delete()
+        _crear_bloques(calcular_bloques(fechas, [profesional_id]))
+
+
+def cita_modificada(profesional_id, fecha_hora, duracion=disponibilidad.DURACION_CITA):
+    """Actualiza los días cuyos bloques pueden solaparse con la cita."""
+    fechas = {timezone.localdate(fecha_hora + delta) for delta in (-duracion, timedelta(0), duracion)}
+    regenerar_fechas(profesional_id, fechas)
+
+
+def horario_modificado(profesional_id, dias):
+    """Actualiza todas las fechas del horizonte que caen en los días de la semana dados."""
+    primera, _ = fechas_horizonte()
+    fechas = [primera + timedelta(days=i) for i in range(HORIZONTE_DIAS)]
+    regenerar_fechas(profesional_id, [fecha for fecha in fechas if fecha.weekday() in dias])
+
+
+def regenerar_agenda(profesional_ids=None, hoy=None, batch_size=1000):
+    """
+    Reconstruye la agenda completa (o la de los profesionales indicados) para
+    todo el horizonte. Devuelve la cantidad de bloques creados.
+    """
+    primera, ultima = fechas_horizonte(hoy)
+    fechas = [primera + timedelta(days=i) for i in range(HORIZONTE_DIAS)]
+    with transaction.atomic():
+        # Se calcula con el bloqueo tomado, para no pisar una regeneración confirmada entre medio
+        _bloquear_profesionales(profesional_ids)
+        bloques = calcular_bloques(fechas, profesional_ids)
+        existentes = BloqueAgenda.objects.all()
+        if profesional_ids is not None:
+            existentes = existentes.filter(profesional_id__in=profesional_ids)
+        existentes.delete()
+        _crear_bloques(bloques, batch_size=batch_size)
+    return len(bloques)
+
+
+def diferencias_agenda(profesional_ids=None, hoy=None):
+    """
+    Compara la tabla materializada con un cálculo desde cero dentro del
+    horizonte. Devuelve una lista de `(profesional_id, inicio, esperado, actual)`
+    donde `esperado` o `actual` es None si el bloque falta en ese lado.
+    """
+    primera, ultima = fechas_horizonte(hoy)
+    fechas = [primera + timedelta(days=i) for i in range(HORIZONTE_DIAS)]
+    esperados = calcular_bloques(fechas, profesional_ids)
+
+    desde, hasta = disponibilidad.limites_rango(primera, ultima)
+    actuales_qs = BloqueAgenda.objects.filter(inicio__gte=desde, inicio__lt=hasta)
+    if profesional_ids is not None:
+        actuales_qs = actuales_qs.filter(profesional_id__in=profesional_ids)
+    actuales = {
+        (profesional_id, inicio): estado
+        for profesional_id, inicio, estado in actuales_qs.values_list('profesional_id', 'inicio', 'estado')
+    }
+
+    diferencias = []
+    for clave in esperados.keys() | actuales.keys():
+        esperado, actual = esperados.get(clave), actuales.get(clave)
+        if esperado != actual:
+            diferencias.append((*clave, esperado, actual))
+    return sorted(diferencias)
+
+
+def horarios_disponibles(profesional, fecha_inicio, fecha_fin, ahora=None):
+    """
+    Devuelve los bloques libres de un profesional entre dos fechas (incluidas)
+    con una sola consulta sobre `BloqueAgenda`. Si el rango termina fuera del
+    horizonte materializado, se calcula con el motor de disponibilidad.
+    """
+    ahora = ahora or timezone.now()
+    primera, ultima = fechas_horizonte(timezone.localdate(ahora))
+    if fecha_fin > ultima:
+        return disponibilidad.horarios_disponibles(profesional, fecha_inicio, fecha_fin, ahora=ahora)
+
+    desde, hasta = disponibilidad.limites_rango(max(fecha_inicio, primera), fecha_fin)
+    inicios = BloqueAgenda.objects.filter(
+        profesional=profesional,
+        estado=BloqueAgenda.LIBRE,
+        inicio__gte=desde,
+        inicio__gt=ahora,
+        inicio__lt=hasta,
+    ).order_by('inicio').values_list('inicio', flat=True)
+    return [timezone.localtime(inicio) for inicio in inicios]
+
+
+def primeros_disponibles(profesional_ids, cantidad, ahora=None):
+    """
+    Devuelve los `cantidad` bloques libres más próximos entre varios
+    profesionales, como una lista de `(inicio, profesional_id)`. Dentro del
+    horizonte es una sola consulta; si no alcanza, se completa con el motor de
+    disponibilidad para el período siguiente.
+    """
+    ahora = ahora or timezone.now()
+    primera, ultima = fechas_horizonte(timezone.localdate(ahora))
+    _, hasta = disponibilidad.limites_rango(primera, ultima)
+    resultado = [
+        (timezone.localtime(inicio), profesional_id)
+        for inicio, profesional_id in BloqueAgenda.objects.filter(
+            profesional_id__in=profesional_ids,
+            estado=BloqueAgenda.LIBRE,
+            inicio__gt=ahora,
+            inicio__lt=hasta,
+        ).order_by('inicio', 'profesional_id').values_list('inicio', 'profesional_id')[:cantidad]
+    ]
+    if len(resultado) < cantidad:
+        siguiente = ultima + timedelta(days=1)
+        resultado += disponibilidad.primeros_disponibles(
+            profesional_ids, cantidad - len(resultado),
+            siguiente, siguiente + timedelta(days=HORIZONTE_DIAS - 1), ahora=ahora
+        )
+    return resultado
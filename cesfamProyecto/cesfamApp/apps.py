@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CesfamappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cesfamApp'
+
+    def ready(self):
+        # Registra las señales que mantienen la agenda materializada
+        from . import signals  # noqa: F401
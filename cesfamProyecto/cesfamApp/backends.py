@@ -0,0 +1,39 @@
+"""
+Autenticación por email o RUN.
+
+`CustomUser.save` guarda el email en minúsculas y el RUN en forma canónica
+(`run_canonico`), así que basta normalizar lo que escribe el usuario y buscar
+por igualdad: una sola consulta que usa el índice del email o el índice único
+del RUN, en vez de comparar sin distinguir mayúsculas (que no usa índices) y
+volver a buscar por username.
+
+`ModelBackend` sigue configurado después de este para el login por username
+(admin y pruebas).
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from .models import email_canonico, run_canonico
+
+
+class EmailORunBackend(ModelBackend):
+
+    def authenticate(self, request, identificador=None, password=None, **kwargs):
+        if not identificador or password is None:
+            return None
+        User = get_user_model()
+        if '@' in identificador:
+            filtro = {'email': email_canonico(identificador)}
+        else:
+            filtro = {'run': run_canonico(identificador)}
+        user = None
+        if all(filtro.values()):
+            # El email no es único: ante duplicados antiguos gana la cuenta más antigua, siempre la misma
+            user = User._default_manager.filter(**filtro).order_by('pk').first()
+        if user is None:
+            # Igual que ModelBackend: calcular un hash para que no se note por el tiempo si el usuario existe
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,175 @@
+"""
+Caché de disponibilidad por profesional y por semana.
+
+Cada semana (de lunes a domingo) de cada profesional se guarda en el caché de
+Django con sus bloques libres. Las claves llevan dos números de versión:
+
+- uno por profesional, que se incrementa cuando cambia alguno de sus `Horario`
+  (afecta a todas sus semanas);
+- uno por profesional y semana, que se incrementa cuando cambia una `Cita`
+  de esa semana.
+
+Invalidar es cambiar una versión por un valor nuevo, así que un cálculo que
+termina después de un cambio guarda su resultado bajo una clave que ya nadie
+lee. Para eso la invalidación tiene que ocurrir después de que los datos
+nuevos sean visibles: las señales de `signals.py` invalidan al confirmarse la
+transacción (`transaction.on_commit`), y las operaciones masivas que no
+disparan señales deben llamar a `invalidar_profesional` después de confirmar
+y de actualizar la agenda materializada. Si se invalida antes, otra request
+puede calcular con los datos viejos y guardarlos bajo la versión nueva hasta
+por `TIMEOUT`.
+
+Las versiones viven en el caché de Django: con varios procesos (workers de
+gunicorn) el caché tiene que ser compartido (`DJANGO_CACHE_DIR`), o cada
+worker seguiría sirviendo lo suyo sin enterarse de los cambios hechos en otro.
+`gunicorn.conf.py` no arranca con más de un worker sin caché compartido.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import agenda, disponibilidad
+from .models import BloqueAgenda
+
+CLAVE_HITS = 'disp:hits'
+CLAVE_MISSES = 'disp:misses'
+
+# Tiempo máximo que se guarda una semana; es solo un resguardo, la invalidación la hacen las señales.
+TIMEOUT = getattr(settings, 'DISPONIBILIDAD_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _lunes(fecha):
+    return fecha - timedelta(days=fecha.weekday())
+
+
+def _clave_version_profesional(profesional_id):
+    return f'disp:v:{profesional_id}'
+
+
+def _clave_version_semana(profesional_id, lunes):
+    return f'disp:v:{profesional_id}:{lunes.isoformat()}'
+
+
+def _incrementar(clave, delta=1, inicial=0):
+    if delta <= 0:
+        return
+    cache.add(clave, inicial, None)
+    try:
+        cache.incr(clave, delta)
+    except ValueError:
+        # La clave expiró o se desalojó entre `add` e `incr`
+        cache.set(clave, inicial + delta, None)
+
+
+def _nueva_version(clave):
+    # Un valor nuevo y no un `incr`: en el caché en archivos `incr` es leer y escribir, y dos
+    # invalidaciones simultáneas podrían dejar la misma versión
+    cache.set(clave, time.time_ns(), None)
+
+
+def _versiones(claves):
+    """
+    Lee las versiones indicadas. Una versión que no está en el caché (nunca se
+    creó o fue desalojada) se inicializa con un valor nuevo basado en la hora,
+    para no volver a usar claves de datos guardadas con una versión anterior.
+    """
+    versiones = cache.get_many(claves)
+    faltantes = [clave for clave in claves if clave not in versiones]
+    if faltantes:
+        inicial = time.time_ns()
+        for clave in faltantes:
+            cache.add(clave, inicial, None)
+        versiones.update(cache.get_many(faltantes))
+    return versiones
+
+
+def _calcular_semana(profesional, lunes):
+    """Bloques libres de la semana, sin filtrar por la hora actual."""
+    domingo = lunes + timedelta(days=6)
+    _, ultima = agenda.fechas_horizonte()
+    if domingo <= ultima:
+        desde, hasta = disponibilidad.limites_rango(lunes, domingo)
+        inicios = BloqueAgenda.objects.filter(
+            profesional=profesional,
+            estado=BloqueAgenda.LIBRE,
+            inicio__gte=desde,
+            inicio__lt=hasta,
+        ).order_by('inicio').values_list('inicio', flat=True)
+        return [timezone.localtime(inicio) for inicio in inicios]
+    desde, _ = disponibilidad.limites_rango(lunes, lunes)
+    return disponibilidad.horarios_disponibles(profesional, lunes, domingo, ahora=desde - timedelta(microseconds=1))
+
+
+def horarios_disponibles(profesional, fecha_inicio, fecha_fin, ahora=None):
+    """
+    Igual que `agenda.horarios_disponibles`, pero leyendo cada semana del caché
+    y calculando solo las semanas que faltan.
+    """
+    ahora = ahora or timezone.now()
+    fecha_inicio = max(fecha_inicio, timezone.localdate(ahora))
+    if fecha_inicio > fecha_fin:
+        return []
+
+    lunes = []
+    semana = _lunes(fecha_inicio)
+    while semana <= fecha_fin:
+        lunes.append(semana)
+        semana += timedelta(days=7)
+
+    claves_version = [_clave_version_profesional(profesional.pk)] + [
+        _clave_version_semana(profesional.pk, semana) for semana in lunes
+    ]
+    versiones = _versiones(claves_version)
+    version_profesional = versiones.get(claves_version[0])
+    claves = {
+        semana: f'disp:{profesional.pk}:{version_profesional}:{semana.isoformat()}:{versiones.get(clave_version)}'
+        for semana, clave_version in zip(lunes, claves_version[1:])
+    }
+
+    guardadas = cache.get_many(claves.values())
+    faltantes = {}
+    slots = []
+    for semana in lunes:
+        bloques = guardadas.get(claves[semana])
+        if bloques is None:
+            bloques = faltantes[claves[semana]] = _calcular_semana(profesional, semana)
+        slots.extend(bloques)
+    if faltantes:
+        cache.set_many(faltantes, TIMEOUT)
+
+    _incrementar(CLAVE_HITS, len(lunes) - len(faltantes))
+    _incrementar(CLAVE_MISSES, len(faltantes))
+
+    desde, hasta = disponibilidad.limites_rango(fecha_inicio, fecha_fin)
+    return [slot for slot in slots if slot > ahora and desde <= slot < hasta]
+
+
+def invalidar_cita(profesional_id, fecha_hora, duracion=disponibilidad.DURACION_CITA):
+    """Invalida las semanas del profesional cuyos bloques pueden solaparse con la cita."""
+    semanas = {_lunes(timezone.localdate(fecha_hora + delta)) for delta in (-duracion, duracion)}
+    for semana in semanas:
+        _nueva_version(_clave_version_semana(profesional_id, semana))
+
+
+def invalidar_profesional(profesional_id):
+    """Invalida todas las semanas de un profesional (p. ej. al cambiar sus horarios)."""
+    _nueva_version(_clave_version_profesional(profesional_id))
+
+
+def estadisticas():
+    """Contadores de aciertos y fallos del caché, por semana consultada."""
+    valores = cache.get_many([CLAVE_HITS, CLAVE_MISSES])
+    hits, misses = valores.get(CLAVE_HITS, 0), valores.get(CLAVE_MISSES, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else None,
+    }
+
+
+def reiniciar_estadisticas():
+    cache.delete_many([CLAVE_HITS, CLAVE_MISSES])
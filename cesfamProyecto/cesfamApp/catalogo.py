@@ -0,0 +1,86 @@
+"""
+Versiones del catálogo (servicios, CESFAM y horarios) para GET condicional.
+
+Cada tabla del catálogo tiene una fila en `VersionCatalogo` con un contador de
+cambios y la hora del último. Con ellos se arman el `ETag` y el
+`Last-Modified` de los endpoints que la muestran, así que a un cliente que ya
+tiene la versión vigente se le responde `304 Not Modified` con una sola
+consulta (la de las versiones), sin consultar ni serializar filas.
+
+Las versiones están en la base y no en el caché de Django: con varios workers
+y el caché en memoria de cada proceso, un worker que no se enteró de un cambio
+respondería 304 a un cliente con datos viejos. Un nombre sin fila todavía no
+ha cambiado nunca (versión 0).
+
+Las señales de `signals.py` llaman a `registrar_cambio` al confirmarse cada
+transacción que modifica el catálogo; las operaciones masivas que no disparan
+señales deben llamarlo ellas mismas.
+
+`Last-Modified` tiene resolución de segundos; dos cambios dentro del mismo
+segundo solo los distingue el ETag, que es lo que revisan primero los
+navegadores (`If-None-Match`).
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .models import VersionCatalogo
+
+SERVICIOS = 'servicio'
+CESFAM = 'cesfam'
+HORARIOS = 'horario'
+
+
+def registrar_cambio(*nombres):
+    ahora = timezone.now()
+    with transaction.atomic():
+        VersionCatalogo.objects.bulk_create(
+            [VersionCatalogo(nombre=nombre, modificado=ahora) for nombre in nombres], ignore_conflicts=True,
+        )
+        VersionCatalogo.objects.filter(nombre__in=nombres).update(version=F('version') + 1, modificado=ahora)
+
+
+def versiones(nombres):
+    """`(version, segundos del último cambio)` de cada nombre, con una consulta; `(0, 0)` si nunca cambió."""
+    encontradas = {
+        nombre: (version, modificado.timestamp())
+        for nombre, version, modificado in VersionCatalogo.objects.filter(nombre__in=nombres).values_list(
+            'nombre', 'version', 'modificado',
+        )
+    }
+    return [encontradas.get(nombre, (0, 0)) for nombre in nombres]
+
+
+def etiqueta(version):
+    """Texto de una versión para ETags y claves de caché (la hora distingue una base recreada)."""
+    numero, modificado = version
+    return f'{numero}.{int(modificado * 1e6)}'
+
+
+def responder_condicional(request, nombres, generar, variante='', last_modified=True):
+    """
+    Responde con `generar()` agregando `ETag` (y `Last-Modified`), o con 304
+    si el cliente ya tiene esa versión. `variante` distingue representaciones
+    distintas de los mismos datos (formato, usuario) dentro del ETag. Con
+    `last_modified=False` solo se usa el ETag, para respuestas que dependen
+    de algo más que el catálogo.
+    """
+    valores = versiones(nombres)
+    etag = quote_etag('-'.join([f'{nombre}.{etiqueta(valor)}' for nombre, valor in zip(nombres, valores)] +
+                               ([variante] if variante else [])))
+    ultimo = max(segundos for _, segundos in valores)
+    # Sin ningún cambio registrado no hay fecha que informar; basta el ETag
+    modificado = int(ultimo) if last_modified and ultimo else None
+    respuesta = get_conditional_response(request, etag=etag, last_modified=modificado)
+    if respuesta is None:
+        respuesta = generar()
+        if respuesta.status_code != 200:
+            return respuesta
+    respuesta.headers['ETag'] = etag
+    if modificado is not None:
+        respuesta.headers['Last-Modified'] = http_date(modificado)
+    # Sin esto el navegador puede reutilizar la respuesta por heurística sin preguntar si cambió
+    patch_cache_control(respuesta, no_cache=True)
+    return respuesta
@@ -26,4 +26,5 @@ def role_required(allowed_roles):
 # Decoradores específicos por rol
 admin_required = role_required([CustomUser.ROL_PROFESIONAL, CustomUser.ROL_ADMIN])
 profesional_required = role_required([CustomUser.ROL_PROFESIONAL, CustomUser.ROL_ADMIN])
-paciente_required = role_required([CustomUser.ROL_PACIENTE])
\ No newline at end of file
+paciente_required = role_required([CustomUser.ROL_PACIENTE])
+solo_admin_required = role_required([CustomUser.ROL_ADMIN])
\ No newline at end of file
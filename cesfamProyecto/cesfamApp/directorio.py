@@ -0,0 +1,119 @@
+"""
+Búsqueda en el directorio de usuarios para los selectores con autocompletado
+(mensajería y agendamiento por el profesional).
+
+`TerminoDirectorio` es un índice materializado: una fila por cada palabra del
+nombre, por el email y por el RUN normalizado de cada usuario, sin tildes y en
+minúsculas, junto con su rol. Buscar es pedir, por cada palabra escrita, los
+términos que empiezan con ella dentro de los roles permitidos: una consulta
+por rango sobre el índice `(rol, termino)`, que funciona igual en SQLite y en
+PostgreSQL y no recorre la tabla de usuarios.
+
+Las señales de `signals.py` mantienen el índice al crear o editar un usuario;
+las altas masivas que no disparan señales deben llamar a `reindexar`.
+"""
+import re
+import unicodedata
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .models import TerminoDirectorio
+
+# Resultados por búsqueda
+LIMITE_POR_DEFECTO = 10
+LIMITE_MAXIMO = 25
+# Largo mínimo de lo escrito antes de buscar y palabras que se consideran
+LARGO_MINIMO = 2
+MAXIMO_PALABRAS = 4
+
+# Campos del usuario de los que salen los términos
+CAMPOS_INDEXADOS = {'first_name', 'last_name', 'username', 'email', 'run', 'rol'}
+
+_RUN = re.compile(r'[0-9][0-9.]*-?[0-9k]?')
+
+
+def sin_tildes(texto):
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c)).lower()
+
+
+def normalizar_run(run):
+    """RUN sin puntos ni guion y con la `k` en minúscula: '12.345.678-K' -> '12345678k'."""
+    return re.sub(r'[^0-9k]', '', (run or '').lower())
+
+
+def terminos(usuario):
+    """Pares `(tipo, termino)` con los que se encuentra al usuario."""
+    pares = set()
+    for campo in (usuario.first_name, usuario.last_name, usuario.username):
+        pares.update((TerminoDirectorio.NOMBRE, palabra) for palabra in re.findall(r'[a-z0-9]+', sin_tildes(campo or '')))
+    if usuario.email:
+        pares.add((TerminoDirectorio.EMAIL, usuario.email.strip().lower()))
+    if normalizar_run(usuario.run):
+        pares.add((TerminoDirectorio.RUN, normalizar_run(usuario.run)))
+    return pares
+
+
+def reindexar(usuarios):
+    """Reemplaza los términos de los usuarios dados (dos consultas por lote)."""
+    usuarios = list(usuarios)
+    with transaction.atomic():
+        TerminoDirectorio.objects.filter(usuario__in=[usuario.pk for usuario in usuarios]).delete()
+        TerminoDirectorio.objects.bulk_create(
+            (
+                TerminoDirectorio(usuario_id=usuario.pk, rol=usuario.rol, tipo=tipo, termino=termino[:254])
+                for usuario in usuarios for tipo, termino in terminos(usuario)
+            ),
+            batch_size=1000,
+        )
+
+
+def alcance(usuario):
+    """
+    Roles que `usuario` puede buscar y tipos de término que puede usar. Un
+    paciente solo encuentra al equipo de salud y solo por nombre; el equipo
+    de salud también busca pacientes, por email y por RUN.
+    """
+    User = get_user_model()
+    if usuario.is_staff or usuario.rol in (User.ROL_PROFESIONAL, User.ROL_ADMIN):
+        return {User.ROL_PACIENTE, User.ROL_PROFESIONAL, User.ROL_ADMIN}, set(TerminoDirectorio.TIPOS)
+    return {User.ROL_PROFESIONAL, User.ROL_ADMIN}, {TerminoDirectorio.NOMBRE}
+
+
+def _palabras(texto):
+    """Prefijos a buscar: palabras del nombre, un email a medio escribir o un RUN con o sin formato."""
+    palabras = []
+    for palabra in sin_tildes(texto).split():
+        if '@' in palabra:
+            palabras.append(palabra)
+        elif _RUN.fullmatch(palabra):
+            palabras.append(normalizar_run(palabra))
+        else:
+            palabras.extend(re.findall(r'[a-z0-9]+', palabra))
+    return [palabra for palabra in palabras if palabra][:MAXIMO_PALABRAS]
+
+
+def _siguiente(prefijo):
+    # Menor texto mayor que todos los que empiezan con `prefijo`, para que el filtro sea un rango del índice
+    return prefijo[:-1] + chr(ord(prefijo[-1]) + 1)
+
+
+def buscar(texto, roles, tipos, limite=LIMITE_POR_DEFECTO, excluir=None):
+    """
+    Usuarios activos con alguno de `roles` en los que cada palabra de `texto`
+    es el comienzo de algún término de los `tipos` permitidos. Devuelve una
+    consulta con a lo más `limite` usuarios ordenados por apellido y nombre.
+    """
+    User = get_user_model()
+    palabras = _palabras(texto)
+    if not roles or not palabras or len(''.join(palabras)) < LARGO_MINIMO:
+        return User.objects.none()
+    usuarios = User.objects.filter(rol__in=roles, is_active=True)
+    for palabra in palabras:
+        usuarios = usuarios.filter(pk__in=TerminoDirectorio.objects.filter(
+            rol__in=roles, termino__gte=palabra, termino__lt=_siguiente(palabra),
+            termino__startswith=palabra, tipo__in=tipos,
+        ).values('usuario_id'))
+    if excluir is not None:
+        usuarios = usuarios.exclude(pk=excluir)
+    return usuarios.order_by('last_name', 'first_name', 'pk')[:max(1, min(limite, LIMITE_MAXIMO))]
@@ -0,0 +1,169 @@
+"""
+Motor de cálculo de disponibilidad de horarios.
+
+Centraliza la lógica que antes estaba duplicada en `agendar_cita_paso3` y
+`profesional_horarios_json`. Los bloques de `Horario` de un mismo día se unen
+como intervalos (un profesional puede tener varios bloques por día) y las citas
+ocupadas se buscan con `bisect` sobre una lista ordenada, en vez de recorrer
+un QuerySet por cada bloque de tiempo.
+"""
+import heapq
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from itertools import islice
+
+from django.utils import timezone
+
+from .models import Cita, Horario
+
+# Asumimos que cada cita dura 30 minutos
+DURACION_CITA = timedelta(minutes=30)
+# Días de disponibilidad que se le muestran al paciente al elegir hora (`agendar_cita_paso3`)
+DIAS_A_MOSTRAR = 14
+
+
+def agrupar_bloques(bloques):
+    """
+    Agrupa bloques `(dia, hora_inicio, hora_fin)` por día de la semana y une
+    los que se solapan o son contiguos.
+
+    Devuelve un diccionario `{dia: [(hora_inicio, hora_fin), ...]}` con los
+    intervalos de cada día ordenados y sin solapamientos.
+    """
+    por_dia = {}
+    for dia, hora_inicio, hora_fin in bloques:
+        if hora_inicio < hora_fin:
+            por_dia.setdefault(dia, []).append((hora_inicio, hora_fin))
+
+    for dia, intervalos in por_dia.items():
+        intervalos.sort()
+        unidos = [intervalos[0]]
+        for inicio, fin in intervalos[1:]:
+            ultimo_inicio, ultimo_fin = unidos[-1]
+            if inicio <= ultimo_fin:
+                unidos[-1] = (ultimo_inicio, max(ultimo_fin, fin))
+            else:
+                unidos.append((inicio, fin))
+        por_dia[dia] = unidos
+    return por_dia
+
+
+def generar_slots(bloques_por_dia, fecha_inicio, fecha_fin, duracion=DURACION_CITA, tz=None):
+    """
+    Genera todos los bloques de tiempo (ocupados o no) que caen dentro de los
+    horarios de atención entre `fecha_inicio` y `fecha_fin` (ambas incluidas).
+    """
+    tz = tz or timezone.get_current_timezone()
+    current_date = fecha_inicio
+    while current_date <= fecha_fin:
+        for hora_inicio, hora_fin in bloques_por_dia.get(current_date.weekday(), ()):
+            current_slot = datetime.combine(current_date, hora_inicio, tzinfo=tz)
+            hora_fin_dt = datetime.combine(current_date, hora_fin, tzinfo=tz)
+            while current_slot < hora_fin_dt:
+                yield current_slot
+                current_slot += duracion
+        current_date += timedelta(days=1)
+
+
+def esta_ocupado(slot, citas_ocupadas, duracion=DURACION_CITA):
+    """
+    Indica si `slot` se solapa con alguna cita de la lista ORDENADA
+    `citas_ocupadas`, aunque la cita no esté alineada a la grilla de 30 minutos.
+    """
+    # Primera cita que empieza después de (slot - duración):
+    # si empieza antes de (slot + duración), se solapan.
+    i = bisect_right(citas_ocupadas, slot - duracion)
+    return i < len(citas_ocupadas) and citas_ocupadas[i] < slot + duracion
+
+
+def calcular_slots_libres(bloques_por_dia, citas_ocupadas, fecha_inicio, fecha_fin,
+                          ahora=None, duracion=DURACION_CITA, tz=None):
+    """
+    Calcula los bloques de tiempo libres entre `fecha_inicio` y `fecha_fin`
+    (ambas fechas incluidas).
+
+    - `bloques_por_dia`: resultado de `agrupar_bloques`.
+    - `citas_ocupadas`: lista ORDENADA de `datetime` con el inicio de cada cita.
+    - `ahora`: solo se devuelven bloques posteriores a este instante.
+    """
+    ahora = ahora or timezone.now()
+    return [
+        slot for slot in generar_slots(bloques_por_dia, fecha_inicio, fecha_fin, duracion, tz)
+        if slot > ahora and not esta_ocupado(slot, citas_ocupadas, duracion)
+    ]
+
+
+def limites_rango(fecha_inicio, fecha_fin, tz=None):
+    """
+    Devuelve el rango `[desde, hasta)` de instantes que cubre las fechas
+    `fecha_inicio` a `fecha_fin` (ambas incluidas) en la zona horaria `tz`.
+    """
+    tz = tz or timezone.get_current_timezone()
+    desde = datetime.combine(fecha_inicio, datetime.min.time(), tzinfo=tz)
+    hasta = datetime.combine(fecha_fin + timedelta(days=1), datetime.min.time(), tzinfo=tz)
+    return desde, hasta
+
+
+def cargar_agendas(profesional_ids, fecha_inicio, fecha_fin, duracion=DURACION_CITA, tz=None):
+    """
+    Carga los horarios y las citas de varios profesionales con una sola
+    consulta por tabla. Si `profesional_ids` es None se cargan todos.
+
+    Devuelve `(bloques, citas)`: `{profesional_id: bloques_por_dia}` y
+    `{profesional_id: [inicio de cita, ...]}` con las citas ordenadas.
+    """
+    horarios = Horario.objects.filter(bloqueado=False)
+    if profesional_ids is not None:
+        horarios = horarios.filter(profesional_id__in=profesional_ids)
+
+    bloques = {}
+    for profesional_id, dia, hora_inicio, hora_fin in horarios.values_list(
+            'profesional_id', 'dia', 'hora_inicio', 'hora_fin'):
+        bloques.setdefault(profesional_id, []).append((dia, hora_inicio, hora_fin))
+    if not bloques:
+        return {}, {}
+
+    # Se incluye una duración antes del rango para detectar citas que se solapan
+    # con el primer bloque del día.
+    desde, hasta = limites_rango(fecha_inicio, fecha_fin, tz)
+    citas_qs = Cita.objects.filter(fecha_hora__gt=desde - duracion, fecha_hora__lt=hasta)
+    if profesional_ids is not None:
+        citas_qs = citas_qs.filter(profesional_id__in=bloques.keys())
+    citas = {}
+    for profesional_id, fecha_hora in citas_qs.order_by('fecha_hora').values_list('profesional_id', 'fecha_hora'):
+        citas.setdefault(profesional_id, []).append(fecha_hora)
+
+    return {profesional_id: agrupar_bloques(b) for profesional_id, b in bloques.items()}, citas
+
+
+def horarios_disponibles(profesional, fecha_inicio, fecha_fin, ahora=None, duracion=DURACION_CITA):
+    """
+    Devuelve los bloques libres de un profesional entre dos fechas (incluidas),
+    usando una consulta para sus `Horario` y otra para sus `Cita`.
+    """
+    tz = timezone.get_current_timezone()
+    bloques, citas = cargar_agendas([profesional.pk], fecha_inicio, fecha_fin, duracion, tz)
+    return calcular_slots_libres(
+        bloques.get(profesional.pk, {}), citas.get(profesional.pk, []), fecha_inicio, fecha_fin,
+        ahora=ahora, duracion=duracion, tz=tz
+    )
+
+
+def primeros_disponibles(profesional_ids, cantidad, fecha_inicio, fecha_fin, ahora=None, duracion=DURACION_CITA):
+    """
+    Devuelve los `cantidad` bloques libres más próximos entre todos los
+    profesionales indicados, como una lista de `(inicio, profesional_id)`.
+    Los horarios y citas se cargan con una consulta por tabla y los bloques de
+    cada profesional se mezclan en orden sin calcular el rango completo.
+    """
+    ahora = ahora or timezone.now()
+    tz = timezone.get_current_timezone()
+    bloques, citas = cargar_agendas(profesional_ids, fecha_inicio, fecha_fin, duracion, tz)
+
+    def libres(profesional_id):
+        ocupadas = citas.get(profesional_id, [])
+        for slot in generar_slots(bloques[profesional_id], fecha_inicio, fecha_fin, duracion, tz):
+            if slot > ahora and not esta_ocupado(slot, ocupadas, duracion):
+                yield slot, profesional_id
+
+    return list(islice(heapq.merge(*(libres(profesional_id) for profesional_id in sorted(bloques))), cantidad))
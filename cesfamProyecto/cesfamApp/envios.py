@@ -0,0 +1,46 @@
+"""
+Servicio de envío de mensajes.
+
+Todo el envío ocurre en una transacción y con un número fijo de consultas,
+sin cargar la conversación ni sus participantes:
+    1. sube `Conversation.updated_at` con un `UPDATE` que solo alcanza a la
+       conversación si el remitente participa en ella: si no actualiza
+       ninguna fila, el remitente no participa y no se escribe nada más;
+    2. inserta el mensaje;
+    3. avanza la marca de lectura del remitente hasta su mensaje
+       (`cesfamApp.lecturas`). Los demás participantes quedan con su marca
+       por debajo, o sea con el mensaje sin leer, sin escribir nada por ellos.
+
+Que la primera sentencia sea una escritura importa en SQLite: una transacción
+que empieza leyendo y luego escribe no puede esperar el lock de escritura y
+falla con "database is locked" cuando hay envíos simultáneos. En PostgreSQL el
+`UPDATE` además bloquea la fila de la conversación, así que los envíos a una
+misma conversación se ordenan entre sí.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import lecturas
+from .models import Conversation, Message
+
+
+class NoEsParticipante(Exception):
+    """El remitente no participa en la conversación (o la conversación no existe)."""
+
+
+def enviar_mensaje(conversation_id, remitente, contenido):
+    """
+    Crea un mensaje de `remitente` en la conversación y lo devuelve. Lanza
+    `NoEsParticipante` si el remitente no pertenece a ella.
+    """
+    with transaction.atomic():
+        actualizadas = Conversation.objects.filter(pk=conversation_id, participants=remitente).update(
+            updated_at=timezone.now(),
+        )
+        if not actualizadas:
+            raise NoEsParticipante()
+        message = Message.objects.create(conversation_id=conversation_id, sender=remitente, content=contenido)
+        lecturas.avanzar(conversation_id, remitente.pk, message.pk, avisar=False)
+    # Recién enviado solo lo leyó el remitente; así la respuesta no vuelve a consultar las marcas
+    message.lectores = [remitente]
+    return message
@@ -0,0 +1,77 @@
+"""
+Exportación de citas en streaming (CSV o NDJSON).
+
+Las filas se leen con `iterator(chunk_size=...)` y se serializan de a una, así
+que la memoria usada no depende de la cantidad de citas exportadas. Las
+columnas coinciden con las que acepta `importacion`, más algunos datos de
+contexto, para poder reimportar un archivo exportado.
+"""
+import csv
+import json
+
+from django.utils import timezone
+
+from . import disponibilidad
+from .models import Cita
+
+CAMPOS = (
+    ('id', 'id'),
+    ('fecha_hora', 'fecha_hora'),
+    ('paciente', 'paciente__username'),
+    ('paciente_nombre', 'paciente__first_name'),
+    ('paciente_apellido', 'paciente__last_name'),
+    ('paciente_run', 'paciente__run'),
+    ('profesional', 'profesional__username'),
+    ('profesional_nombre', 'profesional__first_name'),
+    ('profesional_apellido', 'profesional__last_name'),
+    ('servicio', 'servicio__nombre'),
+    ('cesfam', 'cesfam__nombre'),
+)
+COLUMNAS = tuple(columna for columna, _ in CAMPOS)
+CHUNK_SIZE = 2000
+
+
+def filtrar_citas(desde=None, hasta=None, profesional_id=None, cesfam_id=None):
+    """Citas ordenadas por fecha, filtradas por rango de fechas (inclusivo), profesional y CESFAM."""
+    citas = Cita.objects.order_by('fecha_hora', 'id')
+    # Límites como datetime (no `__date`) para que se usen los índices sobre fecha_hora
+    if desde:
+        citas = citas.filter(fecha_hora__gte=disponibilidad.limites_rango(desde, desde)[0])
+    if hasta:
+        citas = citas.filter(fecha_hora__lt=disponibilidad.limites_rango(hasta, hasta)[1])
+    if profesional_id:
+        citas = citas.filter(profesional_id=profesional_id)
+    if cesfam_id:
+        citas = citas.filter(cesfam_id=cesfam_id)
+    return citas
+
+
+def filas(citas, chunk_size=CHUNK_SIZE):
+    """
+    Diccionarios por cita, con los datos relacionados traídos en la misma
+    consulta (joins de paciente, profesional, servicio y CESFAM).
+    """
+    tz = timezone.get_current_timezone()
+    for valores in citas.values_list(*(campo for _, campo in CAMPOS)).iterator(chunk_size=chunk_size):
+        fila = dict(zip(COLUMNAS, valores))
+        fila['fecha_hora'] = fila['fecha_hora'].astimezone(tz).isoformat()
+        yield fila
+
+
+class _Eco:
+    """Objeto tipo archivo que devuelve lo escrito, para usar `csv.writer` en streaming."""
+
+    def write(self, valor):
+        return valor
+
+
+def lineas_csv(citas, chunk_size=CHUNK_SIZE):
+    escritor = csv.DictWriter(_Eco(), fieldnames=COLUMNAS)
+    yield escritor.writeheader()
+    for fila in filas(citas, chunk_size):
+        yield escritor.writerow(fila)
+
+
+def lineas_ndjson(citas, chunk_size=CHUNK_SIZE):
+    for fila in filas(citas, chunk_size):
+        yield json.dumps(fila, ensure_ascii=False) + '\n'
@@ -0,0 +1,35 @@
+"""
+Filtros de la API (django-filter) para citas y horarios.
+
+Los filtros por profesional, paciente, servicio y CESFAM reciben el id y
+filtran directo por la columna de la clave foránea, sin validar antes que el
+objeto exista (un id inexistente simplemente no trae resultados). Cada
+combinación habitual tiene su índice (ver `Cita.Meta` y `Horario.Meta`); en
+particular, la semana de un profesional
+(`?profesional=<id>&fecha_hora_after=...&fecha_hora_before=...`) es una
+consulta por rango sobre `(profesional, fecha_hora)`.
+"""
+from django_filters import rest_framework as filters
+
+from .models import Cita, Horario
+
+
+class CitaFilter(filters.FilterSet):
+    profesional = filters.NumberFilter(field_name='profesional_id')
+    paciente = filters.NumberFilter(field_name='paciente_id')
+    servicio = filters.NumberFilter(field_name='servicio_id')
+    cesfam = filters.NumberFilter(field_name='cesfam_id')
+    # `fecha_hora_after` (desde, inclusive) y `fecha_hora_before` (hasta, inclusive), en ISO 8601
+    fecha_hora = filters.IsoDateTimeFromToRangeFilter()
+
+    class Meta:
+        model = Cita
+        fields = ['profesional', 'paciente', 'servicio', 'cesfam', 'fecha_hora']
+
+
+class HorarioFilter(filters.FilterSet):
+    profesional = filters.NumberFilter(field_name='profesional_id')
+
+    class Meta:
+        model = Horario
+        fields = ['profesional', 'dia', 'bloqueado']
@@ -0,0 +1,47 @@
+"""
+Versiones de los fragmentos del panel principal guardados en el caché.
+
+`partials/dashboard_anuncios.html` (igual para todos) y
+`partials/dashboard_notificaciones.html` (uno por usuario) se guardan ya
+renderizados con `{% cache %}`, usando como clave la versión de sus datos.
+Las consultas de `paneles.contexto_dashboard` son perezosas y solo se ejecutan
+dentro del bloque, así que con el fragmento en el caché no se consulta la
+base.
+
+Las versiones se llevan igual que las del catálogo (`catalogo.versiones` y
+`catalogo.registrar_cambio`): están en la base (`VersionCatalogo`), no en el
+caché, así que un cambio hecho en un worker invalida los fragmentos de todos
+aunque cada uno tenga su propio caché en memoria. Leerlas es una consulta por
+panel. Las señales de `signals.py` cambian la de los anuncios al guardar o
+eliminar un `Anuncio` y la de las notificaciones de un usuario al crear, leer
+(guardar) o eliminar una de sus `Notificacion`. Quien las modifique con
+`update()` o `bulk_create` debe llamar a `invalidar_*`. Los fragmentos de
+versiones viejas no se borran: expiran a los `TIMEOUT` segundos.
+"""
+from . import catalogo
+
+TIMEOUT = 60 * 60
+
+ANUNCIOS = 'anuncio'
+
+
+def notificaciones(usuario_id):
+    return f'notificacion:{usuario_id}'
+
+
+def versiones_dashboard(usuario_id):
+    """Contexto con las versiones que usan como clave los fragmentos del panel (una consulta)."""
+    anuncios, propias = catalogo.versiones([ANUNCIOS, notificaciones(usuario_id)])
+    return {
+        'timeout_fragmentos': TIMEOUT,
+        'version_anuncios': catalogo.etiqueta(anuncios),
+        'version_notificaciones': catalogo.etiqueta(propias),
+    }
+
+
+def invalidar_anuncios():
+    catalogo.registrar_cambio(ANUNCIOS)
+
+
+def invalidar_notificaciones(*usuario_ids):
+    catalogo.registrar_cambio(*(notificaciones(usuario_id) for usuario_id in usuario_ids))
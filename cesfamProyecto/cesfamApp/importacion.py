@@ -0,0 +1,270 @@
+"""
+Importación masiva de citas desde agendas de otros sistemas.
+
+Las filas se leen en streaming (CSV o NDJSON) y se procesan por lotes. En cada
+lote las referencias a pacientes, profesionales, servicios y CESFAM se
+resuelven con una consulta `IN` por tabla, los choques de horario se detectan
+con una sola consulta de las citas existentes y las filas válidas se insertan
+con `bulk_create`. Las filas rechazadas se entregan a un callback junto con el
+motivo, para armar el archivo de rechazos.
+
+`bulk_create` no dispara señales, así que la agenda materializada, el caché
+de disponibilidad y el resumen de métricas se actualizan aquí, por lote.
+"""
+import csv
+import json
+from bisect import insort
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import agenda, cache_disponibilidad, disponibilidad, metricas, reservas
+from .models import Cesfam, Cita, Servicio, email_canonico, run_canonico
+
+User = get_user_model()
+
+COLUMNAS = ('paciente', 'profesional', 'servicio', 'cesfam', 'fecha_hora')
+COLUMNAS_RECHAZOS = ('linea', 'motivo') + COLUMNAS
+FORMATOS = ('csv', 'ndjson')
+
+
+def detectar_formato(nombre, content_type=''):
+    """Formato según la extensión del archivo o el Content-Type; CSV por defecto."""
+    nombre = (nombre or '').lower()
+    if nombre.endswith(('.ndjson', '.jsonl')) or 'ndjson' in (content_type or ''):
+        return 'ndjson'
+    return 'csv'
+
+
+def leer_filas(lineas, formato='csv'):
+    """
+    Recorre un iterable de líneas de texto y entrega `(numero_linea, fila, error)`,
+    donde `fila` es un diccionario y `error` un mensaje si la línea no se pudo leer.
+    """
+    if formato == 'ndjson':
+        for numero, linea in enumerate(lineas, 1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                fila = json.loads(linea)
+            except ValueError:
+                yield numero, {}, 'JSON inválido.'
+                continue
+            if not isinstance(fila, dict):
+                yield numero, {}, 'Se esperaba un objeto JSON por línea.'
+                continue
+            yield numero, fila, None
+        return
+
+    lector = csv.DictReader(lineas)
+    for fila in lector:
+        yield lector.line_num, fila, None
+
+
+class EscritorRechazos:
+    """Escribe las filas rechazadas como CSV con el número de línea y el motivo."""
+
+    def __init__(self, archivo):
+        self.escritor = csv.DictWriter(archivo, fieldnames=COLUMNAS_RECHAZOS, extrasaction='ignore')
+        self.escritor.writeheader()
+
+    def __call__(self, numero, fila, motivo):
+        self.escritor.writerow({**{c: fila.get(c, '') for c in COLUMNAS}, 'linea': numero, 'motivo': motivo})
+
+
+def _texto(valor):
+    return '' if valor is None else str(valor).strip()
+
+
+def _resolver_usuarios(referencias):
+    """`{referencia: (pk, rol)}` para referencias por ID, username, email o RUN."""
+    if not referencias:
+        return {}
+    ids = [int(r) for r in referencias if r.isdigit()]
+    # Email y RUN se guardan normalizados: cada forma canónica apunta a las referencias escritas así
+    # (una referencia solo con dígitos es un ID, no un RUN sin guion)
+    canonicas = {}
+    for referencia in referencias:
+        if '@' in referencia:
+            canonica = email_canonico(referencia)
+        else:
+            canonica = None if referencia.isdigit() else run_canonico(referencia)
+        if canonica:
+            canonicas.setdefault(canonica, set()).add(referencia)
+    encontrados = {}
+    for pk, rol, *claves in User.objects.filter(
+            Q(pk__in=ids) | Q(username__in=referencias) | Q(email__in=canonicas) | Q(run__in=canonicas)
+    ).values_list('pk', 'rol', 'username', 'email', 'run'):
+        for clave in (str(pk), *claves):
+            for referencia in {clave} | canonicas.get(clave, set()):
+                if referencia in referencias:
+                    encontrados[referencia] = (pk, rol)
+    return encontrados
+
+
+def _resolver_por_nombre(modelo, referencias):
+    """`{referencia: pk}` para referencias por ID o nombre exacto."""
+    if not referencias:
+        return {}
+    ids = [int(r) for r in referencias if r.isdigit()]
+    encontrados = {}
+    for pk, nombre in modelo.objects.filter(Q(pk__in=ids) | Q(nombre__in=referencias)).values_list('pk', 'nombre'):
+        for clave in (str(pk), nombre):
+            if clave in referencias:
+                encontrados[clave] = pk
+    return encontrados
+
+
+def _validar_lote(lote, cesfam_defecto, rechazar):
+    """Resuelve las referencias del lote y devuelve las citas candidatas con su número de línea."""
+    usuarios, servicios, cesfams = set(), set(), set()
+    for _, fila, error in lote:
+        if error is None:
+            usuarios.update((_texto(fila.get('paciente')), _texto(fila.get('profesional'))))
+            servicios.add(_texto(fila.get('servicio')))
+            cesfams.add(_texto(fila.get('cesfam')))
+    usuarios = _resolver_usuarios(usuarios - {''})
+    servicios = _resolver_por_nombre(Servicio, servicios - {''})
+    cesfams = _resolver_por_nombre(Cesfam, cesfams - {''})
+    tz = timezone.get_current_timezone()
+
+    candidatos = []
+    for numero, fila, error in lote:
+        if error:
+            rechazar(numero, fila, error)
+            continue
+        paciente_id, paciente_rol = usuarios.get(_texto(fila.get('paciente')), (None, None))
+        profesional_id, profesional_rol = usuarios.get(_texto(fila.get('profesional')), (None, None))
+        servicio_id = servicios.get(_texto(fila.get('servicio')))
+        cesfam = _texto(fila.get('cesfam'))
+        cesfam_id = cesfams.get(cesfam) if cesfam else cesfam_defecto
+        fecha_hora = parse_datetime(_texto(fila.get('fecha_hora'))) if fila.get('fecha_hora') else None
+
+        if paciente_rol != User.ROL_PACIENTE:
+            motivo = 'Paciente no encontrado.'
+        elif profesional_rol != User.ROL_PROFESIONAL:
+            motivo = 'Profesional no encontrado.'
+        elif servicio_id is None:
+            motivo = 'Servicio no encontrado.'
+        elif cesfam_id is None:
+            motivo = 'CESFAM no encontrado.'
+        elif fecha_hora is None:
+            motivo = 'Fecha y hora inválida.'
+        else:
+            if timezone.is_naive(fecha_hora):
+                fecha_hora = timezone.make_aware(fecha_hora, tz)
+            candidatos.append((numero, fila, Cita(
+                paciente_id=paciente_id,
+                profesional_id=profesional_id,
+                servicio_id=servicio_id,
+                cesfam_id=cesfam_id,
+                fecha_hora=fecha_hora,
+            )))
+            continue
+        rechazar(numero, fila, motivo)
+    return candidatos
+
+
+def _separar_choques(candidatos, duracion):
+    """
+    Separa las candidatas que se solapan con una cita existente del profesional
+    (una sola consulta para todo el lote) o con otra cita anterior del mismo lote.
+    """
+    if not candidatos:
+        return [], []
+    horas = [cita.fecha_hora for _, _, cita in candidatos]
+    ocupadas = {}
+    for profesional_id, fecha_hora in Cita.objects.filter(
+            profesional_id__in={cita.profesional_id for _, _, cita in candidatos},
+            fecha_hora__gt=min(horas) - duracion,
+            fecha_hora__lt=max(horas) + duracion,
+    ).values_list('profesional_id', 'fecha_hora'):
+        ocupadas.setdefault(profesional_id, []).append(fecha_hora)
+    for lista in ocupadas.values():
+        lista.sort()
+
+    validas, choques = [], []
+    for candidato in candidatos:
+        cita = candidato[2]
+        lista = ocupadas.setdefault(cita.profesional_id, [])
+        if disponibilidad.esta_ocupado(cita.fecha_hora, lista, duracion):
+            choques.append(candidato)
+        else:
+            insort(lista, cita.fecha_hora)
+            validas.append(candidato)
+    return validas, choques
+
+
+def _actualizar_agenda(citas, duracion):
+    """Actualiza la agenda y el caché de los profesionales con citas desde esta semana en adelante."""
+    tz = timezone.get_current_timezone()
+    hoy = timezone.localdate()
+    desde = hoy - timedelta(days=hoy.weekday())
+    fechas = {}
+    for cita in citas:
+        local = cita.fecha_hora.astimezone(tz)
+        if (local + duracion).date() < desde:
+            continue
+        fechas.setdefault(cita.profesional_id, set()).update(
+            (local + delta).date() for delta in (-duracion, timedelta(0), duracion)
+        )
+    for profesional_id, dias in fechas.items():
+        agenda.regenerar_fechas(profesional_id, dias)
+        cache_disponibilidad.invalidar_profesional(profesional_id)
+
+
+def _importar_lote(lote, cesfam_defecto, rechazar, batch_size, duracion):
+    candidatos = _validar_lote(lote, cesfam_defecto, rechazar)
+    for intento in range(2):
+        validas, choques = _separar_choques(candidatos, duracion)
+        try:
+            with transaction.atomic():
+                Cita.objects.bulk_create([cita for _, _, cita in validas], batch_size=batch_size)
+                metricas.registrar_citas(
+                    (cita.profesional_id, cita.servicio_id, cita.cesfam_id, cita.fecha_hora) for _, _, cita in validas
+                )
+            break
+        except IntegrityError as error:
+            # Otra reserva tomó un bloque mientras se importaba: se vuelve a revisar el lote
+            if intento or not reservas.es_choque_de_horario(error):
+                raise
+    for numero, fila, _ in choques:
+        rechazar(numero, fila, 'Choque de horario con otra cita del profesional.')
+    _actualizar_agenda([cita for _, _, cita in validas], duracion)
+    return len(validas)
+
+
+def importar_citas(filas, rechazar=None, tamano_lote=1000, batch_size=1000, duracion=disponibilidad.DURACION_CITA):
+    """
+    Importa las filas entregadas por `leer_filas`. Las columnas son `paciente`,
+    `profesional` (ID, username, email o RUN), `servicio`, `cesfam` (ID o
+    nombre; si falta se usa el primer CESFAM) y `fecha_hora` (ISO 8601; sin
+    zona horaria se interpreta en la hora local). Se admiten fechas pasadas
+    para poder migrar el historial.
+
+    Devuelve un diccionario con la cantidad de filas leídas, creadas y rechazadas.
+    """
+    resultado = {'leidas': 0, 'creadas': 0, 'rechazadas': 0}
+
+    def _rechazar(numero, fila, motivo):
+        resultado['rechazadas'] += 1
+        if rechazar:
+            rechazar(numero, fila, motivo)
+
+    cesfam_defecto = Cesfam.objects.order_by('pk').values_list('pk', flat=True).first()
+    lote = []
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) >= tamano_lote:
+            resultado['creadas'] += _importar_lote(lote, cesfam_defecto, _rechazar, batch_size, duracion)
+            resultado['leidas'] += len(lote)
+            lote = []
+    if lote:
+        resultado['creadas'] += _importar_lote(lote, cesfam_defecto, _rechazar, batch_size, duracion)
+        resultado['leidas'] += len(lote)
+    return resultado
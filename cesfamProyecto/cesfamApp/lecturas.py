@@ -0,0 +1,91 @@
+"""
+Estado de lectura de la mensajería a partir de marcas por participante
+(`ConversationRead`).
+
+Cada participante tiene a lo más una fila por conversación con el id del
+último mensaje que leyó; la marca solo avanza. De ella se deriva todo lo demás:
+    - un mensaje está leído por un usuario si su id es menor o igual a la marca;
+    - un usuario está al día en una conversación (`is_read_by` en la API) si su
+      marca alcanza al último mensaje, o si la conversación no tiene mensajes y
+      ya tiene marca (quien la creó);
+    - los no leídos de un usuario son los mensajes de otros sobre su marca.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, IntegerField, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import tiempo_real
+from .models import ConversationRead, Message
+
+
+def no_leidos(user):
+    """Subconsulta con cuántos mensajes de otros hay sobre la marca del usuario en la conversación de `OuterRef('pk')`."""
+    marca = ConversationRead.objects.filter(
+        conversation=OuterRef('conversation'), user=user,
+    ).values('last_read_message_id')[:1]
+    mensajes = Message.objects.filter(
+        conversation=OuterRef('pk'), id__gt=Coalesce(Subquery(marca), 0),
+    ).exclude(sender=user).order_by().values('conversation').annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(mensajes, output_field=IntegerField()), 0)
+
+
+def avanzar(conversation_id, user_id, hasta_id, avisar=True):
+    """
+    Deja la marca del usuario en al menos `hasta_id`, sin retrocederla. Son
+    dos consultas sin importar cuántos mensajes quedan leídos: un INSERT que
+    se ignora si la fila ya existe y un UPDATE que solo la sube. Con `avisar`
+    publica la lectura en tiempo real al confirmarse la transacción.
+    """
+    ConversationRead.objects.bulk_create(
+        [ConversationRead(conversation_id=conversation_id, user_id=user_id, last_read_message_id=hasta_id)],
+        ignore_conflicts=True,
+    )
+    ConversationRead.objects.filter(
+        conversation_id=conversation_id, user_id=user_id, last_read_message_id__lt=hasta_id,
+    ).update(last_read_message_id=hasta_id, read_at=timezone.now())
+    if avisar:
+        transaction.on_commit(lambda: tiempo_real.publicar_lectura(conversation_id, user_id, hasta_id))
+
+
+def marcar_conversacion(conversation, user, hasta_id=None):
+    """
+    Marca como leídos por `user` los mensajes de la conversación hasta
+    `hasta_id` (o todos). Devuelve cuántos mensajes de otros pasaron a leídos.
+    """
+    anterior = ConversationRead.objects.filter(conversation=conversation, user=user).values_list(
+        'last_read_message_id', flat=True,
+    ).first() or 0
+    mensajes = conversation.messages.filter(id__gt=anterior)
+    if hasta_id is not None:
+        mensajes = mensajes.filter(id__lte=hasta_id)
+    resumen = mensajes.aggregate(ultimo=Max('id'), marcados=Count('id', filter=~Q(sender=user)))
+    with transaction.atomic():
+        avanzar(conversation.pk, user.pk, resumen['ultimo'] or anterior)
+    return resumen['marcados']
+
+
+def lectores(message, marcas):
+    """Usuarios que leyeron `message`, dadas las marcas (con `user`) de su conversación."""
+    return [marca.user for marca in marcas if marca.last_read_message_id >= message.id]
+
+
+def al_dia(ultimo_id, marcas):
+    """Usuarios cuya marca alcanza al último mensaje (`ultimo_id`, 0 si no hay mensajes)."""
+    return [marca.user for marca in marcas if marca.last_read_message_id >= ultimo_id]
+
+
+def usuarios_al_dia(conversation):
+    """Consulta con los usuarios al día en la conversación (lo que la API muestra en `is_read_by`)."""
+    ultimo = conversation.messages.aggregate(ultimo=Max('id'))['ultimo'] or 0
+    return get_user_model().objects.filter(
+        conversation_reads__conversation=conversation, conversation_reads__last_read_message_id__gte=ultimo,
+    )
+
+
+def lectores_de(message):
+    """Consulta con los usuarios que leyeron `message` (lo que la API muestra en `read_by`)."""
+    return get_user_model().objects.filter(
+        conversation_reads__conversation=message.conversation_id, conversation_reads__last_read_message_id__gte=message.pk,
+    )
@@ -0,0 +1,58 @@
+import sys
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cesfamApp import importacion
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa citas desde un archivo CSV o NDJSON en streaming, por lotes. '
+        'Columnas: paciente, profesional, servicio, cesfam, fecha_hora. '
+        'Las filas rechazadas (referencias inválidas o choques de horario) se escriben en un archivo aparte.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Archivo .csv, .ndjson o .jsonl ("-" para leer de la entrada estándar).')
+        parser.add_argument('--formato', choices=importacion.FORMATOS,
+                            help='Formato del archivo. Por defecto se deduce de la extensión.')
+        parser.add_argument('--rechazos', help='Archivo CSV de rechazos. Por defecto, <archivo>.rechazos.csv.')
+        parser.add_argument('--tamano-lote', type=int, default=1000,
+                            help='Filas por lote (una consulta por tabla y lote).')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Cantidad de filas por INSERT.')
+
+    def handle(self, *args, **options):
+        archivo = options['archivo']
+        formato = options['formato'] or importacion.detectar_formato(archivo)
+        if archivo == '-':
+            rechazos = Path(options['rechazos'] or 'rechazos.csv')
+        else:
+            if not Path(archivo).exists():
+                raise CommandError(f'No existe el archivo {archivo}.')
+            rechazos = Path(options['rechazos'] or f'{archivo}.rechazos.csv')
+
+        inicio = time.perf_counter()
+        entrada = sys.stdin if archivo == '-' else open(archivo, encoding='utf-8', newline='')
+        try:
+            with rechazos.open('w', encoding='utf-8', newline='') as salida:
+                resultado = importacion.importar_citas(
+                    importacion.leer_filas(entrada, formato),
+                    rechazar=importacion.EscritorRechazos(salida),
+                    tamano_lote=options['tamano_lote'],
+                    batch_size=options['batch_size'],
+                )
+        finally:
+            if entrada is not sys.stdin:
+                entrada.close()
+        segundos = time.perf_counter() - inicio
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado['creadas']} citas importadas de {resultado['leidas']} filas en {segundos:.2f} s "
+            f"({resultado['leidas'] / segundos if segundos else 0:.0f} filas/s)."
+        ))
+        if resultado['rechazadas']:
+            self.stdout.write(self.style.WARNING(f"{resultado['rechazadas']} filas rechazadas; ver {rechazos}."))
+        else:
+            rechazos.unlink()
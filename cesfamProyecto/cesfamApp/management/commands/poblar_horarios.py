@@ -0,0 +1,243 @@
+import csv
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from cesfamApp import agenda, cache_disponibilidad, catalogo
+from cesfamApp.models import Horario
+from cesfamApp.signals import sincronizacion_suspendida
+
+User = get_user_model()
+
+DIAS = {
+    'lun': Horario.LUNES, 'mar': Horario.MARTES, 'mie': Horario.MIERCOLES, 'mié': Horario.MIERCOLES,
+    'jue': Horario.JUEVES, 'vie': Horario.VIERNES, 'sab': Horario.SABADO, 'sáb': Horario.SABADO,
+    'dom': Horario.DOMINGO,
+}
+
+
+def parsear_dia(valor):
+    valor = str(valor).strip().lower()
+    if valor.isdigit() and 0 <= int(valor) <= 6:
+        return int(valor)
+    if valor[:3] in DIAS:
+        return DIAS[valor[:3]]
+    raise CommandError(f'Día inválido: "{valor}". Usa 0-6 o lun, mar, mie, jue, vie, sab, dom.')
+
+
+def parsear_dias(valor):
+    """Acepta '0-4', 'lun-vie', '0,2,4', 'lunes,miercoles' o una lista."""
+    partes = valor if isinstance(valor, (list, tuple)) else str(valor).split(',')
+    dias = set()
+    for parte in partes:
+        parte = str(parte).strip()
+        if '-' in parte:
+            desde, hasta = (parsear_dia(p) for p in parte.split('-', 1))
+            if desde > hasta:
+                raise CommandError(f'Rango de días inválido: "{parte}".')
+            dias.update(range(desde, hasta + 1))
+        else:
+            dias.add(parsear_dia(parte))
+    return sorted(dias)
+
+
+def parsear_bloque(valor):
+    """Convierte '08:00-13:00' en (time(8, 0), time(13, 0))."""
+    try:
+        inicio, fin = (datetime.strptime(p.strip(), '%H:%M').time() for p in str(valor).split('-', 1))
+    except ValueError:
+        raise CommandError(f'Bloque inválido: "{valor}". Usa el formato HH:MM-HH:MM.')
+    if inicio >= fin:
+        raise CommandError(f'Bloque inválido: "{valor}". La hora de inicio debe ser anterior a la de término.')
+    return inicio, fin
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera los Horario semanales de muchos profesionales a partir de una especificación compacta, '
+        'ya sea por argumentos o desde un archivo YAML/CSV, insertándolos con bulk_create.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archivo', help=(
+            'Archivo .yaml/.yml o .csv con la especificación. YAML: lista de entradas con "profesionales" '
+            '("*", lista de IDs/usernames/emails o {especialidad: X}), "dias" y "bloques". '
+            'CSV: columnas profesional,dias,hora_inicio,hora_fin (profesional admite "*" o "especialidad:X").'
+        ))
+        parser.add_argument('--profesional', action='append', dest='profesionales',
+                            help='ID, username o email del profesional (se puede repetir). Por defecto, todos.')
+        parser.add_argument('--especialidad', help='Solo profesionales con esta especialidad.')
+        parser.add_argument('--dias', default='lun-vie', help='Días de la semana, p. ej. "lun-vie" o "0,2,4".')
+        parser.add_argument('--bloque', action='append', dest='bloques',
+                            help='Bloque horario HH:MM-HH:MM (se puede repetir). Por defecto 08:00-13:00 y 14:00-17:00.')
+        parser.add_argument('--replace', action='store_true',
+                            help='Elimina los horarios existentes de los profesionales afectados antes de insertar.')
+        parser.add_argument('--dry-run', action='store_true', help='Muestra lo que se haría sin escribir en la base.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Cantidad de filas por INSERT.')
+        parser.add_argument('--sin-agenda', action='store_true',
+                            help='No regenera la agenda materializada (ejecutar luego regenerar_agenda).')
+
+    # --------------------------------------------------------------------------
+    # Lectura de la especificación
+    # --------------------------------------------------------------------------
+
+    def leer_especificacion(self, options):
+        """Devuelve una lista de entradas `(selector, dias, bloques)`."""
+        if not options['archivo']:
+            if options['profesionales']:
+                selector = list(options['profesionales'])
+            elif options['especialidad']:
+                selector = {'especialidad': options['especialidad']}
+            else:
+                selector = '*'
+            bloques = options['bloques'] or ['08:00-13:00', '14:00-17:00']
+            return [(selector, parsear_dias(options['dias']), [parsear_bloque(b) for b in bloques])]
+
+        ruta = Path(options['archivo'])
+        if not ruta.exists():
+            raise CommandError(f'No existe el archivo {ruta}.')
+        if ruta.suffix.lower() in ('.yaml', '.yml'):
+            return self.leer_yaml(ruta)
+        if ruta.suffix.lower() == '.csv':
+            return self.leer_csv(ruta)
+        raise CommandError('El archivo debe ser .yaml, .yml o .csv.')
+
+    def leer_yaml(self, ruta):
+        try:
+            import yaml
+        except ImportError:
+            raise CommandError('Se necesita PyYAML para leer archivos YAML (pip install PyYAML).')
+        with ruta.open(encoding='utf-8') as f:
+            datos = yaml.safe_load(f) or []
+        if isinstance(datos, dict):
+            datos = [datos]
+
+        entradas = []
+        for entrada in datos:
+            selector = entrada.get('profesionales', '*')
+            if isinstance(selector, (str, int)) and selector != '*':
+                selector = [selector]
+            bloques = entrada.get('bloques') or []
+            if isinstance(bloques, str):
+                bloques = [bloques]
+            entradas.append((selector, parsear_dias(entrada.get('dias', 'lun-vie')), [parsear_bloque(b) for b in bloques]))
+        return entradas
+
+    def leer_csv(self, ruta):
+        entradas = []
+        with ruta.open(encoding='utf-8', newline='') as f:
+            for fila in csv.DictReader(f):
+                profesional = fila['profesional'].strip()
+                if profesional == '*':
+                    selector = '*'
+                elif profesional.startswith('especialidad:'):
+                    selector = {'especialidad': profesional.split(':', 1)[1].strip()}
+                else:
+                    selector = [profesional]
+                bloque = parsear_bloque(f"{fila['hora_inicio']}-{fila['hora_fin']}")
+                entradas.append((selector, parsear_dias(fila['dias']), [bloque]))
+        return entradas
+
+    # --------------------------------------------------------------------------
+    # Resolución de profesionales (una consulta por tipo de selector)
+    # --------------------------------------------------------------------------
+
+    def resolver_profesionales(self, entradas):
+        profesionales = User.objects.filter(rol=User.ROL_PROFESIONAL)
+        referencias = {str(r) for selector, _, _ in entradas if isinstance(selector, list) for r in selector}
+        especialidades = {s['especialidad'] for s, _, _ in entradas if isinstance(s, dict)}
+        todos = None
+
+        por_referencia = {}
+        if referencias:
+            ids = [int(r) for r in referencias if r.isdigit()]
+            for pk, username, email in profesionales.filter(
+                    Q(pk__in=ids) | Q(username__in=referencias) | Q(email__in=referencias)
+            ).values_list('pk', 'username', 'email'):
+                for clave in (str(pk), username, email):
+                    por_referencia[clave] = pk
+            desconocidos = sorted(referencias - por_referencia.keys())
+            if desconocidos:
+                raise CommandError(f'Profesionales no encontrados: {", ".join(desconocidos[:20])}')
+
+        por_especialidad = {}
+        if especialidades:
+            for pk, especialidad in profesionales.filter(especialidad__in=especialidades).values_list('pk', 'especialidad'):
+                por_especialidad.setdefault(especialidad, []).append(pk)
+
+        resultado = []
+        for selector, dias, bloques in entradas:
+            if selector == '*':
+                if todos is None:
+                    todos = list(profesionales.values_list('pk', flat=True))
+                ids = todos
+            elif isinstance(selector, dict):
+                ids = por_especialidad.get(selector['especialidad'], [])
+            else:
+                ids = [por_referencia[str(r)] for r in selector]
+            resultado.append((ids, dias, bloques))
+        return resultado
+
+    # --------------------------------------------------------------------------
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        entradas = self.resolver_profesionales(self.leer_especificacion(options))
+
+        filas = {}
+        for ids, dias, bloques in entradas:
+            for profesional_id in ids:
+                for dia in dias:
+                    for hora_inicio, hora_fin in bloques:
+                        filas[(profesional_id, dia, hora_inicio, hora_fin)] = None
+        profesional_ids = sorted({profesional_id for profesional_id, *_ in filas})
+        batch_size = options['batch_size']
+
+        if not options['replace'] and profesional_ids:
+            # Omitir los horarios que ya existen, consultando por lotes de profesionales
+            for i in range(0, len(profesional_ids), batch_size):
+                for existente in Horario.objects.filter(
+                        profesional_id__in=profesional_ids[i:i + batch_size]
+                ).values_list('profesional_id', 'dia', 'hora_inicio', 'hora_fin'):
+                    filas.pop(existente, None)
+
+        if options['dry_run']:
+            accion = 'reemplazar los horarios de' if options['replace'] else 'agregar horarios a'
+            self.stdout.write(f'[dry-run] Se insertarían {len(filas)} horarios para {accion} {len(profesional_ids)} profesionales.')
+            return
+
+        # La agenda y el caché se actualizan al final, una vez por profesional
+        with transaction.atomic(), sincronizacion_suspendida():
+            if options['replace']:
+                for i in range(0, len(profesional_ids), batch_size):
+                    Horario.objects.filter(profesional_id__in=profesional_ids[i:i + batch_size]).delete()
+            Horario.objects.bulk_create(
+                (
+                    Horario(profesional_id=profesional_id, dia=dia, hora_inicio=hora_inicio, hora_fin=hora_fin)
+                    for profesional_id, dia, hora_inicio, hora_fin in filas
+                ),
+                batch_size=batch_size,
+            )
+        segundos = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(filas)} horarios insertados para {len(profesional_ids)} profesionales '
+            f'en {segundos:.2f} s ({len(filas) / segundos if segundos else 0:.0f} filas/s).'
+        ))
+
+        catalogo.registrar_cambio(catalogo.HORARIOS)
+        if not options['sin_agenda']:
+            inicio = time.perf_counter()
+            bloques = 0
+            for i in range(0, len(profesional_ids), 500):
+                bloques += agenda.regenerar_agenda(profesional_ids[i:i + 500], batch_size=batch_size)
+            self.stdout.write(f'Agenda regenerada: {bloques} bloques en {time.perf_counter() - inicio:.2f} s.')
+        # Después de regenerar: el caché de disponibilidad se vuelve a calcular desde la agenda
+        for profesional_id in profesional_ids:
+            cache_disponibilidad.invalidar_profesional(profesional_id)
+        if options['sin_agenda']:
+            self.stdout.write('Agenda materializada sin actualizar; ejecuta regenerar_agenda.')
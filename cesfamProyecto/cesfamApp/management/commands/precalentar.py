@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from cesfamApp import precalentamiento
+
+
+class Command(BaseCommand):
+    help = (
+        'Compila las plantillas, arma el resolver de URLs, abre las conexiones a la base y llena el caché de '
+        'disponibilidad. Lo que queda en memoria es de este proceso: en producción lo hace cada worker con el '
+        'hook de gunicorn.conf.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paso', action='append', dest='pasos', choices=precalentamiento.PASOS,
+                            help='Paso a ejecutar (se puede repetir). Por defecto, todos.')
+        parser.add_argument('--profesionales', type=int, default=None,
+                            help='Máximo de profesionales cuya disponibilidad se calcula. Por defecto, todos.')
+
+    def handle(self, *args, **options):
+        resultado = precalentamiento.precalentar(
+            options['pasos'] or precalentamiento.PASOS, limite_profesionales=options['profesionales'],
+        )
+        for paso, (cantidad, segundos) in resultado.items():
+            if paso == 'plantillas':
+                cantidad, errores = cantidad
+                for error in errores:
+                    self.stderr.write(self.style.WARNING(f'Plantilla con errores: {error}'))
+            self.stdout.write(f'{paso}: {cantidad} en {segundos * 1000:.0f} ms')
+        self.stdout.write(self.style.SUCCESS('Precalentamiento terminado.'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cesfamApp import metricas
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye desde la tabla de citas el resumen de métricas (ResumenCitas) '
+        'que usa dashboard_metricas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verificar', action='store_true',
+                            help='Solo compara el resumen con las citas y termina con error si hay diferencias.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Cantidad de filas por INSERT.')
+
+    def handle(self, *args, **options):
+        if options['verificar']:
+            diferencias = metricas.diferencias()
+            for (periodo, fecha, profesional_id, servicio_id, cesfam_id), esperado, actual in diferencias[:50]:
+                self.stdout.write(
+                    f'{periodo} {fecha} profesional={profesional_id} servicio={servicio_id} '
+                    f'cesfam={cesfam_id}: esperado {esperado}, actual {actual}'
+                )
+            if diferencias:
+                raise CommandError(f'{len(diferencias)} filas del resumen no coinciden con las citas.')
+            self.stdout.write(self.style.SUCCESS('El resumen de métricas coincide con las citas.'))
+            return
+
+        total = metricas.reconstruir(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Resumen de métricas reconstruido: {total} filas.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from cesfamApp import agenda
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye desde cero la agenda materializada (BloqueAgenda) para los próximos '
+        f'{agenda.HORIZONTE_DIAS} días. Debe ejecutarse una vez al día (cron), después de medianoche, '
+        'para agregar el último día del horizonte.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profesional', type=int, action='append', dest='profesionales',
+                            help='ID de un profesional a regenerar (se puede repetir). Por defecto, todos.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Cantidad de filas por INSERT.')
+
+    def handle(self, *args, **options):
+        total = agenda.regenerar_agenda(options['profesionales'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Agenda regenerada: {total} bloques.'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cesfamApp import agenda
+
+
+class Command(BaseCommand):
+    help = 'Compara la agenda materializada (BloqueAgenda) con un cálculo desde cero y muestra las diferencias.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profesional', type=int, action='append', dest='profesionales',
+                            help='ID de un profesional a verificar (se puede repetir). Por defecto, todos.')
+        parser.add_argument('--reparar', action='store_true',
+                            help='Regenera la agenda de los profesionales con diferencias.')
+
+    def handle(self, *args, **options):
+        diferencias = agenda.diferencias_agenda(options['profesionales'])
+        if not diferencias:
+            self.stdout.write(self.style.SUCCESS('La agenda materializada está consistente.'))
+            return
+
+        for profesional_id, inicio, esperado, actual in diferencias:
+            self.stdout.write(f'Profesional {profesional_id} {inicio.isoformat()}: esperado={esperado} actual={actual}')
+
+        if options['reparar']:
+            afectados = sorted({profesional_id for profesional_id, *_ in diferencias})
+            agenda.regenerar_agenda(afectados)
+            self.stdout.write(self.style.SUCCESS(f'Agenda regenerada para {len(afectados)} profesionales.'))
+            return
+        raise CommandError(f'{len(diferencias)} bloques difieren del cálculo desde cero.')
@@ -0,0 +1,187 @@
+"""
+Métricas de citas pre-agregadas (`ResumenCitas`).
+
+Cada cita suma 1 en tres filas del resumen: la de su día, su semana (desde el
+lunes) y su mes, para su profesional, servicio y CESFAM, usando la fecha local.
+Las señales de `Cita` llaman a `registrar_citas` con +1 o -1; las operaciones
+masivas que no disparan señales deben llamarlo ellas mismas. `reconstruir`
+(comando `reconstruir_metricas`) vuelve a calcular todo desde la tabla `cita`.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Cita, ResumenCitas
+
+PERIODOS = (ResumenCitas.DIA, ResumenCitas.SEMANA, ResumenCitas.MES)
+
+
+def inicio_periodo(fecha, periodo):
+    if periodo == ResumenCitas.SEMANA:
+        return fecha - timedelta(days=fecha.weekday())
+    if periodo == ResumenCitas.MES:
+        return fecha.replace(day=1)
+    return fecha
+
+
+def _aplicar(deltas):
+    """
+    Aplica `{clave: delta}` con un número fijo de consultas: lee y bloquea las
+    filas existentes, les escribe el nuevo total con un solo upsert (más rápido
+    que `bulk_update`, que arma un CASE por fila) y crea las que faltan. Si otra
+    transacción crea una fila nueva a la vez, el INSERT falla en vez de pisarla.
+
+    MySQL no admite el upsert con columnas de conflicto (`ON CONFLICT (...)`):
+    ahí se usa `bulk_update`, que da lo mismo porque las filas ya están
+    bloqueadas.
+    """
+    existentes = {}
+    for fila in ResumenCitas.objects.select_for_update().filter(
+            periodo__in={clave[0] for clave in deltas},
+            fecha__in={clave[1] for clave in deltas},
+            profesional_id__in={clave[2] for clave in deltas},
+    ).order_by('pk'):
+        clave = (fila.periodo, fila.fecha, fila.profesional_id, fila.servicio_id, fila.cesfam_id)
+        if clave in deltas:
+            existentes[clave] = fila
+
+    nuevas = []
+    for clave, delta in deltas.items():
+        if clave in existentes:
+            existentes[clave].total += delta
+        elif delta > 0:
+            periodo, fecha, profesional_id, servicio_id, cesfam_id = clave
+            nuevas.append(ResumenCitas(periodo=periodo, fecha=fecha, profesional_id=profesional_id,
+                                       servicio_id=servicio_id, cesfam_id=cesfam_id, total=delta))
+    if connections[ResumenCitas.objects.db].features.supports_update_conflicts_with_target:
+        ResumenCitas.objects.bulk_create(
+            existentes.values(),
+            update_conflicts=True,
+            unique_fields=['periodo', 'fecha', 'profesional', 'servicio', 'cesfam'],
+            update_fields=['total'],
+            batch_size=1000,
+        )
+    else:
+        ResumenCitas.objects.bulk_update(existentes.values(), ['total'], batch_size=1000)
+    ResumenCitas.objects.bulk_create(nuevas, batch_size=1000)
+
+
+def registrar_citas(citas, signo=1):
+    """
+    Suma (`signo=1`) o resta (`signo=-1`) las citas dadas en el resumen. `citas`
+    es un iterable de tuplas `(profesional_id, servicio_id, cesfam_id, fecha_hora)`.
+    """
+    tz = timezone.get_current_timezone()
+    deltas = Counter()
+    for profesional_id, servicio_id, cesfam_id, fecha_hora in citas:
+        fecha = fecha_hora.astimezone(tz).date()
+        for periodo in PERIODOS:
+            deltas[(periodo, inicio_periodo(fecha, periodo), profesional_id, servicio_id, cesfam_id)] += signo
+    deltas = {clave: delta for clave, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    for intento in range(2):
+        try:
+            with transaction.atomic():
+                _aplicar(deltas)
+            return
+        except IntegrityError:
+            # Otra transacción creó una de las filas nuevas: se vuelve a leer
+            if intento:
+                raise
+
+
+def reconstruir(batch_size=1000):
+    """Vuelve a calcular el resumen completo con una consulta agregada por período. Devuelve las filas creadas."""
+    tz = timezone.get_current_timezone()
+    truncar = {
+        ResumenCitas.DIA: TruncDate('fecha_hora', tzinfo=tz),
+        ResumenCitas.SEMANA: TruncWeek('fecha_hora', tzinfo=tz),
+        ResumenCitas.MES: TruncMonth('fecha_hora', tzinfo=tz),
+    }
+    filas = []
+    for periodo, funcion in truncar.items():
+        for fecha, profesional_id, servicio_id, cesfam_id, total in Cita.objects.annotate(
+                periodo_inicio=funcion,
+        ).values_list('periodo_inicio', 'profesional_id', 'servicio_id', 'cesfam_id').annotate(
+                total=Count('id'),
+        ).order_by().iterator():
+            if isinstance(fecha, datetime):  # TruncWeek y TruncMonth devuelven datetime
+                fecha = timezone.localtime(fecha, tz).date()
+            filas.append(ResumenCitas(
+                periodo=periodo, fecha=fecha, profesional_id=profesional_id,
+                servicio_id=servicio_id, cesfam_id=cesfam_id, total=total,
+            ))
+    with transaction.atomic():
+        ResumenCitas.objects.all().delete()
+        ResumenCitas.objects.bulk_create(filas, batch_size=batch_size)
+    return len(filas)
+
+
+def diferencias():
+    """Filas del resumen que no coinciden con un recálculo desde `cita`: `[(clave, esperado, actual)]`."""
+    actuales = {
+        (periodo, fecha, p, s, c): total
+        for periodo, fecha, p, s, c, total in ResumenCitas.objects.exclude(total=0).values_list(
+            'periodo', 'fecha', 'profesional_id', 'servicio_id', 'cesfam_id', 'total',
+        )
+    }
+    esperados = Counter()
+    tz = timezone.get_current_timezone()
+    for p, s, c, fecha_hora in Cita.objects.values_list('profesional_id', 'servicio_id', 'cesfam_id', 'fecha_hora').iterator():
+        fecha = fecha_hora.astimezone(tz).date()
+        for periodo in PERIODOS:
+            esperados[(periodo, inicio_periodo(fecha, periodo), p, s, c)] += 1
+    return sorted(
+        (clave, esperados.get(clave, 0), actuales.get(clave, 0))
+        for clave in esperados.keys() | actuales.keys()
+        if esperados.get(clave, 0) != actuales.get(clave, 0)
+    )
+
+
+def _serie(periodo, inicios, clave):
+    """Totales de los períodos dados, incluidos los que no tienen citas."""
+    totales = dict(
+        ResumenCitas.objects.filter(periodo=periodo, fecha__in=inicios)
+        .values_list('fecha').annotate(total=Sum('total')).order_by()
+    )
+    return [{clave: inicio, 'total': totales.get(inicio, 0)} for inicio in inicios]
+
+
+def contexto_metricas(hoy=None):
+    """Contexto de `dashboard_metricas`, leído solo desde `ResumenCitas`."""
+    hoy = hoy or timezone.localdate()
+    dias = [hoy - timedelta(days=i) for i in range(6, -1, -1)]
+    lunes = inicio_periodo(hoy, ResumenCitas.SEMANA)
+    semanas = [lunes - timedelta(weeks=i) for i in range(3, -1, -1)]
+    meses = []
+    mes = inicio_periodo(hoy, ResumenCitas.MES)
+    for _ in range(6):
+        meses.insert(0, mes)
+        mes = (mes - timedelta(days=1)).replace(day=1)
+
+    # Los totales históricos salen de las filas mensuales, que son las menos
+    mensuales = ResumenCitas.objects.filter(periodo=ResumenCitas.MES)
+    carga_profesionales = [
+        {'nombre': f'{nombre} {apellido}'.strip() or username, 'total': total}
+        for nombre, apellido, username, total in mensuales.values_list(
+            'profesional__first_name', 'profesional__last_name', 'profesional__username',
+        ).annotate(total=Sum('total')).filter(total__gt=0).order_by('-total', 'profesional__username')
+    ]
+    return {
+        'citas_dia': _serie(ResumenCitas.DIA, dias, 'dia'),
+        'citas_semana': _serie(ResumenCitas.SEMANA, semanas, 'semana'),
+        'citas_mes': _serie(ResumenCitas.MES, meses, 'mes'),
+        'carga_profesionales': carga_profesionales,
+        'carga_servicios': list(
+            mensuales.values('servicio__nombre').annotate(total=Sum('total')).filter(total__gt=0).order_by('-total')
+        ),
+        'citas_cesfam': list(
+            mensuales.values('cesfam__nombre').annotate(total=Sum('total')).filter(total__gt=0).order_by('-total')
+        ),
+        'total_citas': mensuales.aggregate(total=Sum('total'))['total'] or 0,
+    }
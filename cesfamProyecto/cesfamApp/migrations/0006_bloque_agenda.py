@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cesfamApp', '0005_alter_mensaje_options_mensaje_message_type_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BloqueAgenda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inicio', models.DateTimeField(verbose_name='Inicio')),
+                ('fin', models.DateTimeField(verbose_name='Fin')),
+                ('estado', models.CharField(choices=[('libre', 'Libre'), ('ocupado', 'Ocupado')], default='libre', max_length=10, verbose_name='Estado')),
+                ('profesional', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bloques_agenda', to=settings.AUTH_USER_MODEL, verbose_name='Profesional')),
+            ],
+            options={
+                'verbose_name': 'Bloque de Agenda',
+                'verbose_name_plural': 'Bloques de Agenda',
+                'db_table': 'bloque_agenda',
+                'ordering': ['inicio'],
+                'indexes': [models.Index(fields=['profesional', 'estado', 'inicio'], name='bloque_agenda_disp_idx')],
+                'constraints': [models.UniqueConstraint(fields=('profesional', 'inicio'), name='bloque_agenda_profesional_inicio_uniq')],
+            },
+        ),
+    ]
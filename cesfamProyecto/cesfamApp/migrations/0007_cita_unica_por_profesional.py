@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:29
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def verificar_citas_duplicadas(apps, schema_editor):
+    """
+    La restricción única no se puede crear si ya hay citas duplicadas.
+    En vez de borrar citas de pacientes automáticamente, se informan para que
+    un administrador las resuelva antes de migrar.
+    """
+    Cita = apps.get_model('cesfamApp', 'Cita')
+    duplicadas = list(
+        Cita.objects.values('profesional_id', 'fecha_hora')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)[:20]
+    )
+    if duplicadas:
+        detalle = ', '.join(f"profesional {d['profesional_id']} el {d['fecha_hora']:%Y-%m-%d %H:%M}" for d in duplicadas)
+        raise RuntimeError(f'Existen citas duplicadas que deben resolverse antes de migrar: {detalle}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cesfamApp', '0006_bloque_agenda'),
+    ]
+
+    operations = [
+        migrations.RunPython(verificar_citas_duplicadas, reverse_code=migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['paciente', 'fecha_hora'], name='cita_paciente_fecha_hora_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cita',
+            constraint=models.UniqueConstraint(fields=('profesional', 'fecha_hora'), name='cita_profesional_fecha_hora_uniq'),
+        ),
+    ]
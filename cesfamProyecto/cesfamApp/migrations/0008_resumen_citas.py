@@ -0,0 +1,63 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:49
+
+from collections import Counter
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def poblar_resumen(apps, schema_editor):
+    """Carga el resumen con las citas existentes (igual que `metricas.reconstruir`)."""
+    Cita = apps.get_model('cesfamApp', 'Cita')
+    ResumenCitas = apps.get_model('cesfamApp', 'ResumenCitas')
+    tz = timezone.get_current_timezone()
+    totales = Counter()
+    for profesional_id, servicio_id, cesfam_id, fecha_hora in Cita.objects.values_list(
+            'profesional_id', 'servicio_id', 'cesfam_id', 'fecha_hora').iterator():
+        fecha = fecha_hora.astimezone(tz).date() if timezone.is_aware(fecha_hora) else fecha_hora.date()
+        for periodo, inicio in (
+                ('dia', fecha),
+                ('semana', fecha - timedelta(days=fecha.weekday())),
+                ('mes', fecha.replace(day=1)),
+        ):
+            totales[(periodo, inicio, profesional_id, servicio_id, cesfam_id)] += 1
+    ResumenCitas.objects.bulk_create(
+        (
+            ResumenCitas(periodo=periodo, fecha=fecha, profesional_id=profesional_id,
+                         servicio_id=servicio_id, cesfam_id=cesfam_id, total=total)
+            for (periodo, fecha, profesional_id, servicio_id, cesfam_id), total in totales.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cesfamApp', '0007_cita_unica_por_profesional'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenCitas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.CharField(choices=[('dia', 'Día'), ('semana', 'Semana'), ('mes', 'Mes')], max_length=6, verbose_name='Período')),
+                ('fecha', models.DateField(verbose_name='Inicio del período')),
+                ('total', models.IntegerField(default=0, verbose_name='Total de citas')),
+                ('cesfam', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cesfamApp.cesfam', verbose_name='CESFAM')),
+                ('profesional', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumen_citas', to=settings.AUTH_USER_MODEL, verbose_name='Profesional')),
+                ('servicio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cesfamApp.servicio', verbose_name='Servicio')),
+            ],
+            options={
+                'verbose_name': 'Resumen de Citas',
+                'verbose_name_plural': 'Resúmenes de Citas',
+                'db_table': 'resumen_citas',
+                'constraints': [models.UniqueConstraint(fields=('periodo', 'fecha', 'profesional', 'servicio', 'cesfam'), name='resumen_citas_uniq')],
+            },
+        ),
+        migrations.RunPython(poblar_resumen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cesfamApp', '0008_resumen_citas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['updated_at', 'id'], name='conversation_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'timestamp', 'id'], name='message_conv_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cesfamApp', '0009_indices_paginacion_mensajeria'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(fields=['destinatario', 'id'], name='notificacion_dest_id_idx'),
+        ),
+    ]
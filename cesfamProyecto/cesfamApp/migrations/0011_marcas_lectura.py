@@ -0,0 +1,80 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+# Conversaciones que se procesan por lote
+TAMANO_LOTE = 1000
+
+
+def colapsar_lecturas(apps, schema_editor):
+    """
+    Convierte las filas de `Message.read_by` y `Conversation.is_read_by` en una
+    marca por (conversación, usuario): el mayor mensaje que el usuario leyó, o
+    el último de la conversación si la tenía marcada como leída. Recorre las
+    conversaciones por lotes de ids para no cargar todas las filas a la vez.
+    """
+    Conversation = apps.get_model('cesfamApp', 'Conversation')
+    Message = apps.get_model('cesfamApp', 'Message')
+    ConversationRead = apps.get_model('cesfamApp', 'ConversationRead')
+    LecturaMensaje = Message.read_by.through
+    LecturaConversacion = Conversation.is_read_by.through
+    usuario_mensaje = Message.read_by.field.m2m_reverse_field_name() + '_id'
+    usuario_conversacion = Conversation.is_read_by.field.m2m_reverse_field_name() + '_id'
+
+    ultimo = 0
+    while True:
+        lote = list(Conversation.objects.filter(pk__gt=ultimo).order_by('pk').values_list('pk', flat=True)[:TAMANO_LOTE])
+        if not lote:
+            break
+        ultimo = lote[-1]
+
+        marcas = {}
+        for conversation_id, user_id, mensaje_id in LecturaMensaje.objects.filter(
+                message__conversation__gte=lote[0], message__conversation__lte=lote[-1],
+        ).values_list('message__conversation_id', usuario_mensaje).annotate(ultimo=Max('message_id')).order_by():
+            marcas[(conversation_id, user_id)] = mensaje_id
+        ultimos = dict(
+            Message.objects.filter(conversation__gte=lote[0], conversation__lte=lote[-1])
+            .values_list('conversation_id').annotate(ultimo=Max('id')).order_by()
+        )
+        for conversation_id, user_id in LecturaConversacion.objects.filter(
+                conversation__gte=lote[0], conversation__lte=lote[-1],
+        ).values_list('conversation_id', usuario_conversacion):
+            marcas[(conversation_id, user_id)] = max(marcas.get((conversation_id, user_id), 0), ultimos.get(conversation_id, 0))
+
+        ConversationRead.objects.bulk_create(
+            (
+                ConversationRead(conversation_id=conversation_id, user_id=user_id, last_read_message_id=mensaje_id)
+                for (conversation_id, user_id), mensaje_id in marcas.items()
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cesfamApp', '0010_notificacion_destinatario_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationRead',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0, verbose_name='Último mensaje leído')),
+                ('read_at', models.DateTimeField(auto_now=True, verbose_name='Fecha/Hora de Lectura')),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_marks', to='cesfamApp.conversation', verbose_name='Conversación')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_reads', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Lectura de Conversación',
+                'verbose_name_plural': 'Lecturas de Conversaciones',
+                'constraints': [models.UniqueConstraint(fields=('conversation', 'user'), name='conversation_read_uniq')],
+            },
+        ),
+        migrations.RunPython(colapsar_lecturas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cesfamApp', '0011_marcas_lectura'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='conversation',
+            name='is_read_by',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='read_by',
+        ),
+    ]
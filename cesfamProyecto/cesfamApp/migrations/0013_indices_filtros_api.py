@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cesfamApp', '0012_quitar_read_by'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['servicio', 'fecha_hora'], name='cita_servicio_fecha_hora_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['cesfam', 'fecha_hora'], name='cita_cesfam_fecha_hora_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['fecha_hora', 'id'], name='cita_fecha_hora_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='horario',
+            index=models.Index(fields=['profesional', 'dia'], name='horario_profesional_dia_idx'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:37
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Usuarios que se indexan por lote
+TAMANO_LOTE = 1000
+
+# Copia de cesfamApp.directorio.terminos tal como era al crear esta migración: las
+# migraciones no importan código de la aplicación, que puede cambiar después
+NOMBRE, EMAIL, RUN = 'n', 'e', 'r'
+
+
+def sin_tildes(texto):
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c)).lower()
+
+
+def normalizar_run(run):
+    return re.sub(r'[^0-9k]', '', (run or '').lower())
+
+
+def terminos(usuario):
+    pares = set()
+    for campo in (usuario.first_name, usuario.last_name, usuario.username):
+        pares.update((NOMBRE, palabra) for palabra in re.findall(r'[a-z0-9]+', sin_tildes(campo or '')))
+    if usuario.email:
+        pares.add((EMAIL, usuario.email.strip().lower()))
+    if normalizar_run(usuario.run):
+        pares.add((RUN, normalizar_run(usuario.run)))
+    return pares
+
+
+def indexar_usuarios(apps, schema_editor):
+    """Llena el índice del directorio con los usuarios existentes, por lotes de ids."""
+    CustomUser = apps.get_model('cesfamApp', 'CustomUser')
+    TerminoDirectorio = apps.get_model('cesfamApp', 'TerminoDirectorio')
+    ultimo = 0
+    while True:
+        lote = list(CustomUser.objects.filter(pk__gt=ultimo).order_by('pk').only(
+            'first_name', 'last_name', 'username', 'email', 'run', 'rol',
+        )[:TAMANO_LOTE])
+        if not lote:
+            break
+        ultimo = lote[-1].pk
+        TerminoDirectorio.objects.bulk_create(
+            (
+                TerminoDirectorio(usuario_id=usuario.pk, rol=usuario.rol, tipo=tipo, termino=termino[:254])
+                for usuario in lote for tipo, termino in terminos(usuario)
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cesfamApp', '0013_indices_filtros_api'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerminoDirectorio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rol', models.CharField(max_length=20, verbose_name='Rol')),
+                ('tipo', models.CharField(choices=[('n', 'Nombre'), ('e', 'Email'), ('r', 'RUN')], max_length=1, verbose_name='Tipo')),
+                ('termino', models.CharField(max_length=254, verbose_name='Término')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terminos_directorio', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Término del Directorio',
+                'verbose_name_plural': 'Términos del Directorio',
+                'db_table': 'termino_directorio',
+                'indexes': [models.Index(fields=['rol', 'termino'], name='directorio_rol_termino_idx')],
+            },
+        ),
+        migrations.RunPython(indexar_usuarios, migrations.RunPython.noop),
+    ]
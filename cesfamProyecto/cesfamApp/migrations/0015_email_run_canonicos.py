@@ -0,0 +1,104 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:43
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# Usuarios que se normalizan por lote
+TAMANO_LOTE = 1000
+
+
+# Copias de cesfamApp.models.run_canonico y email_canonico y de cesfamApp.directorio.terminos
+# tal como eran al crear esta migración: las migraciones no importan código de la aplicación
+def run_canonico(run):
+    limpio = re.sub(r'[^0-9K]', '', (run or '').upper())
+    cuerpo, dv = limpio[:-1].lstrip('0'), limpio[-1:]
+    if not cuerpo or not cuerpo.isdigit():
+        return None
+    return f"{cuerpo}-{dv}"
+
+
+def email_canonico(email):
+    return (email or '').strip().lower()
+
+
+NOMBRE, EMAIL, RUN = 'n', 'e', 'r'
+
+
+def sin_tildes(texto):
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c)).lower()
+
+
+def normalizar_run(run):
+    return re.sub(r'[^0-9k]', '', (run or '').lower())
+
+
+def terminos(usuario):
+    pares = set()
+    for campo in (usuario.first_name, usuario.last_name, usuario.username):
+        pares.update((NOMBRE, palabra) for palabra in re.findall(r'[a-z0-9]+', sin_tildes(campo or '')))
+    if usuario.email:
+        pares.add((EMAIL, usuario.email.strip().lower()))
+    if normalizar_run(usuario.run):
+        pares.add((RUN, normalizar_run(usuario.run)))
+    return pares
+
+
+def normalizar_usuarios(apps, schema_editor):
+    """
+    Deja el email y el RUN de los usuarios existentes en la forma canónica que
+    ahora aplica `CustomUser.save`, por lotes de ids. Un RUN cuya forma
+    canónica ya la tiene otro usuario (el mismo RUN escrito de dos maneras) se
+    deja como está para no romper la restricción única; hay que revisarlo a
+    mano. Los usuarios modificados se reindexan en el directorio.
+    """
+    CustomUser = apps.get_model('cesfamApp', 'CustomUser')
+    TerminoDirectorio = apps.get_model('cesfamApp', 'TerminoDirectorio')
+    ultimo = 0
+    while True:
+        lote = list(CustomUser.objects.filter(pk__gt=ultimo).order_by('pk').only(
+            'first_name', 'last_name', 'username', 'email', 'run', 'rol',
+        )[:TAMANO_LOTE])
+        if not lote:
+            break
+        ultimo = lote[-1].pk
+        runs = {usuario.pk: run_canonico(usuario.run) for usuario in lote}
+        ocupados = set(CustomUser.objects.filter(run__in=set(runs.values()) - {None}).values_list('run', flat=True))
+        cambiados = []
+        for usuario in lote:
+            email, run = email_canonico(usuario.email), runs[usuario.pk]
+            if run != usuario.run:
+                if run in ocupados:
+                    run = usuario.run
+                elif run is not None:
+                    ocupados.add(run)
+            if (email, run) != (usuario.email, usuario.run):
+                usuario.email, usuario.run = email, run
+                cambiados.append(usuario)
+        if cambiados:
+            CustomUser.objects.bulk_update(cambiados, ['email', 'run'])
+            TerminoDirectorio.objects.filter(usuario__in=[usuario.pk for usuario in cambiados]).delete()
+            TerminoDirectorio.objects.bulk_create(
+                (
+                    TerminoDirectorio(usuario_id=usuario.pk, rol=usuario.rol, tipo=tipo, termino=termino[:254])
+                    for usuario in cambiados for tipo, termino in terminos(usuario)
+                ),
+                batch_size=1000,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('cesfamApp', '0014_directorio_usuarios'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['email'], name='customuser_email_idx'),
+        ),
+        migrations.RunPython(normalizar_usuarios, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-17 05:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cesfamApp', '0015_email_run_canonicos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionCatalogo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=60, unique=True, verbose_name='Nombre')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='Versión')),
+                ('modificado', models.DateTimeField(verbose_name='Último cambio')),
+            ],
+            options={
+                'verbose_name': 'Versión del Catálogo',
+                'verbose_name_plural': 'Versiones del Catálogo',
+                'db_table': 'version_catalogo',
+            },
+        ),
+    ]
@@ -1,3 +1,5 @@
+import re
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
@@ -8,6 +10,25 @@ from django.conf import settings
 # Este modelo reemplaza a los antiguos modelos 'Usuario' y 'Profesional'.
 # Hereda de AbstractUser de Django para un manejo de autenticación seguro.
 
+def run_canonico(run):
+    """
+    Forma en que se guarda el RUN: sin puntos ni ceros a la izquierda, con
+    guion y dígito verificador en mayúscula ('12.345.678-k' -> '12345678-K').
+    Devuelve None si no hay un RUN (así varios usuarios sin RUN no chocan con
+    la restricción única).
+    """
+    limpio = re.sub(r'[^0-9K]', '', (run or '').upper())
+    cuerpo, dv = limpio[:-1].lstrip('0'), limpio[-1:]
+    if not cuerpo or not cuerpo.isdigit():
+        return None
+    return f"{cuerpo}-{dv}"
+
+
+def email_canonico(email):
+    """Forma en que se guarda el email: sin espacios alrededor y en minúsculas."""
+    return (email or '').strip().lower()
+
+
 class CustomUser(AbstractUser):
     """
     Modelo de usuario personalizado que extiende el AbstractUser de Django.
@@ -33,9 +54,95 @@ class CustomUser(AbstractUser):
     telefono = models.CharField(max_length=20, null=True, blank=True, verbose_name="Teléfono")
     especialidad = models.CharField(max_length=100, null=True, blank=True, verbose_name="Especialidad (si es profesional)")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        usuario = super().from_db(db, field_names, values)
+        if 'run' in usuario.__dict__:
+            usuario._run_guardado = usuario.run
+        return usuario
+
+    def normalizar(self):
+        """
+        Deja email y RUN en la forma canónica, para que el login los busque por
+        igualdad sobre un índice (ver cesfamApp.backends). El RUN solo se
+        normaliza si es nuevo o cambió: la migración 0015 dejó como estaban los
+        RUN cuya forma canónica ya tenía otro usuario, y esos usuarios también
+        tienen que poder guardarse.
+        """
+        diferidos = self.get_deferred_fields()
+        if 'email' not in diferidos:
+            self.email = email_canonico(self.email)
+        if 'run' not in diferidos and (self._state.adding or self.run != getattr(self, '_run_guardado', None)):
+            self.run = run_canonico(self.run)
+
+    def clean(self):
+        # Antes de validate_unique: un RUN repetido escrito de otra forma es un error del formulario
+        super().clean()
+        self.normalizar()
+
+    def save(self, *args, **kwargs):
+        self.normalizar()
+        super().save(*args, **kwargs)
+        if 'run' not in self.get_deferred_fields():
+            self._run_guardado = self.run
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        # Al leer un campo diferido se cargan todos los que faltan en una sola consulta: el usuario
+        # armado desde un JWT trae solo los claims (ver cesfamApp.tokens) y un serializer lee varios más
+        if fields is not None:
+            fields = set(fields) | self.get_deferred_fields()
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if fields is None or 'run' in fields:
+            self._run_guardado = self.run
+
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.get_rol_display()})"
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['email'], name='customuser_email_idx'),
+        ]
+
+
+class TerminoDirectorio(models.Model):
+    """
+    Índice de búsqueda del directorio de usuarios (ver `cesfamApp.directorio`).
+    Una fila por palabra del nombre, por el email y por el RUN normalizado de
+    cada usuario, sin tildes y en minúsculas, con el rol del usuario copiado
+    para que buscar por prefijo dentro de ciertos roles sea un rango del índice.
+    """
+    NOMBRE = 'n'
+    EMAIL = 'e'
+    RUN = 'r'
+
+    TIPO_CHOICES = (
+        (NOMBRE, 'Nombre'),
+        (EMAIL, 'Email'),
+        (RUN, 'RUN'),
+    )
+    TIPOS = (NOMBRE, EMAIL, RUN)
+
+    usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='terminos_directorio',
+        verbose_name="Usuario"
+    )
+    rol = models.CharField(max_length=20, verbose_name="Rol")
+    tipo = models.CharField(max_length=1, choices=TIPO_CHOICES, verbose_name="Tipo")
+    termino = models.CharField(max_length=254, verbose_name="Término")
+
+    def __str__(self):
+        return f"{self.termino} ({self.get_tipo_display()})"
+
+    class Meta:
+        db_table = 'termino_directorio'
+        verbose_name = "Término del Directorio"
+        verbose_name_plural = "Términos del Directorio"
+        indexes = [
+            models.Index(fields=['rol', 'termino'], name='directorio_rol_termino_idx'),
+        ]
+
 
 # ==============================================================================
 # MODELOS PRINCIPALES DE LA APLICACIÓN
@@ -107,6 +214,18 @@ class Cita(models.Model):
         db_table = 'cita'
         verbose_name = "Cita"
         verbose_name_plural = "Citas"
+        constraints = [
+            # Evita que dos reservas simultáneas tomen el mismo bloque del profesional.
+            # También sirve de índice para las consultas por profesional y fecha.
+            models.UniqueConstraint(fields=['profesional', 'fecha_hora'], name='cita_profesional_fecha_hora_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['paciente', 'fecha_hora'], name='cita_paciente_fecha_hora_idx'),
+            # Filtros de la API (cesfamApp.filters): por servicio o CESFAM en un rango de fechas, o solo por fechas
+            models.Index(fields=['servicio', 'fecha_hora'], name='cita_servicio_fecha_hora_idx'),
+            models.Index(fields=['cesfam', 'fecha_hora'], name='cita_cesfam_fecha_hora_idx'),
+            models.Index(fields=['fecha_hora', 'id'], name='cita_fecha_hora_id_idx'),
+        ]
 
 
 class Horario(models.Model):
@@ -146,6 +265,114 @@ class Horario(models.Model):
         db_table = 'horario'
         verbose_name = "Horario"
         verbose_name_plural = "Horarios"
+        indexes = [
+            # Horarios de un profesional por día (API filtrada y cálculo de la agenda)
+            models.Index(fields=['profesional', 'dia'], name='horario_profesional_dia_idx'),
+        ]
+
+
+class BloqueAgenda(models.Model):
+    """
+    Tabla materializada con los bloques de atención de cada profesional.
+    Se mantiene actualizada desde `cesfamApp.agenda` cuando cambian sus
+    `Horario` o `Cita`, de modo que consultar la disponibilidad es una sola
+    consulta por rango sobre un índice.
+    """
+    LIBRE = 'libre'
+    OCUPADO = 'ocupado'
+
+    ESTADO_CHOICES = (
+        (LIBRE, 'Libre'),
+        (OCUPADO, 'Ocupado'),
+    )
+
+    profesional = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='bloques_agenda',
+        verbose_name="Profesional"
+    )
+    inicio = models.DateTimeField(verbose_name="Inicio")
+    fin = models.DateTimeField(verbose_name="Fin")
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default=LIBRE, verbose_name="Estado")
+
+    def __str__(self):
+        return f"Bloque {self.get_estado_display()} de {self.profesional} el {self.inicio.strftime('%d-%m-%Y %H:%M')}"
+
+    class Meta:
+        db_table = 'bloque_agenda'
+        ordering = ['inicio']
+        verbose_name = "Bloque de Agenda"
+        verbose_name_plural = "Bloques de Agenda"
+        constraints = [
+            models.UniqueConstraint(fields=['profesional', 'inicio'], name='bloque_agenda_profesional_inicio_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['profesional', 'estado', 'inicio'], name='bloque_agenda_disp_idx'),
+        ]
+
+
+class ResumenCitas(models.Model):
+    """
+    Conteo pre-agregado de citas por período (día, semana o mes), profesional,
+    servicio y CESFAM. Se actualiza desde `cesfamApp.metricas` cuando cambian
+    las `Cita`, para que `dashboard_metricas` no recorra la tabla de citas.
+    """
+    DIA = 'dia'
+    SEMANA = 'semana'
+    MES = 'mes'
+
+    PERIODO_CHOICES = (
+        (DIA, 'Día'),
+        (SEMANA, 'Semana'),
+        (MES, 'Mes'),
+    )
+
+    periodo = models.CharField(max_length=6, choices=PERIODO_CHOICES, verbose_name="Período")
+    fecha = models.DateField(verbose_name="Inicio del período")
+    profesional = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='resumen_citas',
+        verbose_name="Profesional"
+    )
+    servicio = models.ForeignKey(Servicio, on_delete=models.CASCADE, verbose_name="Servicio")
+    cesfam = models.ForeignKey(Cesfam, on_delete=models.CASCADE, verbose_name="CESFAM")
+    total = models.IntegerField(default=0, verbose_name="Total de citas")
+
+    def __str__(self):
+        return f"{self.get_periodo_display()} {self.fecha:%d-%m-%Y}: {self.total} citas de {self.profesional}"
+
+    class Meta:
+        db_table = 'resumen_citas'
+        verbose_name = "Resumen de Citas"
+        verbose_name_plural = "Resúmenes de Citas"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['periodo', 'fecha', 'profesional', 'servicio', 'cesfam'],
+                name='resumen_citas_uniq',
+            ),
+        ]
+
+
+class VersionCatalogo(models.Model):
+    """
+    Contador de cambios de una tabla del catálogo (o de un fragmento del
+    panel). Lo incrementa `cesfamApp.catalogo.registrar_cambio` y con él se
+    arman los ETag y las claves de los fragmentos; al estar en la base, todos
+    los procesos ven el mismo valor.
+    """
+    nombre = models.CharField(max_length=60, unique=True, verbose_name="Nombre")
+    version = models.PositiveBigIntegerField(default=0, verbose_name="Versión")
+    modificado = models.DateTimeField(verbose_name="Último cambio")
+
+    def __str__(self):
+        return f"{self.nombre} v{self.version}"
+
+    class Meta:
+        db_table = 'version_catalogo'
+        verbose_name = "Versión del Catálogo"
+        verbose_name_plural = "Versiones del Catálogo"
 
 
 # ==============================================================================
@@ -194,6 +421,10 @@ class Notificacion(models.Model):
         ordering = ['-fecha']
         verbose_name = "Notificación"
         verbose_name_plural = "Notificaciones"
+        indexes = [
+            # Reanudación del flujo de notificaciones desde el último id visto
+            models.Index(fields=['destinatario', 'id'], name='notificacion_dest_id_idx'),
+        ]
 
 
 class Mensaje(models.Model):
@@ -258,15 +489,8 @@ class Conversation(models.Model):
         related_name='conversacion_cita',
         verbose_name="Cita Relacionada"
     )
-    
-    # Para rastrear qué usuarios han leído el ÚLTIMO mensaje en la conversación
-    # (Esto es diferente de que cada mensaje tenga un estado de leído)
-    is_read_by = models.ManyToManyField(
-        settings.AUTH_USER_MODEL,
-        related_name='read_conversations',
-        blank=True,
-        verbose_name="Leído por"
-    )
+
+    # Qué leyó cada participante se guarda en `ConversationRead` (ver cesfamApp.lecturas)
 
     def __str__(self):
         participant_names = ", ".join([user.get_full_name() or user.username for user in self.participants.all()])
@@ -276,6 +500,10 @@ class Conversation(models.Model):
         ordering = ['-updated_at']
         verbose_name = "Conversación"
         verbose_name_plural = "Conversaciones"
+        indexes = [
+            # Paginación por cursor sobre (updated_at, id)
+            models.Index(fields=['updated_at', 'id'], name='conversation_updated_idx'),
+        ]
 
 
 class Message(models.Model):
@@ -296,15 +524,6 @@ class Message(models.Model):
     )
     content = models.TextField(verbose_name="Contenido del Mensaje")
     timestamp = models.DateTimeField(auto_now_add=True, verbose_name="Fecha/Hora de Envío")
-    
-    # Para rastrear qué usuarios (de los participantes de la conversación) han leído este mensaje específico
-    # Esto es útil para "visto por" individuales.
-    read_by = models.ManyToManyField(
-        settings.AUTH_USER_MODEL,
-        related_name='read_messages',
-        blank=True,
-        verbose_name="Leído por"
-    )
 
     def __str__(self):
         return f"Mensaje de {self.sender.username} en '{self.conversation.id}' ({self.timestamp.strftime('%d-%m-%Y %H:%M')})"
@@ -313,6 +532,44 @@ class Message(models.Model):
         ordering = ['timestamp']
         verbose_name = "Mensaje"
         verbose_name_plural = "Mensajes"
+        indexes = [
+            # Paginación por cursor de los mensajes de una conversación
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='message_conv_timestamp_idx'),
+        ]
+
+
+class ConversationRead(models.Model):
+    """
+    Marca de lectura de un participante en una conversación: el id del último
+    mensaje que leyó. Todos los mensajes de la conversación con id menor o
+    igual cuentan como leídos por ese usuario, así que basta una fila por
+    participante (en vez de una por mensaje y lector) para saber qué no ha
+    leído, quién vio cada mensaje y quién está al día.
+    """
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='read_marks',
+        verbose_name="Conversación"
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='conversation_reads',
+        verbose_name="Usuario"
+    )
+    last_read_message_id = models.BigIntegerField(default=0, verbose_name="Último mensaje leído")
+    read_at = models.DateTimeField(auto_now=True, verbose_name="Fecha/Hora de Lectura")
+
+    def __str__(self):
+        return f"{self.user} leyó hasta el mensaje {self.last_read_message_id} en '{self.conversation_id}'"
+
+    class Meta:
+        verbose_name = "Lectura de Conversación"
+        verbose_name_plural = "Lecturas de Conversaciones"
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='conversation_read_uniq'),
+        ]
 
 # ==============================================================================
 # MODELOS ADICIONALES ( placeholders )
@@ -0,0 +1,130 @@
+"""
+Paginación por cursor (keyset) para la API de mensajería y de citas.
+
+En vez de OFFSET, cada página se pide relativa a un elemento ya visto:
+`?before=<cursor>` trae los anteriores y `?after=<cursor>` los posteriores. Sin
+cursor se devuelve la página más reciente. El cursor codifica los valores de
+los campos de orden del elemento (p. ej. `timestamp` e `id`), así que cada
+página es una consulta por rango sobre el índice correspondiente, sin importar
+qué tan larga sea la conversación.
+
+La respuesta tiene la forma:
+    {"results": [...], "before": <cursor o null>, "after": <cursor o null>,
+     "has_more_after": <bool>}
+donde `before` sirve para cargar la página anterior (null si no hay más),
+`after` es el cursor del elemento más reciente, para pedir solo lo nuevo, y
+`has_more_after` indica si al ponerse al día con `after` quedaron más páginas.
+"""
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(BasePagination):
+    # Campos que definen el orden (el último debe ser único, normalmente `id`)
+    campo_fecha = 'timestamp'
+    campo_id = 'id'
+    # Orden en que se entregan los resultados: cronológico (chat) o más reciente primero
+    mas_reciente_primero = False
+    limite_por_defecto = 50
+    limite_maximo = 200
+
+    def _limite(self, request):
+        try:
+            limite = int(request.query_params.get('limit', self.limite_por_defecto))
+        except ValueError:
+            raise ParseError('El parámetro "limit" debe ser un número.')
+        return max(1, min(limite, self.limite_maximo))
+
+    def codificar(self, elemento):
+        valores = [getattr(elemento, self.campo_fecha).isoformat(), getattr(elemento, self.campo_id)]
+        return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip('=')
+
+    def decodificar(self, cursor):
+        try:
+            fecha, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            fecha = parse_datetime(fecha)
+        except (ValueError, TypeError):
+            fecha = None
+        if fecha is None or not isinstance(pk, int):
+            raise ParseError('Cursor inválido.')
+        return fecha, pk
+
+    def _antes_de(self, cursor):
+        fecha, pk = cursor
+        return Q(**{f'{self.campo_fecha}__lt': fecha}) | Q(**{self.campo_fecha: fecha, f'{self.campo_id}__lt': pk})
+
+    def _despues_de(self, cursor):
+        fecha, pk = cursor
+        return Q(**{f'{self.campo_fecha}__gt': fecha}) | Q(**{self.campo_fecha: fecha, f'{self.campo_id}__gt': pk})
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limite = self._limite(request)
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+        if before:
+            queryset = queryset.filter(self._antes_de(self.decodificar(before)))
+        if after:
+            queryset = queryset.filter(self._despues_de(self.decodificar(after)))
+
+        ascendente = (self.campo_fecha, self.campo_id)
+        descendente = (f'-{self.campo_fecha}', f'-{self.campo_id}')
+        if after and not before:
+            # Los más antiguos después del cursor: así no se salta nada al ponerse al día
+            elementos = list(queryset.order_by(*ascendente)[:limite + 1])
+            hay_mas_recientes = len(elementos) > limite
+            elementos = elementos[:limite]
+            hay_anteriores = True
+        else:
+            elementos = list(queryset.order_by(*descendente)[:limite + 1])
+            hay_anteriores = len(elementos) > limite
+            elementos = elementos[:limite][::-1]
+            hay_mas_recientes = False
+
+        self.before = self.codificar(elementos[0]) if elementos and hay_anteriores else None
+        self.after = self.codificar(elementos[-1]) if elementos else after
+        self.hay_mas_recientes = hay_mas_recientes
+        return elementos[::-1] if self.mas_reciente_primero else elementos
+
+    def get_paginated_response(self, data):
+        return Response({
+            'results': data,
+            'before': self.before,
+            'after': self.after,
+            'has_more_after': self.hay_mas_recientes,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'results': schema,
+                'before': {'type': 'string', 'nullable': True},
+                'after': {'type': 'string', 'nullable': True},
+                'has_more_after': {'type': 'boolean'},
+            },
+        }
+
+
+class MessagePagination(KeysetPagination):
+    campo_fecha = 'timestamp'
+
+
+class ConversationPagination(KeysetPagination):
+    campo_fecha = 'updated_at'
+    mas_reciente_primero = True
+
+
+class CitaPagination(KeysetPagination):
+    campo_fecha = 'fecha_hora'
+
+
+class HorarioPagination(LimitOffsetPagination):
+    # Un profesional tiene pocos horarios, así que OFFSET no pesa; el límite evita descargar la tabla completa
+    default_limit = 100
+    max_limit = 500
@@ -0,0 +1,88 @@
+"""
+Contexto del panel principal (`dashboard`) según el rol del usuario.
+
+Cada rol tiene su proveedor de contexto con un número fijo de consultas: los
+contadores salen de un solo `aggregate` con filtros condicionales, las listas
+de citas traen sus relaciones con `select_related` y los totales del
+administrador se guardan un momento en el caché. Los anuncios y las
+notificaciones se renderizan desde el caché de fragmentos mientras no cambien
+(ver cesfamApp.fragmentos).
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import disponibilidad, fragmentos
+from .models import Anuncio, Cesfam, Cita, Notificacion
+
+User = get_user_model()
+
+CLAVE_RESUMEN_ADMIN = 'panel:resumen_admin'
+TIMEOUT_RESUMEN_ADMIN = 60
+
+
+def contexto_paciente(user, ahora):
+    citas = Cita.objects.filter(paciente=user).select_related('profesional', 'servicio')
+    return {
+        'proximas_citas': citas.filter(fecha_hora__gte=ahora).order_by('fecha_hora')[:5],
+        'historial_citas': citas.filter(fecha_hora__lt=ahora).order_by('-fecha_hora')[:10],
+    }
+
+
+def contexto_profesional(user, ahora):
+    hoy = timezone.localdate(ahora)
+    desde, hasta = disponibilidad.limites_rango(hoy, hoy)
+    citas = Cita.objects.filter(profesional=user)
+    contadores = citas.aggregate(
+        citas_hoy=Count('id', filter=Q(fecha_hora__gte=desde, fecha_hora__lt=hasta)),
+        total_citas=Count('id'),
+        pacientes_unicos=Count('paciente', distinct=True),
+    )
+    return {
+        **contadores,
+        'proximas_citas': citas.filter(fecha_hora__gte=ahora).select_related('paciente', 'servicio').order_by('fecha_hora')[:10],
+    }
+
+
+def resumen_admin():
+    """Totales del sistema; se guardan `TIMEOUT_RESUMEN_ADMIN` segundos en el caché."""
+    resumen = cache.get(CLAVE_RESUMEN_ADMIN)
+    if resumen is None:
+        usuarios = User.objects.aggregate(
+            total_profesionales=Count('id', filter=Q(rol=User.ROL_PROFESIONAL)),
+            total_usuarios=Count('id', filter=Q(rol=User.ROL_PACIENTE)),
+        )
+        resumen = {
+            'total_cesfams': Cesfam.objects.count(),
+            **usuarios,
+            'total_citas': Cita.objects.count(),
+        }
+        cache.set(CLAVE_RESUMEN_ADMIN, resumen, TIMEOUT_RESUMEN_ADMIN)
+    return resumen
+
+
+def contexto_admin(user, ahora):
+    return {'resumen': resumen_admin()}
+
+
+PROVEEDORES = {
+    User.ROL_PACIENTE: contexto_paciente,
+    User.ROL_PROFESIONAL: contexto_profesional,
+    User.ROL_ADMIN: contexto_admin,
+}
+
+
+def contexto_dashboard(user, ahora=None):
+    ahora = ahora or timezone.now()
+    context = {
+        'now': ahora,
+        # Perezosas: solo se consultan si el fragmento no está en el caché (ver cesfamApp.fragmentos)
+        'anuncios': Anuncio.objects.order_by('-fecha_publicacion')[:5],
+        'notificaciones': Notificacion.objects.filter(destinatario=user).order_by('-fecha')[:10],
+        **fragmentos.versiones_dashboard(user.pk),
+    }
+    proveedor = PROVEEDORES.get(user.rol)
+    if proveedor:
+        context.update(proveedor(user, ahora))
+    return context
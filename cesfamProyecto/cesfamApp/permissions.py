@@ -0,0 +1,22 @@
+"""
+Permisos por rol para la API, equivalentes a los decoradores de
+`decorators.py` pero respondiendo 401/403 en vez de redirigir al login.
+
+Solo leen `request.user.rol`: con JWT ese dato viene firmado en el token
+(ver cesfamApp.tokens), así que revisar el permiso no consulta la base.
+"""
+from rest_framework.permissions import BasePermission
+
+from .models import CustomUser
+
+
+class RolPermitido(BasePermission):
+    roles = ()
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and request.user.rol in self.roles)
+
+
+class EsEquipoSalud(RolPermitido):
+    roles = (CustomUser.ROL_PROFESIONAL, CustomUser.ROL_ADMIN)
+
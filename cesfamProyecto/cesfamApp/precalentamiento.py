@@ -0,0 +1,122 @@
+"""
+Precalentamiento de un proceso recién iniciado (worker de gunicorn o
+`manage.py precalentar`).
+
+Las primeras requests de un worker nuevo pagan trabajo que después queda en
+memoria: compilar las plantillas (el loader con caché de Django las guarda
+compiladas), armar el resolver de URLs con sus expresiones regulares y el
+índice para `reverse`, abrir la conexión a la base y llenar el caché de
+disponibilidad. `precalentar` hace todo eso de una vez y devuelve cuánto tomó
+cada paso.
+
+Lo que queda en memoria solo le sirve al proceso que lo ejecuta: por eso se
+llama desde el hook `post_worker_init` de `gunicorn.conf.py`, en cada worker.
+El comando de gestión sirve para revisar que todo compile después de un
+deploy y, si el caché es compartido (`DJANGO_CACHE_DIR`), para dejar listo el
+caché de disponibilidad antes de que lleguen usuarios. La conexión abierta
+solo sobrevive hasta la primera request si `CONN_MAX_AGE` es mayor que cero
+(`DB_CONN_MAX_AGE`).
+"""
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.template.backends.django import DjangoTemplates
+from django.urls import URLResolver, get_resolver
+from django.utils import timezone
+
+from . import cache_disponibilidad, disponibilidad
+from .models import Horario
+
+PASOS = ('plantillas', 'urls', 'conexiones', 'disponibilidad')
+
+
+# Plantillas de aplicaciones de terceros que también se renderizan (la API navegable del router)
+PLANTILLAS_EXTRA = ('rest_framework/api.html',)
+
+
+def compilar_plantillas():
+    """
+    Compila las plantillas del proyecto (`TEMPLATES['DIRS']`, es decir
+    `templates/`) y las de `PLANTILLAS_EXTRA`; devuelve `(compiladas, errores)`.
+    """
+    compiladas, errores = 0, []
+    for motor in engines.all():
+        if not isinstance(motor, DjangoTemplates):
+            continue
+        nombres = sorted({
+            ruta.relative_to(directorio).as_posix()
+            for directorio in motor.dirs for ruta in Path(directorio).rglob('*.html')
+        }) + list(PLANTILLAS_EXTRA)
+        for nombre in nombres:
+            try:
+                motor.get_template(nombre)
+                compiladas += 1
+            except (TemplateDoesNotExist, TemplateSyntaxError) as error:
+                errores.append(f'{nombre}: {error}')
+    return compiladas, errores
+
+
+def _compilar_patrones(resolver):
+    total = 0
+    for patron in resolver.url_patterns:
+        patron.pattern.regex
+        total += 1
+        if isinstance(patron, URLResolver):
+            total += _compilar_patrones(patron)
+    return total
+
+
+def resolver_urls():
+    """Arma el índice de `reverse` y compila la expresión de cada patrón; devuelve cuántos patrones hay."""
+    resolver = get_resolver()
+    resolver.reverse_dict
+    return _compilar_patrones(resolver)
+
+
+def abrir_conexiones():
+    for alias in connections:
+        connections[alias].ensure_connection()
+    return len(connections.all())
+
+
+def llenar_disponibilidad(limite=None):
+    """
+    Calcula y guarda la disponibilidad que muestra `agendar_cita_paso3` para
+    los profesionales con horario (a lo más `limite`). Son unas tres consultas
+    por profesional; con muchos profesionales conviene limitarlo en cada
+    worker y llenar el caché compartido completo con el comando.
+    """
+    User = get_user_model()
+    profesionales = User.objects.filter(
+        rol=User.ROL_PROFESIONAL, is_active=True, pk__in=Horario.objects.values('profesional_id'),
+    ).order_by('pk')[:limite]
+    hoy = timezone.localdate()
+    total = 0
+    for profesional in profesionales:
+        cache_disponibilidad.horarios_disponibles(profesional, hoy, hoy + timedelta(days=disponibilidad.DIAS_A_MOSTRAR - 1))
+        total += 1
+    return total
+
+
+def precalentar(pasos=PASOS, limite_profesionales=None):
+    """
+    Ejecuta los `pasos` indicados en orden y devuelve
+    `{paso: (cantidad, segundos)}`; para las plantillas la cantidad es
+    `(compiladas, errores)`.
+    """
+    funciones = {
+        'plantillas': compilar_plantillas,
+        'urls': resolver_urls,
+        'conexiones': abrir_conexiones,
+        'disponibilidad': lambda: llenar_disponibilidad(limite_profesionales),
+    }
+    resultado = {}
+    for paso in pasos:
+        inicio = time.perf_counter()
+        cantidad = funciones[paso]()
+        resultado[paso] = (cantidad, time.perf_counter() - inicio)
+    return resultado
@@ -0,0 +1,70 @@
+"""
+Servicio de reserva de citas.
+
+La disponibilidad del bloque no se consulta antes de insertar (eso deja una
+ventana en la que dos reservas simultáneas pasan la validación): se confía en
+la restricción única `Cita(profesional, fecha_hora)` y el `IntegrityError` que
+la viola se traduce a un mensaje para el usuario. Cualquier otro error de
+integridad se propaga. La agenda, el caché y las métricas se actualizan al
+confirmarse la transacción (ver `signals.py`), fuera del savepoint de la
+reserva.
+"""
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Cesfam, Cita
+
+
+RESTRICCION_HORARIO = 'cita_profesional_fecha_hora_uniq'
+
+
+def es_choque_de_horario(error):
+    """Indica si el `IntegrityError` viene de la restricción única `Cita(profesional, fecha_hora)`."""
+    diag = getattr(error.__cause__, 'diag', None)
+    if diag is not None:  # psycopg entrega el nombre de la restricción
+        return diag.constraint_name == RESTRICCION_HORARIO
+    # MySQL nombra la restricción en el mensaje; SQLite lista sus columnas
+    tabla = Cita._meta.db_table
+    return RESTRICCION_HORARIO in str(error) or str(error) == (
+        f'UNIQUE constraint failed: {tabla}.profesional_id, {tabla}.fecha_hora'
+    )
+
+
+class ReservaError(Exception):
+    """Error de reserva con un mensaje apto para mostrar al usuario."""
+
+
+class HorarioNoDisponible(ReservaError):
+    """El bloque ya fue tomado por otra cita del mismo profesional."""
+
+
+def reservar_cita(paciente, profesional, servicio, fecha_hora, cesfam=None,
+                  mensaje_ocupado='El horario seleccionado ya no está disponible. Por favor, elige otro.'):
+    """
+    Crea una cita dentro de una transacción y la devuelve.
+
+    Lanza `ReservaError` si la cita no es válida y `HorarioNoDisponible` si el
+    profesional ya tiene una cita en ese horario.
+    """
+    if fecha_hora < timezone.now():
+        raise ReservaError('No puedes agendar una cita en el pasado.')
+
+    with transaction.atomic():
+        # Asumimos un solo CESFAM o el primero. Esto podría necesitar más lógica en una app real.
+        cesfam = cesfam or Cesfam.objects.first()
+        if not cesfam:
+            raise ReservaError('No hay ningún CESFAM configurado en el sistema.')
+        try:
+            # Savepoint propio para que el error no invalide una transacción externa
+            with transaction.atomic():
+                return Cita.objects.create(
+                    paciente=paciente,
+                    profesional=profesional,
+                    servicio=servicio,
+                    fecha_hora=fecha_hora,
+                    cesfam=cesfam,
+                )
+        except IntegrityError as error:
+            if not es_choque_de_horario(error):
+                raise
+            raise HorarioNoDisponible(mensaje_ocupado)
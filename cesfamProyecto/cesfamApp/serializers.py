@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from . import lecturas
 from .models import Cesfam, Servicio, Cita, Horario, Anuncio, Notificacion, Mensaje, Conversation, Message
 
 User = get_user_model()
@@ -101,24 +102,72 @@ class SystemMessageSerializer(serializers.ModelSerializer): # Renamed from Mensa
 # ==============================================================================
 
 class MessageSerializer(serializers.ModelSerializer):
-    sender = UserSerializer(read_only=True) # Nested serializer for read operations
-    sender_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), source='sender', write_only=True)
-    read_by = UserSerializer(many=True, read_only=True) # To show who has read it
+    sender = UserSerializer(read_only=True) # The sender is always the authenticated user
+    read_by = serializers.SerializerMethodField() # To show who has read it (from the read watermarks)
 
     class Meta:
         model = Message
-        fields = ['id', 'conversation', 'sender', 'sender_id', 'content', 'timestamp', 'read_by']
+        fields = ['id', 'conversation', 'sender', 'content', 'timestamp', 'read_by']
         read_only_fields = ['timestamp']
 
+    def get_read_by(self, obj):
+        # A message just sent carries its readers (see cesfamApp.envios)
+        if hasattr(obj, 'lectores'):
+            return UserSerializer(obj.lectores, many=True).data
+        # Otherwise uses the conversation's prefetched `read_marks` (see the viewsets)
+        return UserSerializer(lecturas.lectores(obj, obj.conversation.read_marks.all()), many=True).data
+
+class SendMessageSerializer(serializers.Serializer):
+    """
+    Input for sending a message. The conversation is only an id: membership is
+    checked by `cesfamApp.envios.enviar_mensaje`, so validating it here
+    would cost an extra query.
+    """
+    conversation = serializers.IntegerField(min_value=1)
+    content = serializers.CharField()
+
 class ConversationSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True) # Nested serializer for read operations
     participants_ids = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), many=True, source='participants', write_only=True)
     messages = MessageSerializer(many=True, read_only=True) # Nested serializer to show messages within a conversation
     cita = serializers.StringRelatedField(read_only=True) # Show cita details if available
     cita_id = serializers.PrimaryKeyRelatedField(queryset=Cita.objects.all(), source='cita', write_only=True, required=False, allow_null=True)
-    is_read_by = UserSerializer(many=True, read_only=True) # To show who has read the latest message
+    is_read_by = serializers.SerializerMethodField() # To show who has read the latest message
 
     class Meta:
         model = Conversation
         fields = ['id', 'participants', 'participants_ids', 'created_at', 'updated_at', 'topic', 'cita', 'cita_id', 'messages', 'is_read_by']
-        read_only_fields = ['created_at', 'updated_at']
\ No newline at end of file
+        read_only_fields = ['created_at', 'updated_at']
+
+    def get_is_read_by(self, obj):
+        last_id = max((message.id for message in obj.messages.all()), default=0)
+        return UserSerializer(lecturas.al_dia(last_id, obj.read_marks.all()), many=True).data
+
+class ConversationSummarySerializer(serializers.Serializer):
+    """
+    Read-only summary of a conversation for the conversation list. Every field
+    comes from annotations on the queryset (see `ConversationViewSet.summary`),
+    so serializing it never touches the database.
+    """
+    id = serializers.IntegerField()
+    topic = serializers.CharField(allow_null=True)
+    updated_at = serializers.DateTimeField()
+    participant_count = serializers.IntegerField()
+    other_participant = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    unread_count = serializers.IntegerField()
+
+    def get_other_participant(self, obj):
+        if obj.other_id is None:
+            return None
+        return {'id': obj.other_id, 'username': obj.other_username, 'first_name': obj.other_first_name, 'rol': obj.other_rol}
+
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        return {
+            'id': obj.last_message_id,
+            'sender_id': obj.last_message_sender_id,
+            'content': obj.last_message_content,
+            'timestamp': serializers.DateTimeField().to_representation(obj.last_message_timestamp),
+        }
@@ -0,0 +1,188 @@
+"""
+Señales que mantienen actualizada la agenda materializada (`BloqueAgenda`),
+el caché de disponibilidad y el resumen de métricas (`ResumenCitas`) cuando se
+crean, modifican o eliminan `Cita` y `Horario`, que publican los mensajes
+y las notificaciones nuevas en los canales de tiempo real
+(`cesfamApp.tiempo_real`) y que cambian la versión del catálogo
+(`cesfamApp.catalogo`) cuando cambian servicios, CESFAM u horarios, que
+mantienen el índice del directorio de usuarios (`cesfamApp.directorio`) y
+que invalidan los fragmentos del panel (`cesfamApp.fragmentos`) cuando cambian
+anuncios o notificaciones.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import agenda, cache_disponibilidad, catalogo, directorio, fragmentos, metricas, tiempo_real
+from .models import Anuncio, Cesfam, Cita, Horario, Message, Notificacion, Servicio
+
+_estado = threading.local()
+
+
+@contextmanager
+def sincronizacion_suspendida():
+    """
+    Desactiva la actualización fila a fila de la agenda, del caché y de las
+    métricas dentro del bloque. Lo usan las operaciones masivas, que luego
+    actualizan a los profesionales afectados de una sola vez.
+    """
+    anterior = getattr(_estado, 'suspendida', False)
+    _estado.suspendida = True
+    try:
+        yield
+    finally:
+        _estado.suspendida = anterior
+
+
+def _suspendida(raw):
+    return raw or getattr(_estado, 'suspendida', False)
+
+
+@receiver(pre_save, sender=Cita)
+def guardar_cita_anterior(sender, instance, raw=False, **kwargs):
+    # Si la cita cambia de profesional u horario (p. ej. `marcar_atendida`),
+    # también hay que liberar el bloque que ocupaba antes y descontarla de
+    # sus métricas anteriores.
+    instance._cita_anterior = None
+    if instance.pk and not _suspendida(raw):
+        instance._cita_anterior = Cita.objects.filter(pk=instance.pk).values_list(
+            'profesional_id', 'servicio_id', 'cesfam_id', 'fecha_hora'
+        ).first()
+
+
+@receiver(post_save, sender=Cita)
+@receiver(post_delete, sender=Cita)
+def actualizar_agenda_cita(sender, instance, raw=False, **kwargs):
+    if _suspendida(raw):
+        return
+    actual = (instance.profesional_id, instance.servicio_id, instance.cesfam_id, instance.fecha_hora)
+    anterior = getattr(instance, '_cita_anterior', None)
+    eliminada = kwargs.get('signal') is post_delete
+    # Al confirmarse, fuera de la transacción (y del savepoint de `reservas.reservar_cita`): un error
+    # en las tablas derivadas no deshace la cita ni se confunde con un choque de horario. Queda en
+    # el log; `verificar_agenda --reparar` y `reconstruir_metricas` las corrigen.
+    transaction.on_commit(lambda: _sincronizar_cita(actual, anterior, eliminada), robust=True)
+
+
+def _sincronizar_cita(actual, anterior, eliminada):
+    if eliminada:
+        metricas.registrar_citas([actual], -1)
+    elif anterior != actual:
+        metricas.registrar_citas([actual], 1)
+        if anterior:
+            metricas.registrar_citas([anterior], -1)
+
+    if anterior and (anterior[0], anterior[3]) != (actual[0], actual[3]):
+        agenda.cita_modificada(anterior[0], anterior[3])
+        cache_disponibilidad.invalidar_cita(anterior[0], anterior[3])
+    agenda.cita_modificada(actual[0], actual[3])
+    cache_disponibilidad.invalidar_cita(actual[0], actual[3])
+
+
+@receiver(pre_save, sender=Horario)
+def guardar_horario_anterior(sender, instance, raw=False, **kwargs):
+    instance._agenda_anterior = None
+    if instance.pk and not _suspendida(raw):
+        instance._agenda_anterior = Horario.objects.filter(pk=instance.pk).values_list(
+            'profesional_id', 'dia'
+        ).first()
+
+
+@receiver(post_save, sender=Horario)
+@receiver(post_delete, sender=Horario)
+def actualizar_agenda_horario(sender, instance, raw=False, **kwargs):
+    if _suspendida(raw):
+        return
+    anterior = getattr(instance, '_agenda_anterior', None)
+    profesionales = {instance.profesional_id}
+    if anterior and anterior[0] != instance.profesional_id:
+        agenda.horario_modificado(anterior[0], {anterior[1]})
+        profesionales.add(anterior[0])
+        anterior = None
+    dias = {instance.dia, anterior[1]} if anterior else {instance.dia}
+    agenda.horario_modificado(instance.profesional_id, dias)
+    # Al confirmarse, para que nadie guarde en el caché los bloques viejos bajo la versión nueva
+    transaction.on_commit(lambda: _invalidar_disponibilidad(profesionales))
+
+
+def _invalidar_disponibilidad(profesional_ids):
+    for profesional_id in profesional_ids:
+        cache_disponibilidad.invalidar_profesional(profesional_id)
+
+
+@receiver(post_save, sender=Message)
+def publicar_mensaje(sender, instance, created, raw=False, **kwargs):
+    if not created or _suspendida(raw):
+        return
+    transaction.on_commit(lambda: tiempo_real.publicar_mensaje(instance))
+
+
+@receiver(post_save, sender=Notificacion)
+def publicar_notificacion(sender, instance, created, raw=False, **kwargs):
+    if not created or _suspendida(raw):
+        return
+    transaction.on_commit(lambda: tiempo_real.canal_notificaciones.publicar(
+        [instance.destinatario_id], tiempo_real.evento_notificacion(instance),
+    ))
+
+
+@receiver(post_save, sender=Anuncio)
+@receiver(post_delete, sender=Anuncio)
+def invalidar_fragmento_anuncios(sender, instance, raw=False, **kwargs):
+    if _suspendida(raw):
+        return
+    transaction.on_commit(fragmentos.invalidar_anuncios)
+
+
+@receiver(post_save, sender=Notificacion)
+@receiver(post_delete, sender=Notificacion)
+def invalidar_fragmento_notificaciones(sender, instance, raw=False, **kwargs):
+    # Nueva, leída o eliminada: el fragmento del destinatario ya no corresponde
+    if _suspendida(raw):
+        return
+    destinatario_id = instance.destinatario_id
+    transaction.on_commit(lambda: fragmentos.invalidar_notificaciones(destinatario_id))
+
+
+def _cambio_catalogo(*nombres):
+    # Al confirmarse, para que nadie lea la versión nueva junto con los datos viejos
+    transaction.on_commit(lambda: catalogo.registrar_cambio(*nombres))
+
+
+@receiver(post_save, sender=Servicio)
+@receiver(post_delete, sender=Servicio)
+@receiver(post_save, sender=Cesfam)
+@receiver(post_delete, sender=Cesfam)
+@receiver(post_save, sender=Horario)
+@receiver(post_delete, sender=Horario)
+def versionar_catalogo(sender, instance, raw=False, **kwargs):
+    if _suspendida(raw):
+        return
+    _cambio_catalogo({Servicio: catalogo.SERVICIOS, Cesfam: catalogo.CESFAM, Horario: catalogo.HORARIOS}[sender])
+
+
+@receiver(m2m_changed, sender=Servicio.profesionales.through)
+def versionar_profesionales_servicio(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and not _suspendida(False):
+        _cambio_catalogo(catalogo.SERVICIOS)
+
+
+@receiver(post_save, sender=get_user_model())
+def versionar_nombre_profesional(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    # Los horarios muestran el nombre del profesional; el login solo actualiza `last_login`
+    if created or _suspendida(raw) or instance.rol != instance.ROL_PROFESIONAL:
+        return
+    if update_fields is None or not set(update_fields) <= {'last_login'}:
+        _cambio_catalogo(catalogo.HORARIOS)
+
+
+@receiver(post_save, sender=get_user_model())
+def indexar_directorio(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if _suspendida(raw):
+        return
+    if created or update_fields is None or directorio.CAMPOS_INDEXADOS & set(update_fields):
+        directorio.reindexar([instance])
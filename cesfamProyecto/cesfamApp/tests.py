@@ -2,11 +2,35 @@ from django.test import TestCase
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
-from django.contrib.auth import get_user_model
-from datetime import timedelta
+from rest_framework_simplejwt.tokens import AccessToken
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from datetime import datetime, time, timedelta
+import asyncio
+import csv
+import json
+import tempfile
+import importlib.util
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import F, Sum
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from .models import Conversation, Message, Cita, Servicio, Cesfam
+from .models import Anuncio, Conversation, ConversationRead, Message, Cita, Servicio, Cesfam, Horario, BloqueAgenda, Notificacion, ResumenCitas, TerminoDirectorio, VersionCatalogo
+from . import agenda, cache_disponibilidad, catalogo, directorio, disponibilidad, envios, fragmentos, importacion, lecturas, metricas, precalentamiento, reservas, tiempo_real
+from .disponibilidad import agrupar_bloques, horarios_disponibles, primeros_disponibles
 
 User = get_user_model()
 
@@ -78,7 +102,7 @@ class CommunicationAPITests(TestCase):
         self.assertIn(self.professional_user, conversation.participants.all())
         self.assertEqual(conversation.topic, 'Consulta sobre cita')
         self.assertEqual(conversation.cita, self.cita)
-        self.assertIn(self.patient_user, conversation.is_read_by.all()) # Creator should mark it as read
+        self.assertIn(self.patient_user, lecturas.usuarios_al_dia(conversation)) # Creator should mark it as read
 
     def test_list_user_conversations(self):
         # Create conversations
@@ -90,13 +114,13 @@ class CommunicationAPITests(TestCase):
         self.client.login(username=self.patient_user.username, password=self.password)
         response = self.client.get(self.conversations_list_url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['id'], conv1.id)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['id'], conv1.id)
 
         self.client.login(username=self.professional_user.username, password=self.password)
         response = self.client.get(self.conversations_list_url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2) # Should see conv1 and conv2
+        self.assertEqual(len(response.data['results']), 2) # Should see conv1 and conv2
 
     def test_retrieve_conversation(self):
         conv = Conversation.objects.create(topic='Test Retrieve')
@@ -119,14 +143,14 @@ class CommunicationAPITests(TestCase):
     def test_mark_conversation_as_read(self):
         conv = Conversation.objects.create(topic='Mark Read Test')
         conv.participants.add(self.patient_user, self.professional_user)
-        conv.is_read_by.add(self.professional_user) # Prof has read it, patient hasn't
+        lecturas.avanzar(conv.pk, self.professional_user.pk, 0) # Prof has read it, patient hasn't
 
         self.client.login(username=self.patient_user.username, password=self.password)
         url = reverse('conversation-mark-as-read', kwargs={'pk': conv.id})
         response = self.client.post(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         conv.refresh_from_db()
-        self.assertIn(self.patient_user, conv.is_read_by.all())
+        self.assertIn(self.patient_user, lecturas.usuarios_al_dia(conv))
 
     # ==========================================================================
     # MESSAGE TESTS
@@ -153,8 +177,8 @@ class CommunicationAPITests(TestCase):
         conv.refresh_from_db()
         self.assertAlmostEqual(conv.updated_at, message.timestamp, delta=timedelta(seconds=1))
         # Check is_read_by for conversation
-        self.assertIn(self.patient_user, conv.is_read_by.all())
-        self.assertNotIn(self.professional_user, conv.is_read_by.all())
+        self.assertIn(self.patient_user, lecturas.usuarios_al_dia(conv))
+        self.assertNotIn(self.professional_user, lecturas.usuarios_al_dia(conv))
 
 
     def test_list_conversation_messages(self):
@@ -166,9 +190,9 @@ class CommunicationAPITests(TestCase):
         self.client.login(username=self.patient_user.username, password=self.password)
         response = self.client.get(self._get_messages_list_url(conv.id), format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
-        self.assertEqual(response.data[0]['content'], 'Msg 1')
-        self.assertEqual(response.data[1]['content'], 'Msg 2')
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['results'][0]['content'], 'Msg 1')
+        self.assertEqual(response.data['results'][1]['content'], 'Msg 2')
 
     def test_message_sender_automatically_set(self):
         conv = Conversation.objects.create(topic='Auto Sender')
@@ -199,8 +223,8 @@ class CommunicationAPITests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         conv.refresh_from_db()
         self.assertGreater(conv.updated_at, old_updated_at)
-        self.assertIn(self.professional_user, conv.is_read_by.all())
-        self.assertNotIn(self.patient_user, conv.is_read_by.all()) # Patient hasn't read it yet
+        self.assertIn(self.professional_user, lecturas.usuarios_al_dia(conv))
+        self.assertNotIn(self.patient_user, lecturas.usuarios_al_dia(conv)) # Patient hasn't read it yet
 
     def test_non_participant_cannot_send_message(self):
         conv = Conversation.objects.create(topic='Restricted Message')
@@ -225,4 +249,1787 @@ class CommunicationAPITests(TestCase):
         response = self.client.post(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         message.refresh_from_db()
-        self.assertIn(self.patient_user, message.read_by.all())
\ No newline at end of file
+        self.assertIn(self.patient_user, lecturas.lectores_de(message))
+
+class DisponibilidadTests(TestCase):
+    def setUp(self):
+        self.password = 'testpassword123'
+        self.profesional = User.objects.create_user(
+            username='prof_disp', email='prof_disp@example.com', password=self.password,
+            first_name='Ana', last_name='Rojas', rol=User.ROL_PROFESIONAL
+        )
+        self.paciente = User.objects.create_user(
+            username='pac_disp', email='pac_disp@example.com', password=self.password,
+            first_name='Luis', last_name='Soto', rol=User.ROL_PACIENTE
+        )
+        self.cesfam = Cesfam.objects.create(nombre="Cesfam Test", direccion="123 Test St", telefono="123456789")
+        self.servicio = Servicio.objects.create(nombre="Consulta General", tipo="Médica", descripcion="Consulta de rutina")
+
+        # Un lunes futuro fijo para que los resultados no dependan del día en que corren los tests
+        hoy = timezone.localdate()
+        self.lunes = hoy + timedelta(days=7 - hoy.weekday())
+        self.tz = timezone.get_current_timezone()
+
+    def _dt(self, fecha, hora, minuto=0):
+        return datetime.combine(fecha, time(hora, minuto), tzinfo=self.tz)
+
+    def test_agrupar_bloques_une_bloques_solapados(self):
+        bloques = agrupar_bloques([
+            (Horario.LUNES, time(14, 0), time(16, 0)),
+            (Horario.LUNES, time(8, 0), time(10, 0)),
+            (Horario.LUNES, time(9, 30), time(11, 0)),
+        ])
+        self.assertEqual(bloques[Horario.LUNES], [(time(8, 0), time(11, 0)), (time(14, 0), time(16, 0))])
+
+    def test_varios_bloques_por_dia(self):
+        Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES, hora_inicio=time(8, 0), hora_fin=time(9, 0))
+        Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES, hora_inicio=time(15, 0), hora_fin=time(16, 0))
+        Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES, hora_inicio=time(17, 0), hora_fin=time(18, 0), bloqueado=True)
+
+        slots = horarios_disponibles(self.profesional, self.lunes, self.lunes)
+        self.assertEqual(slots, [
+            self._dt(self.lunes, 8), self._dt(self.lunes, 8, 30),
+            self._dt(self.lunes, 15), self._dt(self.lunes, 15, 30),
+        ])
+
+    def test_citas_ocupan_bloques_solapados(self):
+        Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES, hora_inicio=time(8, 0), hora_fin=time(10, 0))
+        for inicio in (self._dt(self.lunes, 8), self._dt(self.lunes, 9, 15)):
+            Cita.objects.create(fecha_hora=inicio, paciente=self.paciente, profesional=self.profesional,
+                                cesfam=self.cesfam, servicio=self.servicio)
+
+        slots = horarios_disponibles(self.profesional, self.lunes, self.lunes)
+        # 8:00 está tomada y la cita de 9:15 bloquea tanto 9:00 como 9:30
+        self.assertEqual(slots, [self._dt(self.lunes, 8, 30)])
+
+    def test_vistas_devuelven_los_mismos_horarios(self):
+        Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES, hora_inicio=time(8, 0), hora_fin=time(12, 0))
+        Horario.objects.create(profesional=self.profesional, dia=Horario.MIERCOLES, hora_inicio=time(14, 0), hora_fin=time(16, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            Cita.objects.create(fecha_hora=self._dt(self.lunes, 10), paciente=self.paciente,
+                                profesional=self.profesional, cesfam=self.cesfam, servicio=self.servicio)
+
+        self.client.login(username=self.paciente.username, password=self.password)
+        response = self.client.get(reverse('agendar_cita_paso3', args=[self.profesional.id, self.servicio.id]))
+        slots_paso3 = [s for s in response.context['horarios_disponibles'] if s.date() >= self.lunes]
+
+        self.client.login(username=self.profesional.username, password=self.password)
+        fin = timezone.localdate() + timedelta(days=13)
+        response = self.client.get(reverse('profesional_horarios_json'), {
+            'start': self._dt(self.lunes, 0).isoformat(),
+            'end': self._dt(fin, 0).isoformat(),
+        })
+        slots_json = [parse_datetime(evento['start']) for evento in response.json()]
+
+        self.assertTrue(slots_paso3)
+        self.assertEqual(slots_paso3, slots_json)
+        self.assertNotIn(self._dt(self.lunes, 10), slots_json)
+
+
+class AgendaMaterializadaTests(TestCase):
+    def setUp(self):
+        self.profesional = User.objects.create_user(
+            username='prof_agenda', email='prof_agenda@example.com', password='testpassword123',
+            first_name='Ana', last_name='Rojas', rol=User.ROL_PROFESIONAL
+        )
+        self.paciente = User.objects.create_user(
+            username='pac_agenda', email='pac_agenda@example.com', password='testpassword123',
+            first_name='Luis', last_name='Soto', rol=User.ROL_PACIENTE
+        )
+        self.cesfam = Cesfam.objects.create(nombre="Cesfam Test", direccion="123 Test St", telefono="123456789")
+        self.servicio = Servicio.objects.create(nombre="Consulta General", tipo="Médica", descripcion="Consulta de rutina")
+        hoy = timezone.localdate()
+        self.lunes = hoy + timedelta(days=7 - hoy.weekday())
+        self.tz = timezone.get_current_timezone()
+
+    def _dt(self, fecha, hora, minuto=0):
+        return datetime.combine(fecha, time(hora, minuto), tzinfo=self.tz)
+
+    def _estado(self, inicio):
+        return BloqueAgenda.objects.get(profesional=self.profesional, inicio=inicio).estado
+
+    def test_señales_mantienen_la_agenda_consistente(self):
+        horario = Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES,
+                                         hora_inicio=time(8, 0), hora_fin=time(10, 0))
+        self.assertEqual(self._estado(self._dt(self.lunes, 8)), BloqueAgenda.LIBRE)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cita = Cita.objects.create(fecha_hora=self._dt(self.lunes, 8), paciente=self.paciente,
+                                       profesional=self.profesional, cesfam=self.cesfam, servicio=self.servicio)
+        self.assertEqual(self._estado(self._dt(self.lunes, 8)), BloqueAgenda.OCUPADO)
+        self.assertEqual(agenda.diferencias_agenda(), [])
+
+        # Mover la cita libera el bloque anterior
+        cita.fecha_hora = self._dt(self.lunes, 9)
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.save()
+        self.assertEqual(self._estado(self._dt(self.lunes, 8)), BloqueAgenda.LIBRE)
+        self.assertEqual(self._estado(self._dt(self.lunes, 9)), BloqueAgenda.OCUPADO)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.delete()
+        self.assertEqual(self._estado(self._dt(self.lunes, 9)), BloqueAgenda.LIBRE)
+
+        # Bloquear el horario (como en la vista `horario`) elimina sus bloques
+        horario.bloqueado = True
+        horario.save()
+        self.assertFalse(BloqueAgenda.objects.filter(profesional=self.profesional).exists())
+
+        horario.bloqueado = False
+        horario.dia = Horario.MARTES
+        horario.save()
+        self.assertEqual(agenda.diferencias_agenda(), [])
+        self.assertFalse(BloqueAgenda.objects.filter(inicio=self._dt(self.lunes, 8)).exists())
+
+    def test_verificar_y_regenerar_agenda(self):
+        Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES,
+                               hora_inicio=time(8, 0), hora_fin=time(10, 0))
+        BloqueAgenda.objects.filter(inicio=self._dt(self.lunes, 8)).update(estado=BloqueAgenda.OCUPADO)
+        BloqueAgenda.objects.filter(inicio=self._dt(self.lunes, 9)).delete()
+
+        diferencias = agenda.diferencias_agenda()
+        self.assertEqual(len(diferencias), 2)
+        with self.assertRaises(CommandError):
+            call_command('verificar_agenda', stdout=StringIO())
+
+        call_command('regenerar_agenda', stdout=StringIO())
+        self.assertEqual(agenda.diferencias_agenda(), [])
+
+    def test_eliminar_profesional_elimina_su_agenda(self):
+        Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES,
+                               hora_inicio=time(8, 0), hora_fin=time(10, 0))
+        Cita.objects.create(fecha_hora=self._dt(self.lunes, 8), paciente=self.paciente,
+                            profesional=self.profesional, cesfam=self.cesfam, servicio=self.servicio)
+        self.profesional.delete()
+        self.assertFalse(BloqueAgenda.objects.exists())
+
+
+class PrimerasHorasTests(TestCase):
+    def setUp(self):
+        self.password = 'testpassword123'
+        self.paciente = User.objects.create_user(
+            username='pac_primeras', email='pac_primeras@example.com', password=self.password,
+            first_name='Luis', last_name='Soto', rol=User.ROL_PACIENTE
+        )
+        self.cesfam = Cesfam.objects.create(nombre="Cesfam Test", direccion="123 Test St", telefono="123456789")
+        self.servicio = Servicio.objects.create(nombre="Consulta General", tipo="Médica", descripcion="Consulta de rutina")
+        hoy = timezone.localdate()
+        self.lunes = hoy + timedelta(days=7 - hoy.weekday())
+        self.tz = timezone.get_current_timezone()
+
+        # Cada profesional atiende el lunes desde una hora distinta
+        self.profesionales = []
+        for i, hora in enumerate((10, 8, 9)):
+            profesional = User.objects.create(
+                username=f'prof_primeras{i}', email=f'prof_primeras{i}@example.com',
+                first_name='Prof', last_name=str(i), rol=User.ROL_PROFESIONAL
+            )
+            Horario.objects.create(profesional=profesional, dia=Horario.LUNES,
+                                   hora_inicio=time(hora, 0), hora_fin=time(hora + 1, 0))
+            self.servicio.profesionales.add(profesional)
+            self.profesionales.append(profesional)
+
+    def _dt(self, hora, minuto=0):
+        return datetime.combine(self.lunes, time(hora, minuto), tzinfo=self.tz)
+
+    def test_primeras_horas_entre_profesionales(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Cita.objects.create(fecha_hora=self._dt(8), paciente=self.paciente, profesional=self.profesionales[1],
+                                cesfam=self.cesfam, servicio=self.servicio)
+        ahora = self._dt(0)
+
+        esperado = [
+            (self._dt(8, 30), self.profesionales[1].id),
+            (self._dt(9), self.profesionales[2].id),
+            (self._dt(9, 30), self.profesionales[2].id),
+        ]
+        ids = [p.id for p in self.profesionales]
+        self.assertEqual(agenda.primeros_disponibles(ids, 3, ahora=ahora), esperado)
+        self.assertEqual(primeros_disponibles(ids, 3, self.lunes, self.lunes, ahora=ahora), esperado)
+
+    def test_motor_carga_todos_los_profesionales_en_dos_consultas(self):
+        for i in range(10):
+            profesional = User.objects.create(username=f'prof_extra{i}', rol=User.ROL_PROFESIONAL)
+            Horario.objects.create(profesional=profesional, dia=Horario.LUNES,
+                                   hora_inicio=time(7, 0), hora_fin=time(12, 0))
+        ids = list(User.objects.filter(rol=User.ROL_PROFESIONAL).values_list('id', flat=True))
+        with self.assertNumQueries(2):
+            primeros_disponibles(ids, 5, self.lunes, self.lunes + timedelta(days=30))
+
+    def test_primeras_horas_json(self):
+        self.client.login(username=self.paciente.username, password=self.password)
+        response = self.client.get(reverse('primeras_horas_json', args=[self.servicio.id]), {'n': 2})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data), 2)
+        self.assertLessEqual(data[0]['start'], data[1]['start'])
+
+        response = self.client.get(reverse('agendar_primeras_horas', args=[self.servicio.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['primeras_horas']), 10)
+
+
+class ReservaTests(TestCase):
+    def setUp(self):
+        self.password = 'testpassword123'
+        self.profesional = User.objects.create_user(
+            username='prof_reserva', email='prof_reserva@example.com', password=self.password,
+            first_name='Ana', last_name='Rojas', rol=User.ROL_PROFESIONAL
+        )
+        self.paciente = User.objects.create_user(
+            username='pac_reserva', email='pac_reserva@example.com', password=self.password,
+            first_name='Luis', last_name='Soto', rol=User.ROL_PACIENTE
+        )
+        self.otro_paciente = User.objects.create(username='pac_reserva2', rol=User.ROL_PACIENTE)
+        self.cesfam = Cesfam.objects.create(nombre="Cesfam Test", direccion="123 Test St", telefono="123456789")
+        self.servicio = Servicio.objects.create(nombre="Consulta General", tipo="Médica", descripcion="Consulta de rutina")
+        self.fecha_hora = (timezone.now() + timedelta(days=3)).replace(minute=0, second=0, microsecond=0)
+
+    def test_segunda_reserva_del_mismo_bloque_falla(self):
+        reservas.reservar_cita(self.paciente, self.profesional, self.servicio, self.fecha_hora)
+        with self.assertRaises(reservas.HorarioNoDisponible):
+            reservas.reservar_cita(self.otro_paciente, self.profesional, self.servicio, self.fecha_hora)
+        self.assertEqual(Cita.objects.filter(profesional=self.profesional).count(), 1)
+
+    def test_solo_la_restriccion_del_bloque_es_horario_no_disponible(self):
+        reservas.reservar_cita(self.paciente, self.profesional, self.servicio, self.fecha_hora)
+        with self.assertRaises(IntegrityError) as choque, transaction.atomic():
+            Cita.objects.create(paciente=self.otro_paciente, profesional=self.profesional, servicio=self.servicio,
+                                fecha_hora=self.fecha_hora, cesfam=self.cesfam)
+        self.assertTrue(reservas.es_choque_de_horario(choque.exception))
+
+        BloqueAgenda.objects.create(profesional=self.profesional, inicio=self.fecha_hora, fin=self.fecha_hora)
+        with self.assertRaises(IntegrityError) as otro, transaction.atomic():
+            BloqueAgenda.objects.create(profesional=self.profesional, inicio=self.fecha_hora, fin=self.fecha_hora)
+        self.assertFalse(reservas.es_choque_de_horario(otro.exception))
+
+    def test_reserva_en_el_pasado_falla(self):
+        with self.assertRaises(reservas.ReservaError):
+            reservas.reservar_cita(self.paciente, self.profesional, self.servicio, timezone.now() - timedelta(hours=1))
+
+    def test_crear_cita_informa_bloque_tomado(self):
+        reservas.reservar_cita(self.otro_paciente, self.profesional, self.servicio, self.fecha_hora)
+        self.client.login(username=self.paciente.username, password=self.password)
+        response = self.client.post(reverse('crear_cita'), {
+            'profesional_id': self.profesional.id,
+            'servicio_id': self.servicio.id,
+            'fecha_hora_cita': self.fecha_hora.isoformat(),
+        })
+        self.assertRedirects(response, reverse('agendar_cita_paso3', args=[self.profesional.id, self.servicio.id]),
+                             fetch_redirect_response=False)
+        self.assertFalse(Cita.objects.filter(paciente=self.paciente).exists())
+
+    def test_profesional_crear_cita_no_notifica_si_el_bloque_esta_tomado(self):
+        reservas.reservar_cita(self.otro_paciente, self.profesional, self.servicio, self.fecha_hora)
+        self.client.login(username=self.profesional.username, password=self.password)
+        self.client.post(reverse('profesional_crear_cita'), {
+            'paciente_id': self.paciente.id,
+            'servicio_id': self.servicio.id,
+            'fecha_hora_cita': self.fecha_hora.isoformat(),
+        })
+        self.assertFalse(Cita.objects.filter(paciente=self.paciente).exists())
+        self.assertFalse(Notificacion.objects.filter(destinatario=self.paciente).exists())
+
+
+def _configuracion_gunicorn():
+    ruta = Path(settings.BASE_DIR) / 'gunicorn.conf.py'
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', ruta)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+class CacheDisponibilidadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profesional = User.objects.create(username='prof_cache', rol=User.ROL_PROFESIONAL)
+        self.paciente = User.objects.create(username='pac_cache', rol=User.ROL_PACIENTE)
+        self.cesfam = Cesfam.objects.create(nombre="Cesfam Test", direccion="123 Test St", telefono="123456789")
+        self.servicio = Servicio.objects.create(nombre="Consulta General", tipo="Médica", descripcion="Consulta de rutina")
+        self.horario = Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES,
+                                              hora_inicio=time(8, 0), hora_fin=time(10, 0))
+        hoy = timezone.localdate()
+        self.lunes = hoy + timedelta(days=7 - hoy.weekday())
+        self.domingo = self.lunes + timedelta(days=13)  # Dos semanas completas
+        self.tz = timezone.get_current_timezone()
+
+    def _consultar(self):
+        return cache_disponibilidad.horarios_disponibles(self.profesional, self.lunes, self.domingo)
+
+    def test_cuenta_aciertos_y_fallos(self):
+        primera = self._consultar()
+        self.assertEqual(cache_disponibilidad.estadisticas()['misses'], 2)
+
+        with self.assertNumQueries(0):
+            segunda = self._consultar()
+        self.assertEqual(primera, segunda)
+        self.assertEqual(cache_disponibilidad.estadisticas(), {'hits': 2, 'misses': 2, 'hit_rate': 0.5})
+
+    def test_cita_invalida_solo_su_semana(self):
+        self._consultar()
+        inicio = datetime.combine(self.lunes, time(8, 0), tzinfo=self.tz)
+        with self.captureOnCommitCallbacks(execute=True):
+            Cita.objects.create(fecha_hora=inicio, paciente=self.paciente, profesional=self.profesional,
+                                cesfam=self.cesfam, servicio=self.servicio)
+        cache_disponibilidad.reiniciar_estadisticas()
+
+        slots = self._consultar()
+        self.assertNotIn(inicio, slots)
+        self.assertEqual(cache_disponibilidad.estadisticas()['misses'], 1)
+        self.assertEqual(cache_disponibilidad.estadisticas()['hits'], 1)
+
+    def test_cambio_de_horario_invalida_todas_las_semanas(self):
+        self._consultar()
+        self.horario.bloqueado = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.horario.save()
+        cache_disponibilidad.reiniciar_estadisticas()
+
+        self.assertEqual(self._consultar(), [])
+        self.assertEqual(cache_disponibilidad.estadisticas()['misses'], 2)
+
+    def test_invalida_recien_al_confirmar(self):
+        antes = self._consultar()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.horario.bloqueado = True
+            self.horario.save()
+            # Antes de confirmar, la versión vigente sigue siendo la que corresponde a los datos confirmados
+            with self.assertNumQueries(0):
+                self.assertEqual(self._consultar(), antes)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self._consultar(), [])
+
+    def test_gunicorn_no_arranca_varios_workers_sin_cache_compartido(self):
+        configuracion = _configuracion_gunicorn()
+        with self.assertRaisesMessage(RuntimeError, 'DJANGO_CACHE_DIR'):
+            configuracion.on_starting(SimpleNamespace(cfg=SimpleNamespace(workers=3)))
+        configuracion.on_starting(SimpleNamespace(cfg=SimpleNamespace(workers=1)))
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                               'LOCATION': tempfile.mkdtemp()}}):
+            configuracion.on_starting(SimpleNamespace(cfg=SimpleNamespace(workers=3)))
+
+
+class PoblarHorariosTests(TestCase):
+    def setUp(self):
+        self.dental = User.objects.create(username='dental', rol=User.ROL_PROFESIONAL,
+                                          especialidad='Dental', email='dental@test.com')
+        self.medico = User.objects.create(username='medico', rol=User.ROL_PROFESIONAL, especialidad='Medicina')
+
+    def _poblar(self, *args):
+        salida = StringIO()
+        call_command('poblar_horarios', *args, stdout=salida)
+        return salida.getvalue()
+
+    def test_genera_horarios_y_agenda(self):
+        self._poblar('--especialidad', 'Dental', '--dias', 'lun-mie', '--bloque', '09:00-11:00')
+
+        horarios = Horario.objects.filter(profesional=self.dental)
+        self.assertEqual(sorted(horarios.values_list('dia', flat=True)), [0, 1, 2])
+        self.assertFalse(Horario.objects.filter(profesional=self.medico).exists())
+        self.assertTrue(BloqueAgenda.objects.filter(profesional=self.dental).exists())
+        self.assertEqual(agenda.diferencias_agenda(), [])
+
+        # Repetir sin --replace no duplica los horarios existentes
+        self._poblar('--especialidad', 'Dental', '--dias', 'lun-mie', '--bloque', '09:00-11:00')
+        self.assertEqual(horarios.count(), 3)
+
+    def test_replace_y_dry_run(self):
+        Horario.objects.create(profesional=self.medico, dia=Horario.SABADO,
+                               hora_inicio=time(8, 0), hora_fin=time(9, 0))
+
+        salida = self._poblar('--profesional', 'medico', '--dias', 'lun', '--replace', '--dry-run')
+        self.assertIn('[dry-run]', salida)
+        self.assertEqual(list(Horario.objects.filter(profesional=self.medico).values_list('dia', flat=True)),
+                         [Horario.SABADO])
+
+        self._poblar('--profesional', 'medico', '--dias', 'lun', '--replace')
+        self.assertEqual(Horario.objects.filter(profesional=self.medico).count(), 2)
+        self.assertFalse(Horario.objects.filter(profesional=self.medico, dia=Horario.SABADO).exists())
+        self.assertEqual(agenda.diferencias_agenda(), [])
+
+    def test_archivo_csv(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as f:
+            f.write('profesional,dias,hora_inicio,hora_fin\n')
+            f.write('dental@test.com,"0,2,4",08:00,12:00\n')
+            f.write('especialidad:Medicina,vie,15:00,16:00\n')
+        self._poblar('--archivo', f.name)
+
+        self.assertEqual(Horario.objects.filter(profesional=self.dental).count(), 3)
+        self.assertEqual(Horario.objects.get(profesional=self.medico).dia, Horario.VIERNES)
+
+    def test_bloque_invalido(self):
+        with self.assertRaises(CommandError):
+            self._poblar('--bloque', '10:00-09:00')
+
+
+class ImportacionCitasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profesional = User.objects.create(username='prof_import', rol=User.ROL_PROFESIONAL)
+        self.paciente = User.objects.create(username='pac_import', rol=User.ROL_PACIENTE,
+                                            email='pac@test.com', run='11111111-1')
+        self.admin = User.objects.create_user(username='admin_import', password='pw', rol=User.ROL_ADMIN)
+        self.cesfam = Cesfam.objects.create(nombre="Cesfam Test", direccion="123 Test St", telefono="123456789")
+        self.servicio = Servicio.objects.create(nombre="Consulta General", tipo="Médica", descripcion="Consulta de rutina")
+        Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES,
+                               hora_inicio=time(8, 0), hora_fin=time(12, 0))
+        hoy = timezone.localdate()
+        self.lunes = hoy + timedelta(days=7 - hoy.weekday())
+        self.tz = timezone.get_current_timezone()
+        self.existente = Cita.objects.create(
+            fecha_hora=datetime.combine(self.lunes, time(9, 0), tzinfo=self.tz), paciente=self.paciente,
+            profesional=self.profesional, cesfam=self.cesfam, servicio=self.servicio,
+        )
+
+    def _csv(self, *filas):
+        lineas = ['paciente,profesional,servicio,cesfam,fecha_hora']
+        lineas += [','.join(fila) for fila in filas]
+        return '\n'.join(lineas) + '\n'
+
+    def test_importa_y_rechaza_choques(self):
+        dia = self.lunes.isoformat()
+        contenido = self._csv(
+            ('pac@test.com', 'prof_import', 'Consulta General', '', f'{dia} 08:00'),
+            ('11111111-1', str(self.profesional.pk), str(self.servicio.pk), 'Cesfam Test', f'{dia}T10:00'),
+            ('pac_import', 'prof_import', 'Consulta General', '', f'{dia} 09:15'),  # Choca con la existente
+            ('pac_import', 'prof_import', 'Consulta General', '', f'{dia} 10:00'),  # Duplicada en el archivo
+            ('nadie', 'prof_import', 'Consulta General', '', f'{dia} 11:00'),
+            ('pac_import', 'prof_import', 'Consulta General', '', 'mañana'),
+        )
+        rechazos = []
+        with self.assertNumQueries(19):  # Constante por lote, sin importar la cantidad de filas
+            resultado = importacion.importar_citas(
+                importacion.leer_filas(StringIO(contenido)),
+                rechazar=lambda numero, fila, motivo: rechazos.append((numero, motivo)),
+            )
+
+        self.assertEqual(resultado, {'leidas': 6, 'creadas': 2, 'rechazadas': 4})
+        self.assertEqual([numero for numero, _ in sorted(rechazos)], [4, 5, 6, 7])
+        self.assertEqual(Cita.objects.filter(profesional=self.profesional).count(), 3)
+        self.assertFalse(BloqueAgenda.objects.filter(
+            profesional=self.profesional, inicio=datetime.combine(self.lunes, time(8, 0), tzinfo=self.tz),
+            estado=BloqueAgenda.LIBRE,
+        ).exists())
+        self.assertEqual(agenda.diferencias_agenda(), [])
+
+    def test_comando_escribe_archivo_de_rechazos(self):
+        dia = self.lunes.isoformat()
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = f'{directorio}/citas.ndjson'
+            with open(ruta, 'w', encoding='utf-8') as f:
+                f.write('{"paciente": "pac_import", "profesional": "prof_import", '
+                        f'"servicio": "Consulta General", "fecha_hora": "{dia}T11:00"}}\n')
+                f.write('{"paciente": "pac_import", "profesional": "prof_import", '
+                        f'"servicio": "Consulta General", "fecha_hora": "{dia}T09:00"}}\n')
+                f.write('no es json\n')
+            call_command('importar_citas', ruta, stdout=StringIO())
+
+            with open(f'{ruta}.rechazos.csv', encoding='utf-8') as f:
+                rechazos = f.read().splitlines()
+        self.assertEqual(len(rechazos), 3)  # Encabezado y dos rechazos
+        self.assertTrue(Cita.objects.filter(fecha_hora=datetime.combine(self.lunes, time(11, 0), tzinfo=self.tz)).exists())
+
+    def test_endpoint_solo_admin(self):
+        contenido = self._csv(('pac_import', 'prof_import', 'Consulta General', '', f'{self.lunes.isoformat()} 08:30'))
+        url = reverse('importar_citas')
+
+        self.client.force_login(self.profesional)
+        self.client.post(url, contenido, content_type='text/csv')
+        self.assertEqual(Cita.objects.count(), 1)
+
+        self.client.force_login(self.admin)
+        response = self.client.post(url, contenido, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['creadas'], 1)
+        self.assertEqual(Cita.objects.count(), 2)
+
+
+class ExportacionCitasTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin_export', password='pw', rol=User.ROL_ADMIN)
+        self.profesional = User.objects.create(username='prof_export', rol=User.ROL_PROFESIONAL)
+        self.otro = User.objects.create(username='otro_export', rol=User.ROL_PROFESIONAL)
+        self.paciente = User.objects.create(username='pac_export', rol=User.ROL_PACIENTE, first_name='Ana')
+        self.cesfam = Cesfam.objects.create(nombre="Cesfam Test", direccion="123 Test St", telefono="123456789")
+        self.servicio = Servicio.objects.create(nombre="Consulta General", tipo="Médica", descripcion="Consulta de rutina")
+        tz = timezone.get_current_timezone()
+        self.dia = timezone.localdate() + timedelta(days=3)
+        for profesional, dia, hora in ((self.profesional, self.dia, 9), (self.profesional, self.dia, 23),
+                                       (self.profesional, self.dia + timedelta(days=1), 9), (self.otro, self.dia, 9)):
+            Cita.objects.create(fecha_hora=datetime.combine(dia, time(hora, 0), tzinfo=tz), paciente=self.paciente,
+                                profesional=profesional, cesfam=self.cesfam, servicio=self.servicio)
+        self.client.force_login(self.admin)
+
+    def _exportar(self, **params):
+        response = self.client.get(reverse('exportar_citas'), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_con_filtros(self):
+        contenido = self._exportar(desde=self.dia.isoformat(), hasta=self.dia.isoformat(),
+                                   profesional=self.profesional.pk)
+        filas = list(csv.DictReader(StringIO(contenido)))
+        # La cita de las 23:00 locales cae en el día siguiente en UTC y aun así se incluye
+        self.assertEqual(len(filas), 2)
+        self.assertEqual({f['profesional'] for f in filas}, {'prof_export'})
+        self.assertEqual(filas[0]['paciente_nombre'], 'Ana')
+        self.assertEqual(filas[0]['servicio'], 'Consulta General')
+
+    def test_ndjson_una_consulta(self):
+        with self.assertNumQueries(3):  # Sesión, usuario y la exportación completa
+            contenido = self._exportar(formato='ndjson', cesfam=self.cesfam.pk)
+        filas = [json.loads(linea) for linea in contenido.splitlines()]
+        self.assertEqual(len(filas), 4)
+        self.assertEqual(filas, sorted(filas, key=lambda f: (f['fecha_hora'], f['id'])))
+
+    def test_exportado_se_puede_reimportar(self):
+        contenido = self._exportar(profesional=self.otro.pk)
+        Cita.objects.filter(profesional=self.otro).delete()
+        resultado = importacion.importar_citas(importacion.leer_filas(StringIO(contenido)))
+        self.assertEqual(resultado['creadas'], 1)
+
+    def test_solo_administradores(self):
+        self.client.force_login(self.profesional)
+        response = self.client.get(reverse('exportar_citas'))
+        self.assertRedirects(response, reverse('login_page'), fetch_redirect_response=False)
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.client.get(reverse('exportar_citas'), {'desde': 'ayer'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('exportar_citas'), {'formato': 'xml'}).status_code, 400)
+
+
+class DashboardConsultasTests(TestCase):
+    """Cada rol carga el panel con una cantidad fija de consultas, sin importar cuántas citas tenga."""
+
+    def setUp(self):
+        cache.clear()
+        self.paciente = User.objects.create(username='pac_panel', rol=User.ROL_PACIENTE)
+        self.profesional = User.objects.create(username='prof_panel', rol=User.ROL_PROFESIONAL)
+        self.admin = User.objects.create(username='admin_panel', rol=User.ROL_ADMIN, is_staff=True)
+        self.cesfam = Cesfam.objects.create(nombre="Cesfam Test", direccion="123 Test St", telefono="123456789")
+        self.servicio = Servicio.objects.create(nombre="Consulta General", tipo="Médica", descripcion="Consulta de rutina")
+        self.ahora = timezone.now().replace(second=0, microsecond=0)
+        self._crear_citas(range(-4, 4))
+
+    def _crear_citas(self, horas):
+        for i in horas:
+            Cita.objects.create(fecha_hora=self.ahora + timedelta(hours=i), paciente=self.paciente,
+                                profesional=self.profesional, cesfam=self.cesfam, servicio=self.servicio)
+        with self.captureOnCommitCallbacks(execute=True):
+            Notificacion.objects.create(destinatario=self.paciente, mensaje='Aviso')
+
+    def _consultas_panel(self, usuario, consultas):
+        self.client.force_login(usuario)
+        with self.assertNumQueries(consultas):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_paciente(self):
+        # Sesión, usuario, versiones de los fragmentos, anuncios, notificaciones, próximas citas e historial
+        response = self._consultas_panel(self.paciente, 7)
+        self.assertEqual(len(response.context['proximas_citas']), 3)
+        # Los anuncios salen del caché de fragmentos; la notificación nueva invalida las del paciente
+        self._crear_citas(range(10, 20))
+        self._consultas_panel(self.paciente, 6)
+
+    def test_profesional(self):
+        # Sesión, usuario, versiones de los fragmentos, anuncios, notificaciones, contadores y próximas citas
+        response = self._consultas_panel(self.profesional, 7)
+        self.assertEqual(response.context['total_citas'], 8)
+        self.assertEqual(response.context['pacientes_unicos'], 1)
+        # Anuncios y notificaciones del profesional salen del caché de fragmentos
+        self._crear_citas(range(10, 20))
+        self._consultas_panel(self.profesional, 5)
+
+    def test_admin_cachea_totales(self):
+        # Sesión, usuario, versiones de los fragmentos, anuncios, notificaciones y tres consultas de totales
+        response = self._consultas_panel(self.admin, 8)
+        self.assertEqual(response.context['resumen'], {
+            'total_cesfams': 1, 'total_profesionales': 1, 'total_usuarios': 1, 'total_citas': 8,
+        })
+        self._consultas_panel(self.admin, 3)
+
+
+class MetricasTests(TestCase):
+    def setUp(self):
+        self.profesional = User.objects.create(username='prof_metricas', rol=User.ROL_PROFESIONAL, first_name='Eva')
+        self.otro = User.objects.create(username='otro_metricas', rol=User.ROL_PROFESIONAL)
+        self.paciente = User.objects.create(username='pac_metricas', rol=User.ROL_PACIENTE)
+        self.admin = User.objects.create(username='admin_metricas', rol=User.ROL_ADMIN)
+        self.cesfam = Cesfam.objects.create(nombre="Cesfam Test", direccion="123 Test St", telefono="123456789")
+        self.servicio = Servicio.objects.create(nombre="Consulta General", tipo="Médica", descripcion="Consulta de rutina")
+        self.tz = timezone.get_current_timezone()
+        self.hoy = timezone.localdate()
+
+    def _cita(self, dias, hora=10, profesional=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Cita.objects.create(
+                fecha_hora=datetime.combine(self.hoy - timedelta(days=dias), time(hora, 0), tzinfo=self.tz),
+                paciente=self.paciente, profesional=profesional or self.profesional,
+                cesfam=self.cesfam, servicio=self.servicio,
+            )
+
+    def test_senales_mantienen_el_resumen(self):
+        cita = self._cita(0)
+        self._cita(0, hora=23)  # Ya es el día siguiente en UTC, pero cuenta para hoy
+        self._cita(40, profesional=self.otro)
+        self.assertEqual(ResumenCitas.objects.get(periodo=ResumenCitas.DIA, fecha=self.hoy).total, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.fecha_hora -= timedelta(days=1)
+            cita.save()
+            cita.profesional = self.otro
+            cita.save()
+        self.assertEqual(metricas.diferencias(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Cita.objects.filter(profesional=self.otro).delete()
+        self.assertEqual(metricas.diferencias(), [])
+        self.assertEqual(ResumenCitas.objects.filter(periodo=ResumenCitas.MES).aggregate(t=Sum('total'))['t'], 1)
+
+    def test_sin_upsert_con_columnas_de_conflicto(self):
+        # Como en MySQL
+        self._cita(0)
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            self._cita(0, hora=11)
+        self.assertEqual(ResumenCitas.objects.get(periodo=ResumenCitas.DIA, fecha=self.hoy).total, 2)
+        self.assertEqual(metricas.diferencias(), [])
+
+    def test_reconstruir(self):
+        for dias in (0, 1, 8, 35):
+            self._cita(dias)
+        ResumenCitas.objects.all().delete()
+        self.assertTrue(metricas.diferencias())
+        with self.assertRaises(CommandError):
+            call_command('reconstruir_metricas', '--verificar', stdout=StringIO())
+
+        call_command('reconstruir_metricas', stdout=StringIO())
+        self.assertEqual(metricas.diferencias(), [])
+        self.assertEqual(ResumenCitas.objects.get(periodo=ResumenCitas.DIA, fecha=self.hoy).total, 1)
+
+    def test_pagina_no_consulta_citas(self):
+        self._cita(0)
+        self._cita(1, profesional=self.otro)
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('dashboard_metricas'))
+        self.assertFalse([q['sql'] for q in consultas if '"cita"' in q['sql']])
+
+        self.assertEqual(response.context['total_citas'], 2)
+        self.assertEqual(response.context['citas_dia'][-1], {'dia': self.hoy, 'total': 1})
+        self.assertEqual(len(response.context['citas_mes']), 6)
+        self.assertEqual(response.context['carga_profesionales'][0]['total'], 1)
+        self.assertContains(response, 'Eva')
+
+
+class CommunicationQueryCountTests(TestCase):
+    """Listing conversations and messages costs a fixed number of queries."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='reader', password='pw', rol=User.ROL_PACIENTE)
+        self.professional = User.objects.create_user(username='prof_reader', password='pw', rol=User.ROL_PROFESIONAL)
+        self.cesfam = Cesfam.objects.create(nombre="Cesfam Test", direccion="123 Test St", telefono="123456789")
+        self.servicio = Servicio.objects.create(nombre="Consulta General", tipo="Médica", descripcion="Consulta de rutina")
+        self.client.force_authenticate(user=self.user)
+        self._add_conversations(2, messages=2)
+
+    def _add_conversations(self, count, messages):
+        for i in range(count):
+            cita = Cita.objects.create(
+                fecha_hora=timezone.now() + timedelta(days=Conversation.objects.count() + 1),
+                paciente=self.user, profesional=self.professional, cesfam=self.cesfam, servicio=self.servicio,
+            )
+            conversation = Conversation.objects.create(topic=f'Topic {i}', cita=cita)
+            conversation.participants.add(self.user, self.professional)
+            for j in range(messages):
+                message = Message.objects.create(conversation=conversation, sender=self.professional, content=f'Msg {j}')
+            for user in (self.user, self.professional):
+                lecturas.avanzar(conversation.pk, user.pk, message.pk, avisar=False)
+
+    def test_conversation_list_query_count_is_constant(self):
+        url = reverse('conversation-list')
+        # Conversations (with cita, paciente and profesional), participants, read marks (with user), messages (with sender)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 2)
+
+        self._add_conversations(5, messages=4)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertEqual(len(response.data['results'][0]['messages']), 4)
+        self.assertEqual(len(response.data['results'][0]['messages'][0]['read_by']), 2)
+
+    def test_message_list_query_count_is_constant(self):
+        conversation = Conversation.objects.first()
+        url = reverse('conversation-messages-list', kwargs={'conversation_pk': conversation.pk})
+        # Messages (with sender and conversation) and the conversations' read marks (with user)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+        for j in range(10):
+            message = Message.objects.create(conversation=conversation, sender=self.user, content=f'Extra {j}')
+            lecturas.avanzar(conversation.pk, self.user.pk, message.pk, avisar=False)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 12)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('message-list'))
+
+
+class KeysetPaginationTests(TestCase):
+    """Messages and conversations are paged with before/after cursors."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='pager', password='pw', rol=User.ROL_PACIENTE)
+        self.other = User.objects.create_user(username='pager_prof', password='pw', rol=User.ROL_PROFESIONAL)
+        self.client.force_authenticate(user=self.user)
+        self.conversation = Conversation.objects.create(topic='Paged')
+        self.conversation.participants.add(self.user, self.other)
+        base = timezone.now() - timedelta(hours=1)
+        for i in range(7):
+            message = Message.objects.create(conversation=self.conversation, sender=self.other, content=f'Msg {i}')
+            # Two messages share each timestamp so the id breaks the tie
+            Message.objects.filter(pk=message.pk).update(timestamp=base + timedelta(minutes=i // 2))
+        self.url = reverse('conversation-messages-list', kwargs={'conversation_pk': self.conversation.pk})
+
+    def _contents(self, response):
+        return [m['content'] for m in response.data['results']]
+
+    def test_first_page_is_the_latest_in_chronological_order(self):
+        response = self.client.get(self.url, {'limit': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._contents(response), ['Msg 4', 'Msg 5', 'Msg 6'])
+        self.assertIsNotNone(response.data['before'])
+        self.assertFalse(response.data['has_more_after'])
+
+    def test_before_scrolls_back_until_exhausted(self):
+        seen = []
+        params = {'limit': 3}
+        while True:
+            response = self.client.get(self.url, params)
+            seen = self._contents(response) + seen
+            if response.data['before'] is None:
+                break
+            params['before'] = response.data['before']
+        self.assertEqual(seen, [f'Msg {i}' for i in range(7)])
+
+    def test_after_returns_only_new_messages(self):
+        latest = self.client.get(self.url).data
+        response = self.client.get(self.url, {'after': latest['after']})
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['after'], latest['after'])
+
+        Message.objects.create(conversation=self.conversation, sender=self.other, content='New')
+        response = self.client.get(self.url, {'after': latest['after']})
+        self.assertEqual(self._contents(response), ['New'])
+
+    def test_after_pages_forward_oldest_first(self):
+        first = self.client.get(self.url, {'limit': 2, 'before': self.client.get(self.url, {'limit': 5}).data['before']}).data
+        self.assertEqual([m['content'] for m in first['results']], ['Msg 0', 'Msg 1'])
+        response = self.client.get(self.url, {'limit': 3, 'after': first['after']})
+        self.assertEqual(self._contents(response), ['Msg 2', 'Msg 3', 'Msg 4'])
+        self.assertTrue(response.data['has_more_after'])
+
+    def test_invalid_cursor_is_rejected(self):
+        for cursor in ('nope', 'WzEsMl0'):  # not base64 JSON / wrong shape
+            response = self.client.get(self.url, {'before': cursor})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_conversations_are_most_recent_first(self):
+        older = Conversation.objects.create(topic='Older')
+        older.participants.add(self.user, self.other)
+        Conversation.objects.filter(pk=older.pk).update(updated_at=timezone.now() - timedelta(days=1))
+        response = self.client.get(reverse('conversation-list'), {'limit': 1})
+        self.assertEqual([c['topic'] for c in response.data['results']], ['Paged'])
+        response = self.client.get(reverse('conversation-list'), {'limit': 1, 'before': response.data['before']})
+        self.assertEqual([c['topic'] for c in response.data['results']], ['Older'])
+        self.assertIsNone(response.data['before'])
+
+
+class ConversationSummaryTests(TestCase):
+    """The summary endpoint returns the last message and unread count in one query."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='summary', password='pw', rol=User.ROL_PACIENTE)
+        self.other = User.objects.create_user(username='summary_prof', password='pw', first_name='Ana', rol=User.ROL_PROFESIONAL)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('conversation-summary')
+
+    def _conversation(self, messages=0):
+        conversation = Conversation.objects.create(topic='Summary')
+        conversation.participants.add(self.user, self.other)
+        for i in range(messages):
+            Message.objects.create(conversation=conversation, sender=self.other, content=f'Msg {i}')
+        return conversation
+
+    def test_summary_fields(self):
+        conversation = self._conversation(messages=3)
+        read = Message.objects.filter(conversation=conversation).order_by('id').first()
+        lecturas.avanzar(conversation.pk, self.user.pk, read.pk)
+        mine = Message.objects.create(conversation=conversation, sender=self.user, content='Mine')
+        self._conversation()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summary = next(c for c in response.data['results'] if c['id'] == conversation.id)
+        self.assertEqual(summary['other_participant'], {
+            'id': self.other.id, 'username': 'summary_prof', 'first_name': 'Ana', 'rol': User.ROL_PROFESIONAL,
+        })
+        self.assertEqual(summary['participant_count'], 2)
+        self.assertEqual(summary['last_message']['id'], mine.id)
+        self.assertEqual(summary['last_message']['content'], 'Mine')
+        self.assertEqual(summary['last_message']['sender_id'], self.user.id)
+        # Two unread messages from the other participant; the user's own message does not count
+        self.assertEqual(summary['unread_count'], 2)
+        self.assertNotIn('messages', summary)
+
+        empty = next(c for c in response.data['results'] if c['id'] != conversation.id)
+        self.assertIsNone(empty['last_message'])
+        self.assertEqual(empty['unread_count'], 0)
+
+    def test_only_own_conversations(self):
+        outsider = User.objects.create_user(username='outsider', password='pw')
+        foreign = Conversation.objects.create(topic='Foreign')
+        foreign.participants.add(outsider, self.other)
+        self._conversation()
+        response = self.client.get(self.url)
+        self.assertNotIn(foreign.id, [c['id'] for c in response.data['results']])
+
+    def test_single_query_regardless_of_history(self):
+        self._conversation(messages=2)
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        for _ in range(5):
+            self._conversation(messages=20)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results']), 6)
+
+
+class TiempoRealTests(TestCase):
+    """Mensajes y lecturas llegan por el canal en memoria y el flujo SSE se puede reanudar."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='rt_user', password='pw', rol=User.ROL_PACIENTE)
+        self.other = User.objects.create_user(username='rt_prof', password='pw', rol=User.ROL_PROFESIONAL)
+        self.outsider = User.objects.create_user(username='rt_outsider', password='pw')
+        self.conversation = Conversation.objects.create(topic='Tiempo real')
+        self.conversation.participants.add(self.user, self.other)
+        self.mensajes = [
+            Message.objects.create(conversation=self.conversation, sender=self.other, content=f'Msg {i}') for i in range(3)
+        ]
+
+    def _suscribir(self, loop, usuario):
+        async def suscribir():
+            return tiempo_real.canal.suscribir(usuario.pk)
+        suscripcion = loop.run_until_complete(suscribir())
+        self.addCleanup(tiempo_real.canal.desuscribir, suscripcion)
+        return suscripcion
+
+    def _recibidos(self, loop, suscripcion):
+        loop.run_until_complete(asyncio.sleep(0))
+        eventos = []
+        while not suscripcion.cola.empty():
+            eventos.append(suscripcion.cola.get_nowait())
+        return eventos
+
+    def test_signals_publish_to_participants_after_commit(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        suscripcion_usuario = self._suscribir(loop, self.user)
+        suscripcion_ajena = self._suscribir(loop, self.outsider)
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            message = Message.objects.create(conversation=self.conversation, sender=self.other, content='Hola')
+        self.assertEqual(self._recibidos(loop, suscripcion_usuario), [])  # Nada antes del commit
+        for callback in callbacks:
+            callback()
+        eventos = self._recibidos(loop, suscripcion_usuario)
+        self.assertEqual([(e['tipo'], e['id']) for e in eventos], [('message', message.id)])
+        self.assertEqual(eventos[0]['data']['content'], 'Hola')
+        self.assertEqual(eventos[0]['data']['sender']['username'], 'rt_prof')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lecturas.avanzar(self.conversation.pk, self.other.pk, message.pk)
+        eventos = self._recibidos(loop, suscripcion_usuario)
+        self.assertEqual([e['tipo'] for e in eventos], ['read'])
+        self.assertEqual(eventos[0]['data'], {'conversation': self.conversation.id, 'user': self.other.id, 'last_read_message_id': message.id})
+        self.assertEqual(self._recibidos(loop, suscripcion_ajena), [])
+
+    def test_full_queue_marks_subscription_as_lagging(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        suscripcion = self._suscribir(loop, self.user)
+        for i in range(tiempo_real.TAMANO_COLA + 1):
+            tiempo_real.canal.publicar([self.user.pk], {'tipo': 'message', 'id': i, 'data': {}})
+        loop.run_until_complete(asyncio.sleep(0))
+        self.assertTrue(suscripcion.atrasada)
+
+    async def test_stream_resumes_after_last_seen_id_without_duplicates(self):
+        flujo = tiempo_real.flujo_eventos(self.user.pk, ultimo_id=self.mensajes[0].id)
+        self.assertEqual(await anext(flujo), 'retry: 3000\n\n')
+        reenviados = [await anext(flujo), await anext(flujo)]
+        self.assertEqual([tiempo_real.formatear(e) for e in await sync_to_async(tiempo_real.mensajes_pendientes)(self.user.pk, self.mensajes[0].id)], reenviados)
+        self.assertTrue(reenviados[0].startswith(f'id: {self.mensajes[1].id}\nevent: message\n'))
+
+        # Un mensaje ya reenviado que llega tarde por la cola no se repite
+        tiempo_real.canal.publicar([self.user.pk], {'tipo': 'message', 'id': self.mensajes[2].id, 'data': {}})
+        tiempo_real.canal.publicar([self.user.pk], {'tipo': 'message', 'id': self.mensajes[2].id + 1, 'data': {'content': 'Nuevo'}})
+        siguiente = await anext(flujo)
+        self.assertTrue(siguiente.startswith(f'id: {self.mensajes[2].id + 1}\n'))
+        self.assertEqual(tiempo_real.canal.conexiones(), 1)
+        await flujo.aclose()
+        self.assertEqual(tiempo_real.canal.conexiones(), 0)
+
+    async def test_stream_delivers_ids_out_of_order(self):
+        flujo = tiempo_real.flujo_eventos(self.user.pk)
+        await anext(flujo)
+        # El 11 de una conversación se confirma antes que el 10 de otra: ambos llegan, una sola vez
+        for evento_id in (11, 10, 11, 12):
+            tiempo_real.canal.publicar([self.user.pk], {'tipo': 'message', 'id': evento_id, 'data': {}})
+        recibidos = [await anext(flujo) for _ in range(3)]
+        self.assertEqual([r.split('\n')[0] for r in recibidos], ['id: 11', 'id: 10', 'id: 12'])
+        await flujo.aclose()
+
+    def test_resume_replays_message_committed_after_the_last_seen_id(self):
+        otra = Conversation.objects.create(topic='Otra')
+        otra.participants.add(self.user, self.other)
+        tardio = Message.objects.create(conversation=otra, sender=self.other, content='Se confirmó tarde')
+        visto = Message.objects.create(conversation=self.conversation, sender=self.other, content='Visto')
+        # Fuera de la ventana no se reenvía lo anterior al último visto
+        Message.objects.filter(pk=self.mensajes[0].pk).update(
+            timestamp=timezone.now() - tiempo_real.VENTANA_REANUDACION - timedelta(minutes=1),
+        )
+        ids = [evento['id'] for evento in tiempo_real.mensajes_pendientes(self.user.pk, visto.id)]
+        self.assertEqual(ids, [self.mensajes[1].id, self.mensajes[2].id, tardio.id])
+        self.assertEqual(tiempo_real.mensajes_pendientes(self.outsider.pk, visto.id), [])
+
+    async def test_stream_sends_keepalive_when_idle(self):
+        flujo = tiempo_real.flujo_eventos(self.user.pk, intervalo_keepalive=0.01)
+        await anext(flujo)
+        self.assertEqual(await anext(flujo), ': keepalive\n\n')
+        await flujo.aclose()
+
+    async def test_events_view_streams_for_logged_in_users(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('mensajeria_eventos'), headers={'Last-Event-ID': str(self.mensajes[1].id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        contenido = aiter(response.streaming_content)
+        await anext(contenido)
+        # El anterior al último visto entra por la ventana de reanudación
+        self.assertIn(f'id: {self.mensajes[0].id}\n'.encode(), await anext(contenido))
+        self.assertIn(f'id: {self.mensajes[2].id}\n'.encode(), await anext(contenido))
+        await contenido.aclose()
+
+    def test_events_view_requires_asgi(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('mensajeria_eventos')).status_code, 501)
+
+
+class NotificacionesTiempoRealTests(TestCase):
+    """Las notificaciones nuevas llegan por SSE o long-poll y se reanudan desde el último id."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='noti_user', password='pw', rol=User.ROL_PACIENTE)
+        self.otro = User.objects.create_user(username='noti_otro', password='pw', rol=User.ROL_PACIENTE)
+        self.notificaciones = [Notificacion.objects.create(destinatario=self.user, mensaje=f'Aviso {i}') for i in range(3)]
+        Notificacion.objects.create(destinatario=self.otro, mensaje='Ajena')
+
+    def test_signal_publishes_to_recipient_after_commit(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def suscribir(usuario):
+            return tiempo_real.canal_notificaciones.suscribir(usuario.pk)
+        propia = loop.run_until_complete(suscribir(self.user))
+        ajena = loop.run_until_complete(suscribir(self.otro))
+        self.addCleanup(tiempo_real.canal_notificaciones.desuscribir, propia)
+        self.addCleanup(tiempo_real.canal_notificaciones.desuscribir, ajena)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            notificacion = Notificacion.objects.create(destinatario=self.user, mensaje='Nueva cita')
+        loop.run_until_complete(asyncio.sleep(0))
+        evento = propia.cola.get_nowait()
+        self.assertEqual((evento['tipo'], evento['id']), ('notificacion', notificacion.id))
+        self.assertEqual(evento['data']['mensaje'], 'Nueva cita')
+        self.assertTrue(ajena.cola.empty())
+
+    async def test_stream_replays_missed_notifications(self):
+        flujo = tiempo_real.flujo_eventos(
+            self.user.pk, self.notificaciones[0].id,
+            canal=tiempo_real.canal_notificaciones, pendientes=tiempo_real.notificaciones_pendientes,
+        )
+        await anext(flujo)
+        reenviadas = [await anext(flujo), await anext(flujo)]
+        self.assertTrue(reenviadas[0].startswith(f'id: {self.notificaciones[1].id}\nevent: notificacion\n'))
+        self.assertIn('"mensaje":"Aviso 2"', reenviadas[1])
+        await flujo.aclose()
+
+    def test_long_poll_returns_pending_immediately(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('notificaciones_nuevas'), {'last_id': self.notificaciones[0].id})
+        self.assertEqual([n['mensaje'] for n in response.json()['notificaciones']], ['Aviso 1', 'Aviso 2'])
+        # Bajo WSGI no se espera aunque no haya nada nuevo
+        vistos = ','.join(str(n.id) for n in self.notificaciones)
+        response = self.client.get(reverse('notificaciones_nuevas'), {'last_id': self.notificaciones[2].id, 'vistos': vistos})
+        self.assertEqual(response.json(), {'notificaciones': [], 'espera': 0})
+
+    def test_notification_committed_out_of_order_is_not_lost(self):
+        # Aviso 1 se confirmó después que Aviso 2, que el cliente ya recibió
+        ultimo = self.notificaciones[2].id
+        self.assertEqual(
+            [e['id'] for e in tiempo_real.notificaciones_pendientes(self.user.pk, ultimo)],
+            [self.notificaciones[0].id, self.notificaciones[1].id],
+        )
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('notificaciones_nuevas'), {
+            'last_id': ultimo, 'vistos': f'{self.notificaciones[0].id},{ultimo},x',
+        })
+        self.assertEqual([n['mensaje'] for n in response.json()['notificaciones']], ['Aviso 1'])
+        # Lo anterior a la ventana de reanudación no se vuelve a enviar
+        Notificacion.objects.filter(pk=self.notificaciones[0].pk).update(
+            fecha=timezone.now() - tiempo_real.VENTANA_REANUDACION - timedelta(minutes=1),
+        )
+        self.assertEqual(
+            [e['id'] for e in tiempo_real.notificaciones_pendientes(self.user.pk, ultimo)], [self.notificaciones[1].id],
+        )
+
+    async def test_stream_delivers_notifications_out_of_order(self):
+        flujo = tiempo_real.flujo_eventos(
+            self.user.pk, self.notificaciones[2].id,
+            canal=tiempo_real.canal_notificaciones, pendientes=tiempo_real.notificaciones_pendientes,
+        )
+        await anext(flujo)
+        reenviadas = [await anext(flujo), await anext(flujo)]
+        self.assertTrue(reenviadas[0].startswith(f'id: {self.notificaciones[0].id}\n'))
+        # Una reenviada que además llega por la cola no se repite; una menor nueva sí llega
+        nueva = self.notificaciones[2].id + 10
+        for evento_id in (self.notificaciones[1].id, nueva + 1, nueva):
+            tiempo_real.canal_notificaciones.publicar([self.user.pk], {'tipo': 'notificacion', 'id': evento_id, 'data': {}})
+        recibidas = [await anext(flujo), await anext(flujo)]
+        self.assertEqual([r.split('\n')[0] for r in recibidas], [f'id: {nueva + 1}', f'id: {nueva}'])
+        await flujo.aclose()
+
+    async def test_long_poll_waits_for_new_notification(self):
+        ultimo = self.notificaciones[2].id
+        vistos = [n.id for n in self.notificaciones]
+        espera = asyncio.ensure_future(tiempo_real.esperar_pendientes(
+            self.user.pk, ultimo, tiempo_real.canal_notificaciones, tiempo_real.notificaciones_pendientes, 5, vistos,
+        ))
+        await asyncio.sleep(0.05)
+        self.assertFalse(espera.done())
+        notificacion = await sync_to_async(Notificacion.objects.create)(destinatario=self.user, mensaje='Llegó')
+        tiempo_real.canal_notificaciones.publicar([self.user.pk], tiempo_real.evento_notificacion(notificacion))
+        eventos = await asyncio.wait_for(espera, 5)
+        self.assertEqual([e['data']['mensaje'] for e in eventos], ['Llegó'])
+
+        vacio = await tiempo_real.esperar_pendientes(
+            self.user.pk, notificacion.id, tiempo_real.canal_notificaciones, tiempo_real.notificaciones_pendientes, 0.01,
+            vistos + [notificacion.id],
+        )
+        self.assertEqual(vacio, [])
+        self.assertEqual(tiempo_real.canal_notificaciones.conexiones(), 0)
+
+
+class MarkConversationReadTests(TestCase):
+    """Marking a conversation read moves one watermark with a constant number of queries."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='bulk_reader', password='pw', rol=User.ROL_PACIENTE)
+        self.other = User.objects.create_user(username='bulk_sender', password='pw', rol=User.ROL_PROFESIONAL)
+        self.client.force_authenticate(user=self.user)
+        self.conversation = Conversation.objects.create(topic='Bulk read')
+        self.conversation.participants.add(self.user, self.other)
+        self.url = reverse('conversation-mark-as-read', kwargs={'pk': self.conversation.pk})
+
+    def _messages(self, count, sender=None):
+        return [
+            Message.objects.create(conversation=self.conversation, sender=sender or self.other, content=f'Msg {i}')
+            for i in range(count)
+        ]
+
+    def _watermark(self, user=None):
+        return ConversationRead.objects.get(conversation=self.conversation, user=user or self.user).last_read_message_id
+
+    def test_marks_unread_messages_up_to_id(self):
+        messages = self._messages(5)
+        lecturas.avanzar(self.conversation.pk, self.user.pk, messages[0].pk, avisar=False)
+        own = self._messages(1, sender=self.user)[0]
+
+        response = self.client.post(self.url, {'up_to': messages[3].pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['marked'], 3)
+        self.assertEqual(self._watermark(), messages[3].pk)
+        self.assertNotIn(self.user, lecturas.usuarios_al_dia(self.conversation))
+
+        response = self.client.post(self.url, format='json')
+        self.assertEqual(response.data['marked'], 1)
+        self.assertEqual(self._watermark(), own.pk)
+        self.assertIn(self.user, lecturas.usuarios_al_dia(self.conversation))
+
+    def test_up_to_before_last_message_keeps_conversation_unread(self):
+        messages = self._messages(3)
+        detail = reverse('conversation-detail', kwargs={'pk': self.conversation.pk})
+        self.client.post(self.url, {'up_to': messages[1].pk}, format='json')
+        self.assertNotIn(self.user.pk, [u['id'] for u in self.client.get(detail).data['is_read_by']])
+        self.client.post(self.url, {'up_to': messages[2].pk + 100}, format='json')
+        self.assertEqual(self._watermark(), messages[2].pk)
+        self.assertIn(self.user.pk, [u['id'] for u in self.client.get(detail).data['is_read_by']])
+
+    def test_watermark_never_moves_back(self):
+        messages = self._messages(3)
+        self.client.post(self.url, format='json')
+        response = self.client.post(self.url, {'up_to': messages[0].pk}, format='json')
+        self.assertEqual(response.data['marked'], 0)
+        self.assertEqual(self._watermark(), messages[2].pk)
+        self.assertEqual(ConversationRead.objects.filter(conversation=self.conversation, user=self.user).count(), 1)
+
+    def test_query_count_does_not_grow_with_thread_length(self):
+        self._messages(3)
+        # Conversation, previous watermark, unread summary, savepoint, watermark insert and update, release
+        with self.assertNumQueries(7):
+            self.client.post(self.url, format='json')
+        self._messages(1000)
+        with self.assertNumQueries(7):
+            response = self.client.post(self.url, format='json')
+        self.assertEqual(response.data['marked'], 1000)
+        self.assertEqual(ConversationRead.objects.filter(conversation=self.conversation).count(), 1)
+
+    def test_invalid_up_to_and_foreign_conversation(self):
+        self.assertEqual(self.client.post(self.url, {'up_to': 'x'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        foreign = Conversation.objects.create(topic='Foreign')
+        foreign.participants.add(self.other)
+        url = reverse('conversation-mark-as-read', kwargs={'pk': foreign.pk})
+        self.assertEqual(self.client.post(url, format='json').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_publishes_read_receipt(self):
+        messages = self._messages(2)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def suscribir():
+            return tiempo_real.canal.suscribir(self.other.pk)
+        suscripcion = loop.run_until_complete(suscribir())
+        self.addCleanup(tiempo_real.canal.desuscribir, suscripcion)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, format='json')
+        loop.run_until_complete(asyncio.sleep(0))
+        eventos = [suscripcion.cola.get_nowait() for _ in range(suscripcion.cola.qsize())]
+        self.assertEqual(eventos[0]['data'], {
+            'conversation': self.conversation.pk, 'user': self.user.pk, 'last_read_message_id': messages[-1].pk,
+        })
+
+
+class ReadWatermarkTests(TestCase):
+    """Unread counts and the API's read_by / is_read_by are derived from the watermarks."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='mark_user', password='pw', rol=User.ROL_PACIENTE)
+        self.other = User.objects.create_user(username='mark_other', password='pw', rol=User.ROL_PROFESIONAL)
+        self.client.force_authenticate(user=self.user)
+        self.conversation = Conversation.objects.create(topic='Marks')
+        self.conversation.participants.add(self.user, self.other)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.other, content=f'Msg {i}')
+            for i in range(3)
+        ]
+
+    def test_unread_count_follows_watermark(self):
+        url = reverse('conversation-summary')
+        self.assertEqual(self.client.get(url).data['results'][0]['unread_count'], 3)
+        lecturas.avanzar(self.conversation.pk, self.user.pk, self.messages[1].pk, avisar=False)
+        self.assertEqual(self.client.get(url).data['results'][0]['unread_count'], 1)
+        # Own messages never count as unread
+        Message.objects.create(conversation=self.conversation, sender=self.user, content='Mine')
+        self.assertEqual(self.client.get(url).data['results'][0]['unread_count'], 1)
+
+    def test_read_by_and_is_read_by_are_derived(self):
+        lecturas.avanzar(self.conversation.pk, self.user.pk, self.messages[1].pk, avisar=False)
+        lecturas.avanzar(self.conversation.pk, self.other.pk, self.messages[2].pk, avisar=False)
+        data = self.client.get(reverse('conversation-detail', kwargs={'pk': self.conversation.pk})).data
+        self.assertEqual([u['id'] for u in data['is_read_by']], [self.other.pk])
+        read_by = {m['id']: sorted(u['id'] for u in m['read_by']) for m in data['messages']}
+        self.assertEqual(read_by[self.messages[0].pk], sorted([self.user.pk, self.other.pk]))
+        self.assertEqual(read_by[self.messages[2].pk], [self.other.pk])
+
+    def test_watermark_covers_earlier_messages(self):
+        message = Message.objects.create(conversation=self.conversation, sender=self.user, content='Reply')
+        lecturas.avanzar(self.conversation.pk, self.user.pk, message.pk, avisar=False)
+        self.assertEqual(list(lecturas.lectores_de(self.messages[0])), [self.user])
+        self.assertIn(self.user, lecturas.usuarios_al_dia(self.conversation))
+
+
+class SendMessageTests(TestCase):
+    """Sending a message is one transaction with a fixed number of queries."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='send_user', password='pw', rol=User.ROL_PACIENTE)
+        self.other = User.objects.create_user(username='send_other', password='pw', rol=User.ROL_PROFESIONAL)
+        self.client.force_authenticate(user=self.user)
+        self.conversation = Conversation.objects.create(topic='Send')
+        self.conversation.participants.add(self.user, self.other)
+        self.url = reverse('conversation-messages-list', kwargs={'conversation_pk': self.conversation.pk})
+
+    def test_query_count_does_not_depend_on_participants(self):
+        # Savepoint, updated_at update (also the membership check), message insert, watermark insert and update, release
+        with self.assertNumQueries(6):
+            response = self.client.post(self.url, {'content': 'Hola'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.conversation.participants.add(*[
+            User.objects.create_user(username=f'send_extra_{i}', password='pw') for i in range(5)
+        ])
+        with self.assertNumQueries(6):
+            self.client.post(self.url, {'content': 'Hola otra vez'}, format='json')
+
+    def test_send_updates_conversation_and_read_state(self):
+        before = self.conversation.updated_at
+        response = self.client.post(self.url, {'content': 'Hola'}, format='json')
+        message = Message.objects.get(pk=response.data['id'])
+        self.assertEqual([u['id'] for u in response.data['read_by']], [self.user.pk])
+        self.assertEqual(response.data['sender']['id'], self.user.pk)
+        self.conversation.refresh_from_db()
+        self.assertGreater(self.conversation.updated_at, before)
+        self.assertLessEqual(self.conversation.updated_at, message.timestamp)
+        self.assertEqual(list(lecturas.usuarios_al_dia(self.conversation)), [self.user])
+
+    def test_flat_endpoint_and_unknown_conversation(self):
+        url = reverse('message-list')
+        response = self.client.post(url, {'conversation': self.conversation.pk, 'content': 'Hola'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(url, {'conversation': self.conversation.pk + 100, 'content': 'Hola'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(url, {'content': 'Hola'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_service_rejects_non_participant_without_writing(self):
+        outsider = User.objects.create_user(username='send_outsider', password='pw')
+        with self.assertRaises(envios.NoEsParticipante):
+            envios.enviar_mensaje(self.conversation.pk, outsider, 'Hola')
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(ConversationRead.objects.filter(user=outsider).exists())
+        with self.assertRaises(envios.NoEsParticipante):
+            envios.enviar_mensaje(self.conversation.pk + 100, self.user, 'Hola')
+
+
+class CatalogoCondicionalTests(TestCase):
+    """GET condicional (ETag / Last-Modified) de servicios, CESFAM, horarios y el paso 1 del agendamiento."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.profesional = User.objects.create_user(username='prof_catalogo', password='pw', rol=User.ROL_PROFESIONAL,
+                                                    first_name='Ana')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.servicio = Servicio.objects.create(nombre='Dental', tipo='Odontología', descripcion='Control')
+            Cesfam.objects.create(nombre='Cesfam Catálogo', direccion='Calle 1', telefono='123')
+            Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES,
+                                   hora_inicio=time(8, 0), hora_fin=time(10, 0))
+
+    def _etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response['ETag']
+
+    def test_mismo_etag_responde_304_sin_consultar_filas(self):
+        for url in ('/api/servicios/', '/api/cesfams/', '/api/horarios/', f'/api/servicios/{self.servicio.pk}/'):
+            response = self.client.get(url)
+            self.assertIn('Last-Modified', response)
+            self.assertIn('no-cache', response['Cache-Control'])
+            with self.assertNumQueries(1):  # Solo la versión
+                revalidada = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(revalidada.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(revalidada['ETag'], response['ETag'])
+            revalidada = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(revalidada.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_cambios_generan_etag_nuevo(self):
+        etag = self._etag('/api/servicios/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.servicio.descripcion = 'Control anual'
+            self.servicio.save()
+        response = self.client.get('/api/servicios/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Control anual', [servicio['descripcion'] for servicio in response.data])
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.servicio.profesionales.add(self.profesional)
+        self.assertNotEqual(self._etag('/api/servicios/'), etag)
+
+    def test_horarios_dependen_del_nombre_del_profesional(self):
+        etag = self._etag('/api/horarios/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.login(username='prof_catalogo', password='pw')
+        self.assertEqual(self._etag('/api/horarios/'), etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profesional.first_name = 'Ana María'
+            self.profesional.save()
+        self.assertNotEqual(self._etag('/api/horarios/'), etag)
+
+    def test_version_compartida_entre_procesos(self):
+        etag = self._etag('/api/cesfams/')
+        # Otro worker, con su propio caché, ve la misma versión
+        cache.clear()
+        self.assertEqual(self.client.get('/api/cesfams/', HTTP_IF_NONE_MATCH=etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        # y un cambio registrado por otro worker invalida el ETag aquí
+        VersionCatalogo.objects.filter(nombre=catalogo.CESFAM).update(version=F('version') + 1)
+        self.assertEqual(self.client.get('/api/cesfams/', HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_paso1_etag_por_usuario(self):
+        url = reverse('agendar_cita_paso1')
+        paciente = User.objects.create_user(username='pac_catalogo', password='pw', rol=User.ROL_PACIENTE)
+        otro = User.objects.create_user(username='pac_catalogo_2', password='pw', rol=User.ROL_PACIENTE)
+        self.client.force_login(paciente)
+        response = self.client.get(url)
+        self.assertContains(response, 'Dental')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('Last-Modified', response)
+        # Solo la sesión, el usuario y la versión; los servicios no se consultan
+        with self.assertNumQueries(3):
+            revalidada = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidada.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.force_login(otro)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, status.HTTP_200_OK)
+
+
+class FiltrosCitasHorariosTests(TestCase):
+    """Filtros de django-filter y paginación en /api/citas/ y /api/horarios/."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.tz = timezone.get_current_timezone()
+        self.cesfam = Cesfam.objects.create(nombre='Cesfam Filtros', direccion='Calle 1', telefono='123')
+        self.otro_cesfam = Cesfam.objects.create(nombre='Cesfam Otro', direccion='Calle 2', telefono='456')
+        self.servicio = Servicio.objects.create(nombre='Filtros', tipo='Test', descripcion='Filtros')
+        self.profesional = User.objects.create(username='prof_filtros', rol=User.ROL_PROFESIONAL)
+        self.otro_profesional = User.objects.create(username='prof_filtros_2', rol=User.ROL_PROFESIONAL)
+        self.paciente = User.objects.create(username='pac_filtros', rol=User.ROL_PACIENTE)
+        self.lunes = datetime(2030, 1, 7, 9, 0, tzinfo=self.tz)
+        # Dos semanas del profesional y una cita del otro profesional en otro CESFAM
+        self.citas = [
+            Cita.objects.create(fecha_hora=self.lunes + timedelta(days=dia), paciente=self.paciente,
+                                profesional=self.profesional, cesfam=self.cesfam, servicio=self.servicio)
+            for dia in range(0, 14, 2)
+        ]
+        self.ajena = Cita.objects.create(fecha_hora=self.lunes, paciente=self.paciente, profesional=self.otro_profesional,
+                                         cesfam=self.otro_cesfam, servicio=self.servicio)
+        self.client.force_authenticate(self.profesional)
+
+    def _ids(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [cita['id'] for cita in response.data['results']]
+
+    def test_semana_de_un_profesional_en_una_consulta(self):
+        params = {
+            'profesional': self.profesional.pk,
+            'fecha_hora_after': self.lunes.isoformat(),
+            'fecha_hora_before': (self.lunes + timedelta(days=6)).isoformat(),
+        }
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/citas/', params)
+        self.assertEqual(self._ids(response), [cita.pk for cita in self.citas[:4]])
+
+    def test_filtros_por_paciente_servicio_y_cesfam(self):
+        self.assertEqual(len(self._ids(self.client.get('/api/citas/', {'paciente': self.paciente.pk}))), 8)
+        self.assertEqual(self._ids(self.client.get('/api/citas/', {'cesfam': self.otro_cesfam.pk})), [self.ajena.pk])
+        response = self.client.get('/api/citas/', {'servicio': self.servicio.pk, 'cesfam': self.cesfam.pk})
+        self.assertEqual(self._ids(response), [cita.pk for cita in self.citas])
+        self.assertEqual(self._ids(self.client.get('/api/citas/', {'profesional': 999999})), [])
+
+    def test_paginacion_por_cursor(self):
+        response = self.client.get('/api/citas/', {'profesional': self.profesional.pk, 'limit': 3})
+        self.assertEqual(self._ids(response), [cita.pk for cita in self.citas[-3:]])
+        response = self.client.get('/api/citas/', {'profesional': self.profesional.pk, 'limit': 3,
+                                                   'before': response.data['before']})
+        self.assertEqual(self._ids(response), [cita.pk for cita in self.citas[-6:-3]])
+
+    def test_fecha_invalida(self):
+        response = self.client.get('/api/citas/', {'fecha_hora_after': 'mañana'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_horarios_por_profesional_dia_y_bloqueo(self):
+        for dia in (Horario.LUNES, Horario.MARTES):
+            Horario.objects.create(profesional=self.profesional, dia=dia, hora_inicio=time(8, 0), hora_fin=time(12, 0))
+        bloqueado = Horario.objects.create(profesional=self.profesional, dia=Horario.LUNES, hora_inicio=time(14, 0),
+                                           hora_fin=time(16, 0), bloqueado=True)
+        Horario.objects.create(profesional=self.otro_profesional, dia=Horario.LUNES, hora_inicio=time(8, 0), hora_fin=time(12, 0))
+
+        response = self.client.get('/api/horarios/', {'profesional': self.profesional.pk, 'dia': Horario.LUNES})
+        self.assertEqual(response.data['count'], 2)
+        response = self.client.get('/api/horarios/', {'profesional': self.profesional.pk, 'bloqueado': 'true'})
+        self.assertEqual([horario['id'] for horario in response.data['results']], [bloqueado.pk])
+        response = self.client.get('/api/horarios/', {'limit': 2})
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+
+class DirectorioUsuariosTests(TestCase):
+    """Búsqueda con autocompletado en /api/users/search/ sobre el índice `TerminoDirectorio`."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('customuser-search')
+        self.profesional = User.objects.create_user(username='prof_dir', password='pw', rol=User.ROL_PROFESIONAL,
+                                                    first_name='Marta', last_name='Soto')
+        self.paciente = User.objects.create_user(username='pac_dir', password='pw', rol=User.ROL_PACIENTE,
+                                                 first_name='Ángela', last_name='Pérez Núñez',
+                                                 email='Angela.Perez@Correo.cl', run='12.345.678-K')
+        self.otro_paciente = User.objects.create_user(username='pac_dir_2', password='pw', rol=User.ROL_PACIENTE,
+                                                      first_name='Andrés', last_name='Peralta', run='9.876.543-2')
+
+    def _buscar(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [usuario['id'] for usuario in response.data]
+
+    def test_busca_por_prefijo_sin_tildes_ni_mayusculas(self):
+        self.client.force_authenticate(self.profesional)
+        self.assertEqual(self._buscar(q='angela'), [self.paciente.pk])
+        self.assertEqual(self._buscar(q='NUÑ'), [self.paciente.pk])
+        self.assertEqual(self._buscar(q='per'), [self.otro_paciente.pk, self.paciente.pk])
+        self.assertEqual(self._buscar(q='an per'), [self.otro_paciente.pk, self.paciente.pk])
+        self.assertEqual(self._buscar(q='andr pera'), [self.otro_paciente.pk])
+        self.assertEqual(self._buscar(q='angela.perez@'), [self.paciente.pk])
+
+    def test_busca_por_run_con_o_sin_formato(self):
+        self.client.force_authenticate(self.profesional)
+        self.assertEqual(self._buscar(q='12.345'), [self.paciente.pk])
+        self.assertEqual(self._buscar(q='12345678-k'), [self.paciente.pk])
+        response = self.client.get(self.url, {'q': '9876'})
+        self.assertEqual(response.data, [
+            {'id': self.otro_paciente.pk, 'nombre': 'Andrés Peralta', 'rol': User.ROL_PACIENTE, 'run': '9876543-2'},
+        ])
+
+    def test_alcance_por_rol(self):
+        self.client.force_authenticate(self.profesional)
+        self.assertEqual(self._buscar(q='per', rol=User.ROL_PROFESIONAL), [])
+        # Un paciente solo encuentra al equipo de salud, por nombre y sin ver el RUN
+        self.client.force_authenticate(self.paciente)
+        self.assertEqual(self._buscar(q='andres'), [])
+        self.assertEqual(self._buscar(q='marta'), [self.profesional.pk])
+        self.assertNotIn('run', self.client.get(self.url, {'q': 'marta'}).data[0])
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get(self.url, {'q': 'marta'}).status_code,
+                      (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    def test_excluye_al_propio_usuario_inactivos_y_respeta_el_limite(self):
+        self.client.force_authenticate(self.profesional)
+        self.assertEqual(self._buscar(q='marta'), [])
+        self.otro_paciente.is_active = False
+        self.otro_paciente.save()
+        self.assertEqual(self._buscar(q='per'), [self.paciente.pk])
+        for i in range(30):
+            User.objects.create_user(username=f'pac_lote_{i}', password='pw', first_name='Pedro')
+        self.assertEqual(len(self._buscar(q='pedro', limit=1000)), directorio.LIMITE_MAXIMO)
+        self.assertEqual(len(self._buscar(q='pedro', limit=3)), 3)
+        self.assertEqual(self._buscar(q='p'), [])
+
+    def test_indice_se_actualiza_al_editar(self):
+        self.client.force_authenticate(self.profesional)
+        self.paciente.last_name = 'Contreras'
+        self.paciente.save()
+        self.assertEqual(self._buscar(q='per'), [self.otro_paciente.pk])
+        self.assertEqual(self._buscar(q='contre'), [self.paciente.pk])
+        # El login solo guarda last_login y no toca el índice
+        terminos = list(TerminoDirectorio.objects.filter(usuario=self.paciente).values_list('pk', flat=True))
+        self.client.login(username='pac_dir', password='pw')
+        self.assertEqual(list(TerminoDirectorio.objects.filter(usuario=self.paciente).values_list('pk', flat=True)), terminos)
+
+    def test_agendar_profesional_no_carga_pacientes(self):
+        self.client.force_login(self.profesional)
+        response = self.client.get(reverse('profesional_agendar'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotContains(response, 'Peralta')
+        self.assertContains(response, self.url)
+
+
+class AutenticacionEmailRunTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user(
+            username='pac_login', email='  Ana.Soto@Correo.CL ', password='clave-segura',
+            first_name='Ana', run='12.345.678-k',
+        )
+
+    def test_guarda_email_y_run_canonicos(self):
+        self.usuario.refresh_from_db()
+        self.assertEqual(self.usuario.email, 'ana.soto@correo.cl')
+        self.assertEqual(self.usuario.run, '12345678-K')
+        # Sin RUN queda NULL, así varios usuarios sin RUN no chocan con la restricción única
+        for i in range(2):
+            self.assertIsNone(User.objects.create_user(username=f'sin_run_{i}', password='pw', run='').run)
+
+    def test_autentica_por_email_o_run_en_cualquier_formato(self):
+        for identificador in ('ANA.SOTO@correo.cl', ' ana.soto@correo.cl', '12.345.678-K', '12345678k', '012345678-k'):
+            with self.subTest(identificador=identificador):
+                self.assertEqual(authenticate(identificador=identificador, password='clave-segura'), self.usuario)
+        self.assertIsNone(authenticate(identificador='12345678-K', password='otra'))
+        self.assertIsNone(authenticate(identificador='nadie@correo.cl', password='clave-segura'))
+        self.assertIsNone(authenticate(identificador='---', password='clave-segura'))
+        # El login por username sigue a cargo de ModelBackend
+        self.assertEqual(authenticate(username='pac_login', password='clave-segura'), self.usuario)
+
+    def test_una_consulta_para_autenticar(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(authenticate(identificador='12.345.678-k', password='clave-segura'), self.usuario)
+        with CaptureQueriesContext(connection) as consultas:
+            authenticate(identificador='Ana.Soto@correo.cl', password='clave-segura')
+        self.assertEqual(len(consultas), 1)
+        self.assertNotIn('LIKE', consultas[0]['sql'].upper())
+        self.assertNotIn('UPPER', consultas[0]['sql'].upper())
+
+    def test_login_y_registro_usan_la_forma_canonica(self):
+        response = self.client.post(reverse('login_page'), {'identificador': '12345678k', 'password': 'clave-segura'})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.client.logout()
+        response = self.client.post(reverse('register_usuario'), {
+            'email': 'otra@correo.cl', 'run': '12345678-K', 'password': 'pw', 'nombre': 'Otra',
+        })
+        self.assertContains(response, 'ya están registrados')
+        self.assertFalse(User.objects.filter(email='otra@correo.cl').exists())
+
+    def test_migracion_normaliza_usuarios_existentes(self):
+        migracion = import_module('cesfamApp.migrations.0015_email_run_canonicos')
+        otro = User.objects.create_user(username='pac_otro', password='pw', run='7654321-0')
+        duplicado = User.objects.create_user(username='pac_dup', password='pw')
+        # Datos anteriores a la normalización, escritos sin pasar por save()
+        User.objects.filter(pk=self.usuario.pk).update(email='Ana.Soto@Correo.CL', run='12.345.678-k')
+        User.objects.filter(pk=otro.pk).update(run='')
+        User.objects.filter(pk=duplicado.pk).update(run='12345678-k')
+        with mock.patch.object(migracion, 'TAMANO_LOTE', 2):
+            migracion.normalizar_usuarios(django_apps, None)
+        self.assertEqual(
+            dict(User.objects.filter(pk__in=[self.usuario.pk, otro.pk, duplicado.pk]).values_list('pk', 'run')),
+            # El segundo '12345678-K' chocaría con el primero: queda como estaba para revisarlo a mano
+            {self.usuario.pk: '12345678-K', otro.pk: None, duplicado.pk: '12345678-k'},
+        )
+        self.assertEqual(User.objects.get(pk=self.usuario.pk).email, 'ana.soto@correo.cl')
+        self.assertTrue(TerminoDirectorio.objects.filter(usuario=self.usuario, termino='12345678k').exists())
+
+    def test_run_sin_normalizar_por_choque_se_puede_guardar(self):
+        # Como los que deja la migración 0015: su forma canónica ya la tiene otro usuario
+        duplicado = User.objects.create_user(username='pac_dup', password='pw')
+        User.objects.filter(pk=duplicado.pk).update(run='12345678-k')
+        duplicado = User.objects.get(pk=duplicado.pk)
+        duplicado.set_password('nueva-clave')
+        duplicado.save()
+        self.assertEqual(User.objects.get(pk=duplicado.pk).run, '12345678-k')
+
+        # Cambiarlo sí lo normaliza, y el choque es un error del formulario, no un 500
+        self.client.force_login(duplicado)
+        response = self.client.post(reverse('profile'), {'first_name': 'Dup', 'run': '12.345.678-K'})
+        self.assertContains(response, 'ya está registrado')
+        self.assertEqual(User.objects.get(pk=duplicado.pk).run, '12345678-k')
+        response = self.client.post(reverse('profile'), {'first_name': 'Dup', 'run': '7.654.321-0'})
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        self.assertEqual(User.objects.get(pk=duplicado.pk).run, '7654321-0')
+
+        # En los formularios de modelo (admin) el choque sale en validate_unique
+        duplicado.run = '12.345.678-K'
+        with self.assertRaises(ValidationError) as error:
+            duplicado.full_clean()
+        self.assertIn('run', error.exception.message_dict)
+
+
+class TokenJWTTests(TestCase):
+    """JWT para la API: emisión por email/RUN, claims firmados y permisos sin consultar la base."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.profesional = User.objects.create_user(
+            username='prof_jwt', email='prof.jwt@correo.cl', password='clave-segura', run='11.111.111-1',
+            first_name='Rosa', last_name='Díaz', rol=User.ROL_PROFESIONAL,
+        )
+        self.paciente = User.objects.create_user(username='pac_jwt', email='pac.jwt@correo.cl', password='clave-segura')
+        self.conversation = Conversation.objects.create(topic='JWT')
+        self.conversation.participants.add(self.profesional, self.paciente)
+
+    def _tokens(self, identificador, password='clave-segura'):
+        response = self.client.post(reverse('token_obtain_pair'), {'identificador': identificador, 'password': password},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data
+
+    def _autenticar(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_emite_tokens_por_email_o_run_con_los_claims(self):
+        for identificador in ('PROF.JWT@correo.cl', '11111111-1'):
+            with self.subTest(identificador=identificador):
+                access = AccessToken(self._tokens(identificador)['access'])
+                self.assertEqual(int(access['user_id']), self.profesional.pk)
+                self.assertEqual((access['rol'], access['first_name'], access['is_staff']), (User.ROL_PROFESIONAL, 'Rosa', False))
+        response = self.client.post(reverse('token_obtain_pair'), {'identificador': '11111111-1', 'password': 'otra'},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_permiso_por_rol_sin_consultas_de_sesion_ni_usuario(self):
+        self._autenticar(self._tokens('prof.jwt@correo.cl')['access'])
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get('/api/citas/', {'profesional': self.profesional.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tablas = ' '.join(consulta['sql'] for consulta in consultas)
+        self.assertNotIn('django_session', tablas)
+        self.assertNotIn('FROM "cesfamApp_customuser"', tablas)
+        # Un paciente no lista las citas de todos
+        self._autenticar(self._tokens('pac.jwt@correo.cl')['access'])
+        self.assertEqual(self.client.get('/api/citas/').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.credentials()
+        self.assertEqual(self.client.get('/api/citas/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_usuario_del_token_sirve_en_vistas_que_escriben(self):
+        self._autenticar(self._tokens('pac.jwt@correo.cl')['access'])
+        response = self.client.post(f'/api/conversations/{self.conversation.pk}/messages/', {'content': 'Hola'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Message.objects.get().sender, self.paciente)
+        self.assertEqual(response.data['sender']['id'], self.paciente.pk)
+        self.assertEqual(self.client.get('/api/conversations/').data['results'][0]['id'], self.conversation.pk)
+
+    def test_refresh_actualiza_claims_y_rechaza_cuentas_inactivas(self):
+        refresh = self._tokens('prof.jwt@correo.cl')['refresh']
+        self.profesional.rol = User.ROL_ADMIN
+        self.profesional.save()
+        response = self.client.post(reverse('token_refresh'), {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(AccessToken(response.data['access'])['rol'], User.ROL_ADMIN)
+        self.profesional.is_active = False
+        self.profesional.save()
+        response = self.client.post(reverse('token_refresh'), {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_sesion_sigue_funcionando(self):
+        self.client.login(username='prof_jwt', password='clave-segura')
+        self.assertEqual(self.client.get('/api/citas/').status_code, status.HTTP_200_OK)
+
+
+class FragmentosDashboardTests(TestCase):
+    """Anuncios y notificaciones del panel desde el caché de fragmentos, invalidados por versión."""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin_fragmentos', rol=User.ROL_ADMIN, is_staff=True)
+        self.paciente = User.objects.create(username='pac_fragmentos', rol=User.ROL_PACIENTE)
+        self.otro = User.objects.create(username='pac_fragmentos_2', rol=User.ROL_PACIENTE)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.anuncio = Anuncio.objects.create(titulo='Campaña de invierno', contenido='Vacunación', publicado_por=self.admin)
+            self.notificacion = Notificacion.objects.create(destinatario=self.paciente, mensaje='Cita confirmada')
+
+    def _panel(self, usuario):
+        self.client.force_login(usuario)
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        tablas = ' '.join(consulta['sql'] for consulta in consultas)
+        return response, '"anuncio"' in tablas, '"notificacion"' in tablas
+
+    def test_segundo_render_no_consulta(self):
+        response, anuncios, notificaciones = self._panel(self.paciente)
+        self.assertTrue(anuncios and notificaciones)
+        self.assertContains(response, 'Campaña de invierno')
+        self.assertContains(response, 'Cita confirmada')
+        response, anuncios, notificaciones = self._panel(self.paciente)
+        self.assertFalse(anuncios or notificaciones)
+        self.assertContains(response, 'Campaña de invierno')
+        self.assertContains(response, 'Cita confirmada')
+        # Los anuncios son los mismos para todos; las notificaciones son de cada uno
+        response, anuncios, notificaciones = self._panel(self.otro)
+        self.assertFalse(anuncios)
+        self.assertTrue(notificaciones)
+        self.assertNotContains(response, 'Cita confirmada')
+
+    def test_cambio_registrado_por_otro_worker(self):
+        self._panel(self.paciente)
+        # Otro worker crea el anuncio y registra el cambio; el caché en memoria de este no se entera
+        with self.captureOnCommitCallbacks(execute=False):
+            Anuncio.objects.create(titulo='Operativo dental', contenido='Sábado', publicado_por=self.admin)
+        VersionCatalogo.objects.filter(nombre=fragmentos.ANUNCIOS).update(version=F('version') + 1)
+        response, anuncios, notificaciones = self._panel(self.paciente)
+        self.assertTrue(anuncios)
+        self.assertFalse(notificaciones)
+        self.assertContains(response, 'Operativo dental')
+
+    def test_gestionar_anuncios_invalida(self):
+        self._panel(self.paciente)
+        self.client.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('gestionar_anuncios'), {'crear': '1', 'titulo': 'Operativo dental', 'contenido': 'Sábado'})
+        response, anuncios, _ = self._panel(self.paciente)
+        self.assertTrue(anuncios)
+        self.assertContains(response, 'Operativo dental')
+        self.client.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('gestionar_anuncios'), {'eliminar': '1', 'anuncio_id': self.anuncio.pk})
+        response, anuncios, _ = self._panel(self.paciente)
+        self.assertTrue(anuncios)
+        self.assertNotContains(response, 'Campaña de invierno')
+
+    def test_notificacion_nueva_o_leida_invalida_solo_al_destinatario(self):
+        self._panel(self.paciente)
+        self._panel(self.otro)
+        with self.captureOnCommitCallbacks(execute=True):
+            Notificacion.objects.create(destinatario=self.paciente, mensaje='Recordatorio')
+        response, _, notificaciones = self._panel(self.paciente)
+        self.assertTrue(notificaciones)
+        self.assertContains(response, 'Recordatorio')
+        self.assertFalse(self._panel(self.otro)[2])
+        self.assertContains(response, 'class="list-group-item list-group-item-warning"', count=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.notificacion.leida = True
+            self.notificacion.save()
+        response, _, notificaciones = self._panel(self.paciente)
+        self.assertTrue(notificaciones)
+        self.assertContains(response, 'class="list-group-item list-group-item-warning"', count=1)
+
+
+class PrecalentamientoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profesional = User.objects.create(username='prof_precalentar', rol=User.ROL_PROFESIONAL)
+        Horario.objects.create(profesional=self.profesional, dia=timezone.localdate().weekday(),
+                               hora_inicio=time(8, 0), hora_fin=time(12, 0))
+        User.objects.create(username='prof_sin_horario', rol=User.ROL_PROFESIONAL)
+
+    def test_compila_todas_las_plantillas_del_proyecto(self):
+        compiladas, errores = precalentamiento.compilar_plantillas()
+        self.assertEqual(errores, [])
+        self.assertGreater(compiladas, 40)
+        self.assertGreater(precalentamiento.resolver_urls(), 50)
+
+    def test_llena_el_cache_de_disponibilidad(self):
+        cache_disponibilidad.reiniciar_estadisticas()
+        self.assertEqual(precalentamiento.llenar_disponibilidad(), 1)
+        misses = cache_disponibilidad.estadisticas()['misses']
+        self.assertGreater(misses, 0)
+        hoy = timezone.localdate()
+        with self.assertNumQueries(0):
+            cache_disponibilidad.horarios_disponibles(
+                self.profesional, hoy, hoy + timedelta(days=disponibilidad.DIAS_A_MOSTRAR - 1),
+            )
+        self.assertEqual(cache_disponibilidad.estadisticas()['misses'], misses)
+
+    def test_worker_arranca_aunque_falle_el_precalentamiento(self):
+        worker = SimpleNamespace(log=mock.Mock())
+        with mock.patch.object(precalentamiento, 'precalentar', side_effect=OperationalError('sin base')):
+            _configuracion_gunicorn().post_worker_init(worker)
+        worker.log.exception.assert_called_once()
+        worker.log.info.assert_not_called()
+
+    def test_comando(self):
+        salida = StringIO()
+        call_command('precalentar', '--paso', 'plantillas', '--paso', 'conexiones', stdout=salida)
+        self.assertIn('plantillas:', salida.getvalue())
+        self.assertIn('conexiones: 1', salida.getvalue())
+        self.assertNotIn('disponibilidad', salida.getvalue())
@@ -0,0 +1,332 @@
+"""
+Entrega en tiempo real de la mensajería y las notificaciones (Server-Sent
+Events sobre ASGI).
+
+`canal` es un difusor en memoria del proceso: cada conexión abierta se
+suscribe con su propia cola `asyncio.Queue` y `publicar` reparte un evento a
+las colas de los usuarios indicados. No necesita Redis, pero solo alcanza a
+las conexiones del mismo proceso: con varios workers cada uno tiene su canal,
+así que detrás de un balanceador hay que usar un solo worker ASGI para la
+mensajería o reemplazar el canal por uno compartido.
+
+Se publica, al confirmarse la transacción:
+    - `message`: un mensaje nuevo (el `id` del evento SSE es el del mensaje).
+    - `read`: un participante avanzó su marca de lectura (`cesfamApp.lecturas`).
+    - `notificacion`: una `Notificacion` nueva, en `canal_notificaciones`.
+
+Para reanudar, el cliente manda el último id que vio (cabecera
+`Last-Event-ID`, que `EventSource` envía sola al reconectar, o `?last_id=`).
+La conexión se suscribe primero, luego envía los eventos posteriores a ese id
+desde la base y recién después lo que llegó por la cola, descartando los
+repetidos, de modo que no se pierde nada entre la consulta y la suscripción.
+Los ids no se confirman en orden: el mensaje 10 de una conversación puede
+confirmarse después que el 11 de otra, y ambas son del mismo flujo. Por eso al
+reanudar también se reenvía lo creado hasta `VENTANA_REANUDACION` antes que el
+último id visto, y cada conexión descarta los repetidos contra los ids que ya
+envió (no contra el mayor); el cliente también debe descartar por id lo que ya
+tiene.
+Si el cliente se atrasa tanto que su cola se llena, se cierra la conexión y el
+cliente reanuda desde su último id. Las lecturas no se reenvían al reanudar: el
+cliente vuelve a pedir el estado de la conversación abierta. Para clientes
+que no pueden mantener la conexión abierta, `esperar_pendientes` sirve un
+long-poll con la misma reanudación por id; como no tiene conexión que recuerde
+lo enviado, el cliente manda los ids que ya tiene (`?vistos=`).
+"""
+import asyncio
+import json
+import threading
+from collections import deque
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+from .models import Message, Notificacion
+
+# Eventos pendientes por conexión antes de darla por atrasada
+TAMANO_COLA = 256
+# Eventos que se reenvían como máximo al reanudar; si hay más, se pide recargar
+MAXIMO_REANUDACION = 500
+# Segundos entre comentarios de keepalive para que los proxies no corten la conexión
+INTERVALO_KEEPALIVE = 20
+# Al reanudar se reenvía además lo creado hasta este tiempo antes que el último evento visto:
+# cubre las transacciones que tomaron su id antes pero se confirmaron después
+VENTANA_REANUDACION = timedelta(seconds=60)
+# Ids enviados que recuerda cada conexión: los reenviados al reanudar más lo que ya podía estar en la cola
+TAMANO_VISTOS = MAXIMO_REANUDACION + 1 + TAMANO_COLA
+# Ids ya recibidos que acepta el long-poll en `?vistos=`
+MAXIMO_VISTOS = 100
+
+
+class Suscripcion:
+    __slots__ = ('usuario_id', 'cola', 'loop', 'atrasada')
+
+    def __init__(self, usuario_id, loop):
+        self.usuario_id = usuario_id
+        self.cola = asyncio.Queue(TAMANO_COLA)
+        self.loop = loop
+        self.atrasada = False
+
+    def _entregar(self, evento):
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.atrasada = True
+
+
+class Canal:
+    """Difusor en memoria: `usuario_id -> {Suscripcion}`. Se puede publicar desde cualquier hilo."""
+
+    def __init__(self):
+        self._suscripciones = {}
+        self._lock = threading.Lock()
+
+    def suscribir(self, usuario_id):
+        suscripcion = Suscripcion(usuario_id, asyncio.get_running_loop())
+        with self._lock:
+            self._suscripciones.setdefault(usuario_id, set()).add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, suscripcion):
+        with self._lock:
+            suscripciones = self._suscripciones.get(suscripcion.usuario_id)
+            if suscripciones:
+                suscripciones.discard(suscripcion)
+                if not suscripciones:
+                    del self._suscripciones[suscripcion.usuario_id]
+
+    def conexiones(self):
+        with self._lock:
+            return sum(len(suscripciones) for suscripciones in self._suscripciones.values())
+
+    def publicar(self, usuario_ids, evento):
+        with self._lock:
+            destinos = [s for usuario_id in usuario_ids for s in self._suscripciones.get(usuario_id, ())]
+        for suscripcion in destinos:
+            try:
+                suscripcion.loop.call_soon_threadsafe(suscripcion._entregar, evento)
+            except RuntimeError:
+                pass  # El loop de esa conexión ya se cerró
+
+
+class Vistos:
+    """Los últimos `tamano` ids enviados por una conexión, para no repetirlos."""
+
+    def __init__(self, tamano=TAMANO_VISTOS):
+        self._orden = deque(maxlen=tamano)
+        self._ids = set()
+
+    def __contains__(self, evento_id):
+        return evento_id in self._ids
+
+    def agregar(self, evento_id):
+        if len(self._orden) == self._orden.maxlen:
+            self._ids.discard(self._orden[0])
+        self._orden.append(evento_id)
+        self._ids.add(evento_id)
+
+
+# Un canal por flujo: mensajería y notificaciones
+canal = Canal()
+canal_notificaciones = Canal()
+
+
+# ------------------------------------------------------------------------------
+# Eventos
+# ------------------------------------------------------------------------------
+
+def datos_mensaje(message_id, conversation_id, sender_id, username, first_name, content, timestamp):
+    return {
+        'id': message_id,
+        'conversation': conversation_id,
+        'sender': {'id': sender_id, 'username': username, 'first_name': first_name},
+        'content': content,
+        'timestamp': timestamp.isoformat(),
+    }
+
+
+CAMPOS_MENSAJE = ('id', 'conversation_id', 'sender_id', 'sender__username', 'sender__first_name', 'content', 'timestamp')
+
+
+def evento_mensaje(message):
+    sender = message.sender
+    return {
+        'tipo': 'message',
+        'id': message.id,
+        'data': datos_mensaje(message.id, message.conversation_id, sender.id, sender.username,
+                              sender.first_name, message.content, message.timestamp),
+    }
+
+
+CAMPOS_NOTIFICACION = ('id', 'mensaje', 'leida', 'fecha')
+
+
+def datos_notificacion(notificacion_id, mensaje, leida, fecha):
+    return {'id': notificacion_id, 'mensaje': mensaje, 'leida': leida, 'fecha': fecha.isoformat()}
+
+
+def evento_notificacion(notificacion):
+    return {
+        'tipo': 'notificacion',
+        'id': notificacion.id,
+        'data': datos_notificacion(notificacion.id, notificacion.mensaje, notificacion.leida, notificacion.fecha),
+    }
+
+
+def evento_lectura(conversation_id, usuario_id, hasta_id):
+    return {
+        'tipo': 'read',
+        'data': {'conversation': conversation_id, 'user': usuario_id, 'last_read_message_id': hasta_id},
+    }
+
+
+def participantes(conversation_id):
+    return list(get_user_model().objects.filter(conversations=conversation_id).values_list('pk', flat=True))
+
+
+def publicar_mensaje(message):
+    # Sin conexiones abiertas en este proceso no vale la pena consultar nada
+    if canal.conexiones():
+        canal.publicar(participantes(message.conversation_id), evento_mensaje(message))
+
+
+def publicar_lectura(conversation_id, usuario_id, hasta_id):
+    if canal.conexiones():
+        canal.publicar(participantes(conversation_id), evento_lectura(conversation_id, usuario_id, hasta_id))
+
+
+def formatear(evento):
+    """Serializa un evento al formato de texto de SSE."""
+    lineas = []
+    if evento.get('id') is not None:
+        lineas.append(f"id: {evento['id']}")
+    lineas.append(f"event: {evento['tipo']}")
+    lineas.append(f"data: {json.dumps(evento['data'], separators=(',', ':'))}")
+    return '\n'.join(lineas) + '\n\n'
+
+
+# ------------------------------------------------------------------------------
+# Flujo de una conexión
+# ------------------------------------------------------------------------------
+
+def posteriores(eventos, campo_fecha, ultimo_id):
+    """
+    Filtra `eventos` a los que el cliente puede no haber visto si el último
+    que recibió es `ultimo_id`: los de id mayor y los creados desde
+    `VENTANA_REANUDACION` antes que ese, que pueden haberse confirmado después.
+    """
+    fecha = eventos.model.objects.filter(pk=ultimo_id).values_list(campo_fecha, flat=True).first()
+    if fecha is None:
+        return eventos.filter(id__gt=ultimo_id)
+    return eventos.filter(
+        Q(id__gt=ultimo_id) | Q(**{f'{campo_fecha}__gte': fecha - VENTANA_REANUDACION}),
+    ).exclude(pk=ultimo_id)
+
+
+def mensajes_pendientes(usuario_id, ultimo_id):
+    """
+    Mensajes de las conversaciones del usuario que pudo no ver después de
+    `ultimo_id` (ver `posteriores`), a lo más `MAXIMO_REANUDACION` + 1.
+    """
+    filas = posteriores(
+        Message.objects.filter(conversation__participants=usuario_id), 'timestamp', ultimo_id,
+    ).order_by('id').values_list(*CAMPOS_MENSAJE)[:MAXIMO_REANUDACION + 1]
+    return [{'tipo': 'message', 'id': fila[0], 'data': datos_mensaje(*fila)} for fila in filas]
+
+
+def notificaciones_pendientes(usuario_id, ultimo_id):
+    """
+    Notificaciones del usuario que pudo no ver después de `ultimo_id` (ver
+    `posteriores`); usa el índice `(destinatario, id)`. Las de un mismo
+    destinatario se crean en transacciones concurrentes (dos citas agendadas a
+    la vez para el mismo paciente), así que tampoco se confirman en orden.
+    """
+    filas = posteriores(
+        Notificacion.objects.filter(destinatario_id=usuario_id), 'fecha', ultimo_id,
+    ).order_by('id').values_list(*CAMPOS_NOTIFICACION)[:MAXIMO_REANUDACION + 1]
+    return [{'tipo': 'notificacion', 'id': fila[0], 'data': datos_notificacion(*fila)} for fila in filas]
+
+
+async def flujo_eventos(usuario_id, ultimo_id=None, canal=canal, pendientes=mensajes_pendientes,
+                        intervalo_keepalive=INTERVALO_KEEPALIVE):
+    """
+    Generador asíncrono con el texto SSE para una conexión. Sin `ultimo_id`
+    solo entrega lo nuevo desde ahora; con `ultimo_id` reenvía primero lo que
+    el cliente no alcanzó a ver, leyéndolo con `pendientes`. Los eventos con
+    `id` (mensajes, notificaciones) no se repiten en la conexión aunque lleguen
+    desordenados; los demás pasan tal cual.
+    """
+    suscripcion = canal.suscribir(usuario_id)
+    vistos = Vistos()
+    try:
+        yield 'retry: 3000\n\n'
+        # Sin `ultimo_id` es una conexión nueva: todo lo que llegue a la cola es posterior a la suscripción
+        if ultimo_id is not None:
+            faltantes = await sync_to_async(pendientes)(usuario_id, ultimo_id)
+            if len(faltantes) > MAXIMO_REANUDACION:
+                # Demasiado atraso: el cliente debe recargar y seguir solo con lo nuevo
+                yield formatear({'tipo': 'reset', 'data': {}})
+                faltantes = []
+            for evento in faltantes:
+                vistos.agregar(evento['id'])
+                yield formatear(evento)
+        while not suscripcion.atrasada:
+            try:
+                evento = await asyncio.wait_for(suscripcion.cola.get(), intervalo_keepalive)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if evento.get('id') is not None:
+                if evento['id'] in vistos:
+                    continue  # Ya se envió al reanudar
+                vistos.agregar(evento['id'])
+            yield formatear(evento)
+    finally:
+        canal.desuscribir(suscripcion)
+
+
+async def esperar_pendientes(usuario_id, ultimo_id, canal, pendientes, espera, vistos=()):
+    """
+    Long-poll: devuelve los eventos posteriores a `ultimo_id` que no estén en
+    `vistos` (los que el cliente ya tiene y entran en la ventana de
+    reanudación) o, si no hay, espera hasta `espera` segundos a que llegue uno.
+    Se suscribe antes de consultar para no perder lo que se cree entre medio.
+    """
+    vistos = set(vistos)
+
+    def nuevos():
+        return [evento for evento in pendientes(usuario_id, ultimo_id) if evento['id'] not in vistos]
+
+    suscripcion = canal.suscribir(usuario_id)
+    try:
+        faltantes = await sync_to_async(nuevos)()
+        if not faltantes and espera:
+            try:
+                await asyncio.wait_for(suscripcion.cola.get(), espera)
+            except asyncio.TimeoutError:
+                return []
+            faltantes = await sync_to_async(nuevos)()
+        return faltantes[:MAXIMO_REANUDACION]
+    finally:
+        canal.desuscribir(suscripcion)
+
+
+def ultimo_id_solicitado(request):
+    """Id de reanudación desde `Last-Event-ID` o `?last_id=`; `None` si no viene o no es válido."""
+    valor = request.headers.get('Last-Event-ID') or request.GET.get('last_id')
+    try:
+        return max(int(valor), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def ids_vistos(request):
+    """Ids que el cliente ya recibió, de `?vistos=1,2,3`; a lo más `MAXIMO_VISTOS`, ignorando los no válidos."""
+    ids = set()
+    for valor in request.GET.get('vistos', '').split(',')[:MAXIMO_VISTOS]:
+        try:
+            ids.add(int(valor))
+        except ValueError:
+            pass
+    return ids
@@ -0,0 +1,75 @@
+"""
+Autenticación por JWT para la API (clientes móviles y de calendario).
+
+`POST /api/token/` recibe `identificador` (email o RUN, ver
+cesfamApp.backends) y `password` y entrega un par access/refresh;
+`POST /api/token/refresh/` entrega un access nuevo a partir del refresh.
+Los tokens llevan firmados, además del id, los datos del usuario que usan
+los permisos de la API (`CLAIMS`: rol, is_staff, nombre).
+
+`JWTClaimsAuthentication` arma `request.user` con esos claims sin tocar la
+base: no hay consulta de sesión ni de usuario por request. El usuario es una
+instancia de `CustomUser` con el resto de los campos diferidos (como con
+`.only()`), así que sirve igual en filtros y claves foráneas, y si una vista
+lee un campo que no viene en el token Django lo carga en ese momento.
+
+Como el access no se revisa contra la base, un cambio de rol o la
+desactivación de la cuenta rigen desde el próximo refresh: el refresh sí
+carga al usuario y vuelve a escribir los claims. Por eso el access dura poco
+(`SIMPLE_JWT['ACCESS_TOKEN_LIFETIME']`).
+"""
+from django.contrib.auth import get_user_model
+from django.db import router
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+# Campos del usuario que viajan firmados en el token
+CLAIMS = ('username', 'first_name', 'last_name', 'rol', 'is_staff', 'is_superuser')
+
+
+def agregar_claims(token, user):
+    for campo in CLAIMS:
+        token[campo] = getattr(user, campo)
+    return token
+
+
+class ObtenerTokenSerializer(TokenObtainPairSerializer):
+    # authenticate(identificador=..., password=...) lo resuelve EmailORunBackend
+    username_field = 'identificador'
+
+    @classmethod
+    def get_token(cls, user):
+        return agregar_claims(super().get_token(user), user)
+
+
+class RefrescarTokenSerializer(TokenRefreshSerializer):
+    """Access nuevo con los claims vigentes del usuario (una consulta)."""
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = get_user_model()._default_manager.filter(
+            **{api_settings.USER_ID_FIELD: refresh.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        return {'access': str(agregar_claims(refresh, user).access_token)}
+
+
+class JWTClaimsAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        campos = (api_settings.USER_ID_CLAIM, *CLAIMS)
+        if not all(campo in validated_token for campo in campos):
+            # Token sin los claims (emitido por otro serializer): se busca al usuario en la base
+            return super().get_user(validated_token)
+        User = get_user_model()
+        valores = dict(zip([api_settings.USER_ID_FIELD, *CLAIMS], (validated_token[campo] for campo in campos)))
+        # from_db espera los valores en el orden de los campos del modelo; el id viene como texto en el token
+        campos_modelo = [f for f in User._meta.concrete_fields if f.attname in valores]
+        return User.from_db(
+            router.db_for_read(User),
+            [f.attname for f in campos_modelo],
+            [f.to_python(valores[f.attname]) for f in campos_modelo],
+        )
@@ -1,5 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from . import views
 
 # Se registran los ViewSets para la API
@@ -17,6 +18,9 @@ router.register(r'messages', views.MessageViewSet, basename='message')
 
 urlpatterns = [
     path('', include(router.urls)),
+    # JWT para clientes sin sesión (ver cesfamApp.tokens)
+    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     # Nested messages endpoint
     path('conversations/<int:conversation_pk>/messages/', 
          views.MessageViewSet.as_view({'get': 'list', 'post': 'create'}), 
@@ -1,28 +1,43 @@
-from django.http import JsonResponse
+import codecs
+import hashlib
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.utils import timezone
-from django.utils.dateparse import parse_datetime
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_date, parse_datetime
 from datetime import datetime, timedelta
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout, get_user_model
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.views.decorators.http import require_POST
+from django.db import IntegrityError, transaction
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
 
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
 from .models import (
     Cesfam, Servicio, Anuncio, Cita, Mensaje, Horario, CustomUser, Notificacion,
-    HistorialMedico, Feedback, Conversation, Message
+    HistorialMedico, Feedback, Conversation, ConversationRead, Message, TerminoDirectorio,
+    email_canonico, run_canonico
 )
-from .decorators import paciente_required, profesional_required, admin_required
+from .filters import CitaFilter, HorarioFilter
+from .permissions import EsEquipoSalud
+from .pagination import CitaPagination, ConversationPagination, HorarioPagination, MessagePagination
+from .decorators import paciente_required, profesional_required, admin_required, solo_admin_required
+from . import agenda, cache_disponibilidad, catalogo, directorio, disponibilidad, envios, exportacion, importacion, lecturas, metricas, paneles, reservas, tiempo_real
 
 from .serializers import (
     UserSerializer, CesfamSerializer, CitaSerializer, ServicioSerializer, 
     AnuncioSerializer, HorarioSerializer, NotificacionSerializer, SystemMessageSerializer,
-    ConversationSerializer, MessageSerializer
+    ConversationSerializer, ConversationSummarySerializer, MessageSerializer, SendMessageSerializer
 )
 
 User = get_user_model()
@@ -33,31 +48,7 @@ def home(request):
 
 @login_required(login_url='login_page')
 def dashboard(request):
-    context = {
-        'now': timezone.now(),
-        'anuncios': Anuncio.objects.all().order_by('-fecha_publicacion')[:5],
-        'notificaciones': Notificacion.objects.filter(destinatario=request.user).order_by('-fecha')[:10]
-    }
-
-    if request.user.rol == User.ROL_PACIENTE:
-        context['proximas_citas'] = Cita.objects.filter(paciente=request.user, fecha_hora__gte=timezone.now()).order_by('fecha_hora')[:5]
-        context['historial_citas'] = Cita.objects.filter(paciente=request.user, fecha_hora__lt=timezone.now()).order_by('-fecha_hora')[:10]
-
-    elif request.user.rol == User.ROL_PROFESIONAL:
-        context['citas_hoy'] = Cita.objects.filter(profesional=request.user, fecha_hora__date=timezone.now().date()).count()
-        context['total_citas'] = Cita.objects.filter(profesional=request.user).count()
-        context['pacientes_unicos'] = Cita.objects.filter(profesional=request.user).values('paciente').distinct().count()
-        context['proximas_citas'] = Cita.objects.filter(profesional=request.user, fecha_hora__gte=timezone.now()).order_by('fecha_hora')[:10]
-
-    elif request.user.rol == User.ROL_ADMIN:
-        context['resumen'] = {
-            'total_cesfams': Cesfam.objects.count(),
-            'total_profesionales': User.objects.filter(rol=User.ROL_PROFESIONAL).count(),
-            'total_usuarios': User.objects.filter(rol=User.ROL_PACIENTE).count(),
-            'total_citas': Cita.objects.count(),
-        }
-
-    return render(request, 'dashboard.html', context)
+    return render(request, 'dashboard.html', paneles.contexto_dashboard(request.user))
 
 
 @login_required(login_url='login_page')
@@ -74,8 +65,15 @@ def profile_view(request):
             user.run = request.POST.get('run', user.run)
         elif user.rol == User.ROL_PROFESIONAL:
             user.especialidad = request.POST.get('especialidad', user.especialidad)
-        
-        user.save()
+
+        try:
+            # Savepoint propio: el RUN (ya normalizado) puede ser el de otro usuario
+            with transaction.atomic():
+                user.save()
+        except IntegrityError:
+            user.refresh_from_db()
+            messages.error(request, 'El RUN ingresado ya está registrado por otro usuario.')
+            return render(request, 'perfil.html')
         messages.success(request, '¡Tu perfil ha sido actualizado con éxito!')
         return redirect('profile')
 
@@ -95,19 +93,13 @@ def login_page(request):
             messages.error(request, 'Debes ingresar un identificador y una contraseña.')
             return render(request, 'login_page.html')
 
-        # Buscar usuario por email o RUN
-        user_q = User.objects.filter(
-            Q(email__iexact=identificador) | Q(run__iexact=identificador)
-        )
-        
-        if user_q.exists():
-            # Usar el username para autenticar, ya que es lo que Django espera por defecto.
-            user_to_auth = authenticate(request, username=user_q.first().username, password=password)
-            
-            if user_to_auth is not None:
-                login(request, user_to_auth)
-                messages.success(request, f'Bienvenido, {user_to_auth.first_name}!')
-                return redirect('dashboard')
+        # El email o RUN se resuelve en cesfamApp.backends.EmailORunBackend
+        user_to_auth = authenticate(request, identificador=identificador, password=password)
+
+        if user_to_auth is not None:
+            login(request, user_to_auth)
+            messages.success(request, f'Bienvenido, {user_to_auth.first_name}!')
+            return redirect('dashboard')
 
         messages.error(request, 'Credenciales inválidas.')
         return render(request, 'login_page.html')
@@ -133,20 +125,30 @@ def register_usuario(request):
         run = request.POST.get('run')
         password = request.POST.get('password')
         
-        if User.objects.filter(Q(email__iexact=email) | Q(run__iexact=run)).exists():
+        # Email y RUN se guardan normalizados: se comparan en la misma forma
+        existentes = Q(email=email_canonico(email))
+        if run_canonico(run):
+            existentes |= Q(run=run_canonico(run))
+        if User.objects.filter(existentes).exists():
             messages.error(request, 'El email o RUN ya están registrados.')
             return render(request, 'register_usuario.html')
 
-        user = User.objects.create_user(
-            username=email, # Usamos email como username para login
-            email=email,
-            password=password,
-            first_name=request.POST.get('nombre', ''),
-            last_name=request.POST.get('apellido', ''),
-            run=run,
-            telefono=request.POST.get('telefono', ''),
-            rol=User.ROL_PACIENTE
-        )
+        try:
+            # Si otro registro con el mismo email o RUN se confirma entre la revisión y el INSERT
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    username=email, # Usamos email como username para login
+                    email=email,
+                    password=password,
+                    first_name=request.POST.get('nombre', ''),
+                    last_name=request.POST.get('apellido', ''),
+                    run=run,
+                    telefono=request.POST.get('telefono', ''),
+                    rol=User.ROL_PACIENTE
+                )
+        except IntegrityError:
+            messages.error(request, 'El email o RUN ya están registrados.')
+            return render(request, 'register_usuario.html')
         login(request, user)
         messages.success(request, f'Bienvenido, {user.first_name}! Tu cuenta ha sido creada.')
         return redirect('dashboard')
@@ -158,7 +160,7 @@ def register_profesional(request):
     # Vista simplificada. En un caso real, un admin debería crear profesionales.
     if request.method == 'POST':
         email = request.POST.get('email')
-        if User.objects.filter(email__iexact=email).exists():
+        if User.objects.filter(email=email_canonico(email)).exists():
             messages.error(request, 'El email ya está registrado.')
             return render(request, 'register_profesional.html')
 
@@ -241,6 +243,67 @@ def mensajeria(request):
     """
     return render(request, 'mensajeria.html', {'current_user_id': request.user.id})
 
+@login_required(login_url='login_page')
+async def mensajeria_eventos(request):
+    """
+    Flujo Server-Sent Events con los mensajes nuevos y las lecturas de las
+    conversaciones del usuario (ver `cesfamApp.tiempo_real`). Necesita que el
+    proyecto se sirva con ASGI; bajo WSGI responde 501 y el cliente vuelve a
+    consultar periódicamente.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('La mensajería en tiempo real requiere un servidor ASGI.', status=501)
+    user = await request.auser()
+    response = StreamingHttpResponse(
+        tiempo_real.flujo_eventos(user.pk, tiempo_real.ultimo_id_solicitado(request)),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: no acumular el flujo
+    return response
+
+# Segundos que espera el long-poll de notificaciones antes de responder vacío
+ESPERA_NOTIFICACIONES = 25
+
+@login_required(login_url='login_page')
+async def notificaciones_eventos(request):
+    """
+    Flujo Server-Sent Events con las notificaciones nuevas del usuario.
+    Reanuda desde `Last-Event-ID` (o `?last_id=`). Requiere ASGI, igual que
+    `mensajeria_eventos`; sin él el cliente usa `notificaciones_nuevas`.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('Las notificaciones en tiempo real requieren un servidor ASGI.', status=501)
+    user = await request.auser()
+    response = StreamingHttpResponse(
+        tiempo_real.flujo_eventos(
+            user.pk, tiempo_real.ultimo_id_solicitado(request),
+            canal=tiempo_real.canal_notificaciones, pendientes=tiempo_real.notificaciones_pendientes,
+        ),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required(login_url='login_page')
+async def notificaciones_nuevas(request):
+    """
+    Long-poll de notificaciones para clientes que no mantienen una conexión
+    abierta: devuelve las posteriores a `?last_id=` que no estén en `?vistos=`
+    (ver `cesfamApp.tiempo_real`) o espera hasta
+    `ESPERA_NOTIFICACIONES` segundos a que llegue una. Bajo WSGI no espera
+    (bloquearía un worker) y `espera` vale 0 para que el cliente espacie las consultas.
+    """
+    user = await request.auser()
+    espera = ESPERA_NOTIFICACIONES if isinstance(request, ASGIRequest) else 0
+    eventos = await tiempo_real.esperar_pendientes(
+        user.pk, tiempo_real.ultimo_id_solicitado(request) or 0,
+        tiempo_real.canal_notificaciones, tiempo_real.notificaciones_pendientes, espera,
+        tiempo_real.ids_vistos(request),
+    )
+    return JsonResponse({'notificaciones': [evento['data'] for evento in eventos], 'espera': espera})
+
 # TODO: Las siguientes vistas dependen de modelos que no existen (HistorialMedico, Feedback)
 # o necesitan una refactorización más profunda.
 
@@ -351,9 +414,72 @@ def gestionar_servicios(request):
 
 @admin_required
 def dashboard_metricas(request):
-    # Esta vista necesita revisión para ajustarse a los nuevos modelos
-    messages.info(request, 'Las métricas están siendo actualizadas al nuevo sistema.')
-    return render(request, 'dashboard_metricas.html', {})
+    return render(request, 'dashboard_metricas.html', metricas.contexto_metricas())
+
+@admin_required
+def estadisticas_cache_json(request):
+    """Aciertos y fallos del caché de disponibilidad, para revisar su efectividad en producción."""
+    return JsonResponse(cache_disponibilidad.estadisticas())
+
+@solo_admin_required
+@require_POST
+def importar_citas(request):
+    """
+    Importa citas desde un CSV o NDJSON, subido como `archivo` (multipart) o
+    enviado directamente en el cuerpo (text/csv o application/x-ndjson).
+    Devuelve el resumen y las filas rechazadas con su motivo.
+    """
+    archivo = request.FILES.get('archivo')
+    if archivo:
+        formato = request.GET.get('formato') or importacion.detectar_formato(archivo.name, archivo.content_type)
+        lineas = codecs.iterdecode(archivo, 'utf-8')
+    else:
+        formato = request.GET.get('formato') or importacion.detectar_formato('', request.content_type)
+        lineas = codecs.iterdecode(request, 'utf-8')
+    if formato not in importacion.FORMATOS:
+        return JsonResponse({'error': f'Formato no soportado: {formato}.'}, status=400)
+
+    rechazos = []
+    try:
+        resultado = importacion.importar_citas(
+            importacion.leer_filas(lineas, formato),
+            rechazar=lambda numero, fila, motivo: rechazos.append({'linea': numero, 'motivo': motivo, 'fila': fila}),
+        )
+    except UnicodeDecodeError:
+        return JsonResponse({'error': 'El archivo debe estar codificado en UTF-8.'}, status=400)
+    return JsonResponse({**resultado, 'rechazos': rechazos})
+
+@solo_admin_required
+def exportar_citas(request):
+    """
+    Exporta citas en streaming como CSV (por defecto) o NDJSON (`?formato=ndjson`).
+    Filtros opcionales: `desde` y `hasta` (AAAA-MM-DD, inclusivos), `profesional` y `cesfam`.
+    """
+    formato = request.GET.get('formato', 'csv')
+    if formato not in importacion.FORMATOS:
+        return JsonResponse({'error': f'Formato no soportado: {formato}.'}, status=400)
+    fechas = {}
+    for parametro in ('desde', 'hasta'):
+        valor = request.GET.get(parametro)
+        fechas[parametro] = parse_date(valor) if valor else None
+        if valor and fechas[parametro] is None:
+            return JsonResponse({'error': f'Fecha inválida en "{parametro}". Usa el formato AAAA-MM-DD.'}, status=400)
+    for parametro in ('profesional', 'cesfam'):
+        valor = request.GET.get(parametro)
+        if valor and not valor.isdigit():
+            return JsonResponse({'error': f'"{parametro}" debe ser un ID numérico.'}, status=400)
+
+    citas = exportacion.filtrar_citas(
+        profesional_id=request.GET.get('profesional'),
+        cesfam_id=request.GET.get('cesfam'),
+        **fechas,
+    )
+    if formato == 'ndjson':
+        response = StreamingHttpResponse(exportacion.lineas_ndjson(citas), content_type='application/x-ndjson')
+    else:
+        response = StreamingHttpResponse(exportacion.lineas_csv(citas), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="citas.{formato}"'
+    return response
 
 @admin_required
 def supervisar_agendas(request):
@@ -367,6 +493,7 @@ def supervisar_agendas(request):
         'profesionales': profesionales,
         'horarios': horarios,
         'profesional_id': profesional_id,
+        'cesfams': Cesfam.objects.order_by('nombre'),
     })
 
 
@@ -382,25 +509,81 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all().order_by('-date_joined')
     serializer_class = UserSerializer
 
-class CesfamViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def search(self, request):
+        """
+        Typeahead over the user directory (see cesfamApp.directorio):
+        `?q=<text>&rol=<rol>&limit=<n>`. Only searches the roles the current
+        user may see, never returns the user themselves and answers with a
+        compact list. RUN is only searchable and returned for the health team.
+        """
+        roles, tipos = directorio.alcance(request.user)
+        if request.query_params.get('rol'):
+            roles &= set(request.query_params.getlist('rol'))
+        try:
+            limite = int(request.query_params.get('limit', directorio.LIMITE_POR_DEFECTO))
+        except ValueError:
+            return Response({'detail': 'El parámetro "limit" debe ser un número.'}, status=status.HTTP_400_BAD_REQUEST)
+        con_run = TerminoDirectorio.RUN in tipos
+        usuarios = directorio.buscar(
+            request.query_params.get('q', ''), roles, tipos, limite=limite, excluir=request.user.pk,
+        ).values_list('id', 'first_name', 'last_name', 'username', 'rol', 'run')
+        return Response([
+            {'id': pk, 'nombre': f'{nombre} {apellido}'.strip() or username, 'rol': rol, **({'run': run} if con_run else {})}
+            for pk, nombre, apellido, username, rol, run in usuarios
+        ])
+
+class CatalogoCondicionalMixin:
+    """
+    GET condicional para las tablas del catálogo: `list` y `retrieve` llevan
+    ETag y Last-Modified según `catalogo_versiones` (ver cesfamApp.catalogo)
+    y responden 304 sin tocar la base si el cliente ya tiene esa versión.
+    """
+    catalogo_versiones = ()
+
+    def _condicional(self, request, generar):
+        # El formato entra al ETag: la API navegable y el JSON son representaciones distintas
+        return catalogo.responder_condicional(
+            request, self.catalogo_versiones, generar, variante=request.accepted_renderer.format,
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self._condicional(request, lambda: super(CatalogoCondicionalMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._condicional(request, lambda: super(CatalogoCondicionalMixin, self).retrieve(request, *args, **kwargs))
+
+class CesfamViewSet(CatalogoCondicionalMixin, viewsets.ModelViewSet):
     queryset = Cesfam.objects.all()
     serializer_class = CesfamSerializer
+    catalogo_versiones = (catalogo.CESFAM,)
 
 class CitaViewSet(viewsets.ModelViewSet):
-    queryset = Cita.objects.all()
+    # Filtrable por profesional, paciente, servicio, CESFAM y rango de fechas (ver cesfamApp.filters)
+    queryset = Cita.objects.select_related('paciente', 'profesional', 'servicio', 'cesfam')
     serializer_class = CitaSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = CitaFilter
+    pagination_class = CitaPagination
+    # Lista las citas de todos los pacientes: solo para el equipo de salud
+    permission_classes = [EsEquipoSalud]
 
-class ServicioViewSet(viewsets.ModelViewSet):
+class ServicioViewSet(CatalogoCondicionalMixin, viewsets.ModelViewSet):
     queryset = Servicio.objects.all()
     serializer_class = ServicioSerializer
+    catalogo_versiones = (catalogo.SERVICIOS,)
 
 class AnuncioViewSet(viewsets.ModelViewSet):
     queryset = Anuncio.objects.all()
     serializer_class = AnuncioSerializer
 
-class HorarioViewSet(viewsets.ModelViewSet):
-    queryset = Horario.objects.all()
+class HorarioViewSet(CatalogoCondicionalMixin, viewsets.ModelViewSet):
+    queryset = Horario.objects.select_related('profesional').order_by('profesional_id', 'dia', 'hora_inicio', 'id')
     serializer_class = HorarioSerializer
+    catalogo_versiones = (catalogo.HORARIOS,)
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = HorarioFilter
+    pagination_class = HorarioPagination
 
 class NotificacionViewSet(viewsets.ModelViewSet):
     queryset = Notificacion.objects.all()
@@ -420,22 +603,82 @@ class ConversationViewSet(viewsets.ModelViewSet):
     """
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ConversationPagination
 
     def get_queryset(self):
-        # Only return conversations that the current user is a participant of
-        return Conversation.objects.filter(participants=self.request.user).order_by('-updated_at')
+        # Only return conversations that the current user is a participant of.
+        conversations = Conversation.objects.filter(participants=self.request.user)
+        if self.action == 'mark_as_read':
+            # Nothing is serialized, so skip the prefetches below
+            return conversations
+        # Everything the serializer nests is prefetched, so the number of queries
+        # does not grow with the number of conversations, messages or readers.
+        return conversations.select_related(
+            'cita__paciente', 'cita__profesional'
+        ).prefetch_related(
+            'participants',
+            Prefetch('read_marks', queryset=ConversationRead.objects.select_related('user')),
+            Prefetch('messages', queryset=Message.objects.select_related('sender').order_by('timestamp')),
+        ).order_by('-updated_at')
+
+    def get_summary_queryset(self):
+        """
+        Conversations of the current user annotated with what the list needs:
+        the other participant, the latest message and how many messages from
+        others the user has not read. Everything is a correlated subquery, so
+        the whole page is a single SQL query however long the histories are.
+        """
+        user = self.request.user
+        others = User.objects.filter(conversations=OuterRef('pk')).exclude(pk=user.pk).order_by('pk')
+        latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-timestamp', '-id')
+        participants = Conversation.participants.through.objects.filter(
+            conversation=OuterRef('pk')
+        ).order_by().values('conversation').annotate(total=Count('pk')).values('total')
+        return Conversation.objects.filter(participants=user).annotate(
+            participant_count=Coalesce(Subquery(participants, output_field=IntegerField()), 0),
+            other_id=Subquery(others.values('pk')[:1]),
+            other_username=Subquery(others.values('username')[:1]),
+            other_first_name=Subquery(others.values('first_name')[:1]),
+            other_rol=Subquery(others.values('rol')[:1]),
+            last_message_id=Subquery(latest.values('pk')[:1]),
+            last_message_sender_id=Subquery(latest.values('sender_id')[:1]),
+            last_message_content=Subquery(latest.values('content')[:1]),
+            last_message_timestamp=Subquery(latest.values('timestamp')[:1]),
+            unread_count=lecturas.no_leidos(user),
+        ).only('id', 'topic', 'updated_at')
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """Lightweight conversation list: other participant, last message and unread count."""
+        page = self.paginate_queryset(self.get_summary_queryset())
+        serializer = ConversationSummarySerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     def perform_create(self, serializer):
         # When creating a conversation, ensure the requesting user is a participant
         instance = serializer.save()
         instance.participants.add(self.request.user)
-        instance.is_read_by.add(self.request.user) # Mark as read by creator
+        lecturas.avanzar(instance.pk, self.request.user.pk, 0, avisar=False) # Mark as read by creator
 
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
+        """
+        Marks the conversation and every message in it as read by the current
+        user by moving their read watermark. With `up_to` (a message id) only
+        messages up to that id are marked, so a client does not acknowledge
+        messages it has not shown yet. Answers how many messages from others
+        became read.
+        """
+        up_to = request.data.get('up_to', request.query_params.get('up_to'))
+        if up_to is not None:
+            try:
+                up_to = int(up_to)
+            except (TypeError, ValueError):
+                return Response({'detail': '"up_to" must be a message id.'}, status=status.HTTP_400_BAD_REQUEST)
+
         conversation = self.get_object()
-        conversation.is_read_by.add(request.user)
-        return Response({'status': 'conversation marked as read'}, status=status.HTTP_200_OK)
+        marked = lecturas.marcar_conversacion(conversation, request.user, up_to)
+        return Response({'status': 'conversation marked as read', 'marked': marked}, status=status.HTTP_200_OK)
 
 class MessageViewSet(viewsets.ModelViewSet):
     """
@@ -444,65 +687,76 @@ class MessageViewSet(viewsets.ModelViewSet):
     """
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = MessagePagination
 
     def get_queryset(self):
         # Only return messages for conversations the current user is a participant of
         # Filter by conversation if 'conversation_pk' is provided in the URL
+        messages = Message.objects.filter(conversation__participants=self.request.user)
+        if self.action != 'mark_as_read':
+            # `read_by` is derived from the conversation's read watermarks
+            messages = messages.select_related('sender', 'conversation').prefetch_related(
+                Prefetch('conversation__read_marks', queryset=ConversationRead.objects.select_related('user')),
+            )
+        messages = messages.order_by('timestamp')
         if 'conversation_pk' in self.kwargs:
-            return Message.objects.filter(
-                conversation__pk=self.kwargs['conversation_pk'],
-                conversation__participants=self.request.user
-            ).order_by('timestamp')
-        
-        # Otherwise, return all messages from conversations the user is in
-        return Message.objects.filter(conversation__participants=self.request.user).order_by('timestamp')
+            return messages.filter(conversation__pk=self.kwargs['conversation_pk'])
 
-    def perform_create(self, serializer):
-        conversation = serializer.validated_data['conversation']
-        # Asegura que el usuario autenticado es participante
-        if self.request.user not in conversation.participants.all():
-            conversation.participants.add(self.request.user)
-        message = serializer.save(sender=self.request.user)
-        # Actualiza la fecha de la conversación
-        conversation.updated_at = message.timestamp
-        conversation.save()
-        # Marca como leído por el remitente
-        conversation.is_read_by.add(self.request.user)
-        # Limpia el estado de leído para otros participantes
-        conversation.is_read_by.remove(*[p for p in conversation.participants.all() if p != self.request.user])
+        # Otherwise, return all messages from conversations the user is in
+        return messages
 
     @action(detail=True, methods=['post'])
-    def mark_as_read(self, request, pk=None):
+    def mark_as_read(self, request, pk=None, conversation_pk=None):
+        # get_queryset only returns messages of the user's conversations, so get_object already checks membership
         message = self.get_object()
-        if request.user in message.conversation.participants.all():
-            message.read_by.add(request.user)
-            return Response({'status': 'message marked as read'}, status=status.HTTP_200_OK)
-        return Response({'detail': 'User is not a participant of this conversation.'}, status=status.HTTP_403_FORBIDDEN)
+        # The watermark also covers every earlier message of the conversation
+        lecturas.avanzar(message.conversation_id, request.user.pk, message.pk)
+        return Response({'status': 'message marked as read'}, status=status.HTTP_200_OK)
 
     def create(self, request, *args, **kwargs):
         # Si el endpoint es anidado, obtiene conversation_pk de la URL
         conversation_pk = kwargs.get('conversation_pk')
-        data = request.data.copy()
-        if conversation_pk and not data.get('conversation'):
-            data['conversation'] = conversation_pk
-        serializer = self.get_serializer(data=data)
+        data = {'conversation': conversation_pk or request.data.get('conversation'), 'content': request.data.get('content')}
+        serializer = SendMessageSerializer(data=data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        try:
+            message = envios.enviar_mensaje(
+                serializer.validated_data['conversation'], request.user, serializer.validated_data['content'],
+            )
+        except envios.NoEsParticipante:
+            raise PermissionDenied('User is not a participant of this conversation.')
+        return Response(self.get_serializer(message).data, status=status.HTTP_201_CREATED)
 
 # ==============================================================================
 # FLUJO DE AGENDAMIENTO DE CITAS
 # ==============================================================================
 
+# Cantidad de horas que muestra la búsqueda de "primera hora disponible"
+PRIMERAS_HORAS_POR_DEFECTO = 10
+PRIMERAS_HORAS_MAXIMO = 50
+
 @paciente_required
 def agendar_cita_paso1(request):
     """Paso 1: Muestra los servicios disponibles para agendar."""
-    servicios = Servicio.objects.all()
-    context = {
-        'servicios': servicios
-    }
-    return render(request, 'agendamiento/paso1_servicio.html', context)
+    def generar():
+        servicios = Servicio.objects.all()
+        context = {
+            'servicios': servicios
+        }
+        return render(request, 'agendamiento/paso1_servicio.html', context)
+
+    # La página también muestra al usuario en la barra de navegación y el año en el pie,
+    # así que entran al ETag y no se envía Last-Modified
+    usuario = request.user
+    variante = hashlib.sha1(repr((
+        usuario.pk, usuario.username, usuario.first_name, usuario.rol, usuario.is_staff, timezone.localdate().year,
+    )).encode()).hexdigest()[:16]
+    respuesta = catalogo.responder_condicional(
+        request, (catalogo.SERVICIOS,), generar, variante=variante, last_modified=False,
+    )
+    # La respuesta es propia de cada usuario: ningún caché compartido debe guardarla
+    patch_cache_control(respuesta, private=True)
+    return respuesta
 
 @paciente_required
 def agendar_cita_paso2(request, servicio_id):
@@ -521,6 +775,54 @@ def agendar_cita_paso2(request, servicio_id):
     }
     return render(request, 'agendamiento/paso2_profesional.html', context)
 
+def _primeras_horas_servicio(servicio, cantidad):
+    """Devuelve `(inicio, profesional)` para las primeras horas libres de un servicio."""
+    profesionales = {p.id: p for p in servicio.profesionales.filter(rol=User.ROL_PROFESIONAL)}
+    if not profesionales:
+        return []
+    return [
+        (inicio, profesionales[profesional_id])
+        for inicio, profesional_id in agenda.primeros_disponibles(list(profesionales), cantidad)
+    ]
+
+@paciente_required
+def agendar_primeras_horas(request, servicio_id):
+    """Paso 2 alternativo: Muestra las primeras horas libres entre todos los profesionales del servicio."""
+    try:
+        servicio = Servicio.objects.get(pk=servicio_id)
+    except Servicio.DoesNotExist:
+        messages.error(request, 'El servicio seleccionado no existe.')
+        return redirect('agendar_cita_paso1')
+
+    context = {
+        'servicio': servicio,
+        'primeras_horas': _primeras_horas_servicio(servicio, PRIMERAS_HORAS_POR_DEFECTO),
+    }
+    return render(request, 'agendamiento/paso2_primeras_horas.html', context)
+
+@login_required(login_url='login_page')
+def primeras_horas_json(request, servicio_id):
+    try:
+        servicio = Servicio.objects.get(pk=servicio_id)
+    except Servicio.DoesNotExist:
+        return JsonResponse({'error': 'Servicio not found'}, status=404)
+
+    try:
+        cantidad = int(request.GET.get('n', PRIMERAS_HORAS_POR_DEFECTO))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid n parameter'}, status=400)
+    cantidad = max(1, min(cantidad, PRIMERAS_HORAS_MAXIMO))
+
+    return JsonResponse([
+        {
+            'profesional_id': profesional.id,
+            'profesional': profesional.get_full_name(),
+            'start': inicio.isoformat(),
+            'end': (inicio + disponibilidad.DURACION_CITA).isoformat(),
+        }
+        for inicio, profesional in _primeras_horas_servicio(servicio, cantidad)
+    ], safe=False)
+
 @paciente_required
 def agendar_cita_paso3(request, profesional_id, servicio_id):
     """Paso 3: Muestra los horarios disponibles para un profesional."""
@@ -532,44 +834,11 @@ def agendar_cita_paso3(request, profesional_id, servicio_id):
         return redirect('agendar_cita_paso1')
 
     # --- Lógica para calcular horarios disponibles ---
-    horarios_disponibles = []
-    duracion_cita_minutos = 30  # Asumimos que cada cita dura 30 minutos
-    dias_a_mostrar = 14  # Mostramos disponibilidad para las próximas 2 semanas
-
-    # 1. Obtener horarios y citas existentes del profesional
-    horarios_profesional = Horario.objects.filter(profesional=profesional, bloqueado=False)
-    citas_futuras = Cita.objects.filter(
-        profesional=profesional,
-        fecha_hora__gte=timezone.now()
-    ).values_list('fecha_hora', flat=True)
-
-    # Convertir los horarios del profesional a un diccionario para acceso rápido.
-    # La clave es el número del día de la semana (0=Lunes), que ahora coincide con el modelo.
-    horarios_dict = {h.dia: (h.hora_inicio, h.hora_fin) for h in horarios_profesional}
-
-    # 2. Iterar sobre los próximos días y generar bloques de tiempo disponibles
-    start_date = timezone.now().date()
-    for i in range(dias_a_mostrar):
-        current_date = start_date + timedelta(days=i)
-        weekday = current_date.weekday() # Esto devuelve 0 para Lunes, 1 para Martes, etc.
-
-        # Si el profesional trabaja ese día de la semana
-        if weekday in horarios_dict:
-            hora_inicio, hora_fin = horarios_dict[weekday]
-            
-            # Combinar la fecha actual con la hora de inicio para crear un objeto datetime
-            current_slot = datetime.combine(current_date, hora_inicio, tzinfo=timezone.get_current_timezone())
-            hora_fin_dt = datetime.combine(current_date, hora_fin, tzinfo=timezone.get_current_timezone())
-
-            # Generar todos los posibles slots dentro del horario laboral
-            while current_slot < hora_fin_dt:
-                # 3. Verificar si el bloque es válido (es en el futuro y no está ya reservado)
-                if current_slot > timezone.now() and current_slot not in citas_futuras:
-                    horarios_disponibles.append(current_slot)
-                
-                # Avanzar al siguiente bloque de tiempo
-                current_slot += timedelta(minutes=duracion_cita_minutos)
-    
+    start_date = timezone.localdate()
+    horarios_disponibles = cache_disponibilidad.horarios_disponibles(
+        profesional, start_date, start_date + timedelta(days=disponibilidad.DIAS_A_MOSTRAR - 1)
+    )
+
     context = {
         'profesional': profesional,
         'servicio': servicio,
@@ -592,47 +861,31 @@ def crear_cita(request):
             messages.error(request, 'Información incompleta para agendar la cita.')
             return redirect('agendar_cita_paso1')
 
-        profesional = User.objects.get(pk=profesional_id, rol=User.ROL_PROFESIONAL)
-        servicio = Servicio.objects.get(pk=servicio_id)
-        paciente = request.user
-        
         # Convertir el string de fecha a un objeto datetime
         fecha_hora_cita = parse_datetime(fecha_hora_str)
         if not fecha_hora_cita:
             raise ValueError("Formato de fecha inválido.")
 
-        # --- Validación de Seguridad Crítica ---
-        # 1. ¿La hora de la cita ya pasó?
-        if fecha_hora_cita < timezone.now():
-            messages.error(request, 'No puedes agendar una cita en el pasado.')
-            return redirect('agendar_cita_paso1')
-
-        # 2. ¿Ya existe una cita en ese mismo bloque? (Prevención de race conditions)
-        if Cita.objects.filter(profesional=profesional, fecha_hora=fecha_hora_cita).exists():
-            messages.error(request, 'El horario seleccionado ya no está disponible. Por favor, elige otro.')
-            return redirect('agendar_cita_paso3', profesional_id=profesional.id, servicio_id=servicio.id)
-            
-        # 3. TODO: Podríamos añadir validación extra para asegurarse que el horario está dentro
+        # TODO: Podríamos añadir validación extra para asegurarse que el horario está dentro
         # del Horario laboral del profesional, pero por ahora confiamos en la lógica del paso 3.
 
         # --- Creación de la Cita ---
-        # Asumimos un solo CESFAM o el primero. Esto podría necesitar más lógica en una app real.
-        cesfam_instancia = Cesfam.objects.first()
-        if not cesfam_instancia:
-            messages.error(request, "No hay ningún CESFAM configurado en el sistema.")
-            return redirect('agendar_cita_paso1')
+        # Todo el flujo va en una transacción; la restricción única de Cita evita
+        # que dos pacientes tomen el mismo bloque al mismo tiempo.
+        with transaction.atomic():
+            profesional = User.objects.get(pk=profesional_id, rol=User.ROL_PROFESIONAL)
+            servicio = Servicio.objects.get(pk=servicio_id)
+            reservas.reservar_cita(request.user, profesional, servicio, fecha_hora_cita)
 
-        Cita.objects.create(
-            paciente=paciente,
-            profesional=profesional,
-            servicio=servicio,
-            fecha_hora=fecha_hora_cita,
-            cesfam=cesfam_instancia
-        )
-        
         messages.success(request, f'¡Tu cita para {servicio.nombre} ha sido agendada con éxito para el {fecha_hora_cita.strftime("%d/%m/%Y a las %H:%M")}!')
         return redirect('dashboard')
 
+    except reservas.HorarioNoDisponible as e:
+        messages.error(request, str(e))
+        return redirect('agendar_cita_paso3', profesional_id=profesional.id, servicio_id=servicio.id)
+    except reservas.ReservaError as e:
+        messages.error(request, str(e))
+        return redirect('agendar_cita_paso1')
     except (User.DoesNotExist, Servicio.DoesNotExist, ValueError) as e:
         messages.error(request, f'Ocurrió un error al procesar tu solicitud: {e}')
         return redirect('agendar_cita_paso1')
@@ -656,41 +909,17 @@ def profesional_horarios_json(request):
         end = parse_datetime(end_str)
     except (ValueError, TypeError):
         return JsonResponse({'error': 'Invalid date format'}, status=400)
+    if not start or not end:
+        return JsonResponse({'error': 'Invalid date format'}, status=400)
 
-    # Lógica para calcular horarios disponibles
-    horarios_disponibles = []
-    duracion_cita_minutos = 30 
-
-    horarios_profesional = Horario.objects.filter(profesional=profesional, bloqueado=False)
-    citas_futuras = Cita.objects.filter(
-        profesional=profesional,
-        fecha_hora__range=(start, end)
-    ).values_list('fecha_hora', flat=True)
-
-    horarios_dict = {h.dia: (h.hora_inicio, h.hora_fin) for h in horarios_profesional}
-
-    current_date = start.date()
-    while current_date <= end.date():
-        weekday = current_date.weekday()
-
-        if weekday in horarios_dict:
-            hora_inicio, hora_fin = horarios_dict[weekday]
-            
-            current_slot = datetime.combine(current_date, hora_inicio, tzinfo=timezone.get_current_timezone())
-            hora_fin_dt = datetime.combine(current_date, hora_fin, tzinfo=timezone.get_current_timezone())
-
-            while current_slot < hora_fin_dt:
-                if current_slot > timezone.now() and current_slot not in citas_futuras:
-                    horarios_disponibles.append({
-                        'title': 'Disponible',
-                        'start': current_slot.isoformat(),
-                        'end': (current_slot + timedelta(minutes=duracion_cita_minutos)).isoformat(),
-                    })
-                
-                current_slot += timedelta(minutes=duracion_cita_minutos)
-        
-        current_date += timedelta(days=1)
-        
+    horarios_disponibles = [
+        {
+            'title': 'Disponible',
+            'start': slot.isoformat(),
+            'end': (slot + disponibilidad.DURACION_CITA).isoformat(),
+        }
+        for slot in cache_disponibilidad.horarios_disponibles(profesional, start.date(), end.date())
+    ]
     return JsonResponse(horarios_disponibles, safe=False)
 
 @login_required
@@ -700,13 +929,12 @@ def profesional_agendar(request):
     Página para que un profesional pueda agendar una cita para un paciente.
     """
     profesional = request.user
-    pacientes = User.objects.filter(rol=User.ROL_PACIENTE).order_by('first_name', 'last_name')
-    
+    # Los pacientes no se cargan aquí: el selector los busca en /api/users/search/
+
     # Usamos todos los servicios para dar flexibilidad, se podría limitar a `profesional.servicios_ofrecidos.all()`
     servicios = Servicio.objects.all()
 
     context = {
-        'pacientes': pacientes,
         'servicios': servicios,
         'profesional': profesional,
     }
@@ -732,51 +960,38 @@ def profesional_crear_cita(request):
             messages.error(request, 'Información incompleta. Debes seleccionar paciente, servicio y horario.')
             return redirect('profesional_agendar')
 
-        profesional = request.user
-        paciente = User.objects.get(pk=paciente_id, rol=User.ROL_PACIENTE)
-        servicio = Servicio.objects.get(pk=servicio_id)
-        
         fecha_hora_cita = parse_datetime(fecha_hora_str)
         if not fecha_hora_cita:
             raise ValueError("Formato de fecha inválido.")
 
-        if fecha_hora_cita < timezone.now():
-            messages.error(request, 'No puedes agendar una cita en el pasado.')
-            return redirect('profesional_agendar')
+        profesional = request.user
+        with transaction.atomic():
+            paciente = User.objects.get(pk=paciente_id, rol=User.ROL_PACIENTE)
+            servicio = Servicio.objects.get(pk=servicio_id)
 
-        if Cita.objects.filter(profesional=profesional, fecha_hora=fecha_hora_cita).exists():
-            messages.error(request, 'Ya tienes una cita en ese horario. Por favor, elige otro.')
-            return redirect('profesional_agendar')
-        
-        if Cita.objects.filter(paciente=paciente, fecha_hora=fecha_hora_cita).exists():
-            messages.warning(request, f'Advertencia: El paciente {paciente.first_name} ya tiene otra cita en ese mismo horario.')
+            nueva_cita = reservas.reservar_cita(
+                paciente, profesional, servicio, fecha_hora_cita,
+                mensaje_ocupado='Ya tienes una cita en ese horario. Por favor, elige otro.'
+            )
 
-        cesfam_instancia = Cesfam.objects.first()
-        if not cesfam_instancia:
-            messages.error(request, "No hay ningún CESFAM configurado en el sistema.")
-            return redirect('profesional_agendar')
+            if Cita.objects.filter(paciente=paciente, fecha_hora=fecha_hora_cita).exclude(pk=nueva_cita.pk).exists():
+                messages.warning(request, f'Advertencia: El paciente {paciente.first_name} ya tiene otra cita en ese mismo horario.')
+
+            # Crear notificación para el paciente
+            Notificacion.objects.create(
+                destinatario=paciente,
+                mensaje=f'El profesional {profesional.get_full_name()} te ha agendado una cita para el {fecha_hora_cita.strftime("%d/%m a las %H:%Mh")}.'
+            )
 
-        # Crear la cita
-        nueva_cita = Cita.objects.create(
-            paciente=paciente,
-            profesional=profesional,
-            servicio=servicio,
-            fecha_hora=fecha_hora_cita,
-            cesfam=cesfam_instancia
-        )
-        
-        # Crear notificación para el paciente
-        Notificacion.objects.create(
-            destinatario=paciente,
-            mensaje=f'El profesional {profesional.get_full_name()} te ha agendado una cita para el {fecha_hora_cita.strftime("%d/%m a las %H:%Mh")}.'
-        )
-        
         messages.success(request, f'Cita para {paciente.get_full_name()} agendada con éxito.')
         return redirect('dashboard')
 
     except (User.DoesNotExist, Servicio.DoesNotExist):
         messages.error(request, 'El paciente o servicio seleccionado no es válido.')
         return redirect('profesional_agendar')
+    except reservas.ReservaError as e:
+        messages.error(request, str(e))
+        return redirect('profesional_agendar')
     except ValueError as e:
         messages.error(request, f'Ocurrió un error al procesar la fecha: {e}')
         return redirect('profesional_agendar')
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+from datetime import timedelta
 import dj_database_url
 from pathlib import Path
 
@@ -53,6 +54,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'cesfamApp',
     'rest_framework',
+    'django_filters',
 ]
 
 MIDDLEWARE = [
@@ -93,11 +95,40 @@ WSGI_APPLICATION = 'cesfamProyecto.wsgi.application'
 # La base de datos de desarrollo (MySQL) se mantiene, pero Render usará la DATABASE_URL.
 DATABASES = {
     'default': dj_database_url.config(
-        default='sqlite:///' + os.path.join(BASE_DIR, 'db.sqlite3')
+        default='sqlite:///' + os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Conexiones persistentes (segundos). 0 por defecto porque las vistas en tiempo real corren bajo ASGI;
+        # gunicorn.conf.py lo sube para los workers WSGI, que así reutilizan la conexión abierta al precalentar
+        conn_max_age=int(os.environ.get('DB_CONN_MAX_AGE', '0')),
+        conn_health_checks=True,
     )
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# Por defecto se usa un caché en memoria por proceso. Con DJANGO_CACHE_DIR se usa
+# un caché en archivos, compartido entre los workers de gunicorn; con más de un
+# worker es obligatorio (ver gunicorn.conf.py), porque las invalidaciones del
+# caché de disponibilidad se guardan en el mismo caché.
+if os.environ.get('DJANGO_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['DJANGO_CACHE_DIR'],
+            'OPTIONS': {'MAX_ENTRIES': 50000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'cesfam',
+            'OPTIONS': {'MAX_ENTRIES': 50000},
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -145,3 +176,27 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Configuración del modelo de usuario personalizado
 AUTH_USER_MODEL = 'cesfamApp.CustomUser'
+
+# Login por email o RUN (una consulta indexada); ModelBackend queda para el login por username
+AUTHENTICATION_BACKENDS = [
+    'cesfamApp.backends.EmailORunBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# API: JWT con los claims del usuario (sin consultar sesión ni usuario, ver cesfamApp.tokens),
+# sesión para el frontend web y Basic como hasta ahora
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'cesfamApp.tokens.JWTClaimsAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+}
+
+SIMPLE_JWT = {
+    # Un cambio de rol o una cuenta desactivada rigen desde el próximo refresh
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=int(os.environ.get('JWT_ACCESS_MINUTOS', '10'))),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=int(os.environ.get('JWT_REFRESH_DIAS', '7'))),
+    'TOKEN_OBTAIN_SERIALIZER': 'cesfamApp.tokens.ObtenerTokenSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'cesfamApp.tokens.RefrescarTokenSerializer',
+}
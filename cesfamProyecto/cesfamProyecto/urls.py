@@ -11,7 +11,6 @@ urlpatterns = [
     
     # Rutas principales de la aplicación
     path('', views.home, name='home'),
-    path('admin/', admin.site.urls),
     
     # Autenticación
     path('login/', views.login_page, name='login_page'), # Renombrada de login_view
@@ -28,10 +27,13 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('perfil/', views.profile_view, name='profile'),
     path('dashboard/metricas/', views.dashboard_metricas, name='dashboard_metricas'),
+    path('dashboard/metricas/cache/', views.estadisticas_cache_json, name='estadisticas_cache_json'),
 
     # Flujo de Agendamiento de Citas
     path('agendar/', views.agendar_cita_paso1, name='agendar_cita_paso1'),
     path('agendar/profesionales/<int:servicio_id>/', views.agendar_cita_paso2, name='agendar_cita_paso2'),
+    path('agendar/primeras-horas/<int:servicio_id>/', views.agendar_primeras_horas, name='agendar_primeras_horas'),
+    path('agendar/primeras-horas/<int:servicio_id>/json/', views.primeras_horas_json, name='primeras_horas_json'),
     path('agendar/horario/<int:profesional_id>/<int:servicio_id>/', views.agendar_cita_paso3, name='agendar_cita_paso3'),
     path('agendar/crear/', views.crear_cita, name='crear_cita'),
 
@@ -45,11 +47,16 @@ urlpatterns = [
     path('modal-test/', views.modal_test, name='modal_test'),
     path('citas/cancelar/', views.cancelar_cita, name='cancelar_cita'),
     path('citas/atendida/', views.marcar_atendida, name='marcar_atendida'),
+    path('citas/importar/', views.importar_citas, name='importar_citas'),
+    path('citas/exportar/', views.exportar_citas, name='exportar_citas'),
     path('ayuda/', views.ayuda, name='ayuda'),
     path('mensajes/', views.mensaje, name='mensaje'),
     path('mensajeria/', views.mensajeria, name='mensajeria'),
+    path('mensajeria/eventos/', views.mensajeria_eventos, name='mensajeria_eventos'),
     path('historial-medico/', views.historial_medico, name='historial_medico'), # Apunta a vista en construcción
     path('notificaciones/', views.notificacion, name='notificacion'),
+    path('notificaciones/eventos/', views.notificaciones_eventos, name='notificaciones_eventos'),
+    path('notificaciones/nuevas/', views.notificaciones_nuevas, name='notificaciones_nuevas'),
     path('horarios/', views.horario, name='horario'),
     path('feedback/', views.feedback, name='feedback'), # Apunta a vista en construcción
     
@@ -59,4 +66,8 @@ urlpatterns = [
     path('admin/profesionales/', views.gestionar_profesionales, name='gestionar_profesionales'),
     path('admin/agendas/', views.supervisar_agendas, name='supervisar_agendas'),
     path('admin/servicios/', views.gestionar_servicios, name='gestionar_servicios'),
+
+    # Al final: el admin de Django responde 404 a toda ruta bajo admin/ que no conoce,
+    # incluidas las vistas de administración de arriba
+    path('admin/', admin.site.urls),
 ]
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""
+Configuración de gunicorn (la lee sola si se inicia desde esta carpeta):
+    gunicorn cesfamProyecto.wsgi
+
+Cada worker se precalienta al iniciar (ver cesfamApp.precalentamiento) antes
+de recibir requests, así que las primeras después de un deploy o de un
+reciclaje del worker (`--max-requests`) no pagan la compilación de plantillas,
+el armado del resolver de URLs ni los misses del caché. Si el precalentamiento
+falla (por ejemplo, la base no responde) se registra el error y el worker
+arranca frío igual.
+
+Con más de un worker el caché de Django tiene que ser compartido
+(`DJANGO_CACHE_DIR`): las invalidaciones del caché de disponibilidad son
+versiones guardadas en el caché, y con el caché en memoria de cada proceso un
+worker no vería las de los demás. En ese caso gunicorn no arranca.
+"""
+import os
+
+# Sin esto la conexión abierta al precalentar se cierra al empezar la primera request
+os.environ.setdefault('DB_CONN_MAX_AGE', '60')
+
+
+def on_starting(server):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cesfamProyecto.settings')
+    from django.conf import settings
+
+    backend = settings.CACHES['default']['BACKEND']
+    if server.cfg.workers > 1 and backend == 'django.core.cache.backends.locmem.LocMemCache':
+        raise RuntimeError(
+            f'{server.cfg.workers} workers con el caché en memoria de cada proceso: los cambios de horarios y '
+            'citas no invalidarían el caché de los demás workers. Define DJANGO_CACHE_DIR (caché compartido) '
+            'o usa un solo worker.'
+        )
+
+
+def post_worker_init(worker):
+    from cesfamApp import precalentamiento
+
+    # La disponibilidad queda en el caché de este worker si no es compartido: se limita para no demorar el inicio
+    limite = int(os.environ.get('PRECALENTAR_PROFESIONALES', '200'))
+    try:
+        resultado = precalentamiento.precalentar(limite_profesionales=limite)
+    except Exception:
+        # Un worker que no arranca hace que gunicorn lo reinicie sin fin: mejor atender frío
+        worker.log.exception('No se pudo precalentar el worker; arranca sin precalentar')
+        return
+    worker.log.info('Worker precalentado en %.0f ms: %s', 1000 * sum(segundos for _, segundos in resultado.values()),
+                    ', '.join(f'{paso} {1000 * segundos:.0f} ms' for paso, (_, segundos) in resultado.items()))
+    for error in resultado['plantillas'][0][1]:
+        worker.log.warning('Plantilla con errores: %s', error)